@@ -49,19 +49,56 @@
 
 import getopt
 import ipaddress
+import os
+
+
+max_targets = 65536  # largest number of addresses a target specification may expand to (a /16 block)
 
 
 def print_usage():
     """Prints correct command line usage of the app"""
 
-    print("Usage: checkpot -t <target IP> <options>")
+    print("Usage: checkpot -t <target> <options>")
+    print("       checkpot -x <nmap XML report> <options>")
+    print("Targets: ")
+    print("\tan IPv4 address (e.g. 10.0.0.1), a CIDR block (e.g. 10.0.0.0/24), a range (e.g. 10.0.0.1-20"
+          " or 10.0.0.1-10.0.1.20), a comma separated list of these or a file containing one per line"
+          " (at most", max_targets, "addresses)")
     print("Options: ")
     print("\t-O / --os-scan -> fingerprint OS (requires sudo)")
     print("\t-l / --level= <level> -> maximum scanning level (1/2/3)")
     print("\t-p / --ports <port range> -> scan a specific range of ports (e.g. 20-100)."
           " For all ports use -p -")
+    print("\t-u / --udp <count> -> also look for the <count> most common UDP services (at most 13),"
+          " while the TCP scan is running")
     print("\t-f / --fast -> Uses -Pn and -T5 for faster scans on local connections")
+    print("\t-a / --adaptive -> measure the round trip time to the targets first and adapt nmap timing"
+          " and all timeouts to it")
     print("\t-b / --brief -> Disables NOT APPLICABLE tests for shorter output")
+    print("\t-g / --group <size> -> number of targets scanned by a single nmap run (default 64)")
+    print("\t-c / --chunk <size> -> scan the port range in chunks of <size> ports and start tests"
+          " while the scan is running (targets are scanned one by one)")
+    print("\t-k / --checkpoint -> save the progress of the scan after every chunk of ports and resume an"
+          " interrupted scan of the same targets with the same options")
+    print("\t-w / --sweep <window> -> find open ports with a fast TCP connect sweep keeping <window>"
+          " connections in flight, then identify services with nmap only on those (requires -p)")
+    print("\t-L / --rate-limit <rate> -> open at most <rate> new connections per second to each target"
+          " (also passed to nmap as --max-rate)")
+    print("\t-m / --max-connections <count> -> keep at most <count> connections open to each target"
+          " (default 8, also passed to nmap as --max-parallelism if -L or -m is given)")
+    print("\t-C / --cache <seconds> -> reuse the results of an identical scan made in the last <seconds>"
+          " instead of running nmap again")
+    print("\t-x / --from-xml <file> -> run the tests on the hosts of a saved nmap XML report (nmap -oX)"
+          " instead of scanning")
+    print("\t-r / --record <file> -> save every network interaction with the targets (including nmap reports)"
+          " to an archive")
+    print("\t-R / --replay <file> -> answer all network interactions from an archive saved with -r"
+          " instead of contacting the targets (use the same options as for the recording)")
+    print("\t-T / --time-limit <seconds> -> maximum time for testing each target, tests that did not"
+          " finish in time are reported as UNKNOWN")
+    print("\t-E / --test-time-limit <seconds> -> maximum time for each test, tests that take longer are"
+          " cancelled and reported as UNKNOWN")
+    print("\t-j / --jobs <count> -> run up to <count> tests at the same time (results are still shown in order)")
     print("\t-s / --show <c/w> -> Show copyright/warranty information")
 
 
@@ -78,12 +115,30 @@ def parse(argv):
         "scan_os": False,
         "scan_level": 5,
         "port_range": None,
+        "udp_ports": 0,
         "fast": False,
-        "brief": False
+        "adaptive": False,
+        "brief": False,
+        "targets": [],
+        "group_size": 64,
+        "chunk_size": None,
+        "checkpoint": False,
+        "sweep_window": None,
+        "rate_limit": None,
+        "max_connections": None,
+        "time_limit": None,
+        "test_time_limit": None,
+        "jobs": 1,
+        "cache_ttl": 0,
+        "from_xml": None,
+        "record": None,
+        "replay": None
     }
 
-    short_options = 't:l:Op:fbs:'
-    long_options = ['target=', 'level=', 'os-scan', 'ports', 'fast', 'brief', 'show=']
+    short_options = 't:l:Op:u:fabs:g:c:kw:L:m:T:E:j:C:x:r:R:'
+    long_options = ['target=', 'level=', 'os-scan', 'ports', 'udp=', 'fast', 'adaptive', 'brief', 'show=', 'group=',
+                    'chunk=', 'checkpoint', 'sweep=', 'rate-limit=', 'max-connections=', 'cache=', 'from-xml=',
+                    'record=', 'replay=', 'time-limit=', 'test-time-limit=', 'jobs=']
 
     try:
         options, values = getopt.getopt(argv[1:], short_options, long_options)
@@ -92,6 +147,125 @@ def parse(argv):
         print_usage()
         return None
 
+    try:
+        _read_options(options, parsed)
+    except ValueError as e:
+        # a numeric option got something else
+        print("Invalid option value:", e)
+        print_usage()
+        return None
+
+    # validate target IP
+    # TODO convert this to use exceptions if it gets too big
+
+    if parsed["record"] is not None and parsed["replay"] is not None:
+        print("Can not record and replay at the same time")
+        print_usage()
+        return None
+
+    if parsed["replay"] is not None and not os.path.isfile(parsed["replay"]):
+        print("Recording", parsed["replay"], "not found")
+        print_usage()
+        return None
+
+    if parsed["jobs"] < 1:
+        print("Number of concurrent tests must be a positive number")
+        print_usage()
+        return None
+
+    if parsed["from_xml"] is not None:
+
+        if not os.path.isfile(parsed["from_xml"]):
+            print("Report file", parsed["from_xml"], "not found")
+            print_usage()
+            return None
+
+        # the targets are the hosts found in the report
+        return parsed
+
+    if parsed["target"] is None:
+        print("No target specified. Use -t or -x")
+        print_usage()
+        return None
+
+    try:
+        parsed["targets"] = parse_targets(parsed["target"])
+    except ValueError as e:
+        # not a valid ip address, network, range or targets file
+        print("Invalid target:", e)
+        print_usage()
+        return None
+
+    if not parsed["targets"]:
+        print("No target addresses found in", parsed["target"])
+        print_usage()
+        return None
+
+    if parsed["rate_limit"] is not None and parsed["rate_limit"] <= 0:
+        print("Rate limit must be a positive number")
+        print_usage()
+        return None
+
+    if parsed["max_connections"] is not None and parsed["max_connections"] < 1:
+        print("Maximum number of connections must be a positive number")
+        print_usage()
+        return None
+
+    for limit in ("time_limit", "test_time_limit"):
+        if parsed[limit] is not None and parsed[limit] <= 0:
+            print("Time limits must be positive numbers")
+            print_usage()
+            return None
+
+    if parsed["cache_ttl"] < 0:
+        print("Cache time must not be negative")
+        print_usage()
+        return None
+
+    if parsed["udp_ports"] < 0:
+        print("Number of UDP services must not be negative")
+        print_usage()
+        return None
+
+    if parsed["group_size"] < 1:
+        print("Group size must be a positive number")
+        print_usage()
+        return None
+
+    if parsed["chunk_size"] is not None:
+
+        if parsed["chunk_size"] < 1:
+            print("Chunk size must be a positive number")
+            print_usage()
+            return None
+
+        # tests are run while each target is scanned
+        parsed["group_size"] = 1
+
+    if parsed["sweep_window"] is not None:
+
+        if parsed["sweep_window"] < 1:
+            print("Sweep window must be a positive number")
+            print_usage()
+            return None
+
+        if parsed["port_range"] is None:
+            print("A port range (-p) is required for the connect sweep")
+            print_usage()
+            return None
+
+    return parsed
+
+
+def _read_options(options, parsed):
+    """
+    Stores the values of the command line options in the options dict
+
+    :param options: list of (option, value) pairs from getopt
+    :param parsed: options dict, updated in place
+    :raises: ValueError if a numeric option has a value that is not a number
+    """
+
     for option, value in options:
 
         if option in ('-t', '--target'):
@@ -102,10 +276,40 @@ def parse(argv):
             parsed["scan_os"] = True
         elif option in ('-p', '--ports'):
             parsed["port_range"] = value
+        elif option in ('-u', '--udp'):
+            parsed["udp_ports"] = int(value)
         elif option in ('-f', '--fast'):
             parsed["fast"] = True
+        elif option in ('-a', '--adaptive'):
+            parsed["adaptive"] = True
         elif option in ('-b', '--brief'):
             parsed["brief"] = True
+        elif option in ('-g', '--group'):
+            parsed["group_size"] = int(value)
+        elif option in ('-c', '--chunk'):
+            parsed["chunk_size"] = int(value)
+        elif option in ('-k', '--checkpoint'):
+            parsed["checkpoint"] = True
+        elif option in ('-w', '--sweep'):
+            parsed["sweep_window"] = int(value)
+        elif option in ('-L', '--rate-limit'):
+            parsed["rate_limit"] = float(value)
+        elif option in ('-m', '--max-connections'):
+            parsed["max_connections"] = int(value)
+        elif option in ('-T', '--time-limit'):
+            parsed["time_limit"] = float(value)
+        elif option in ('-E', '--test-time-limit'):
+            parsed["test_time_limit"] = float(value)
+        elif option in ('-j', '--jobs'):
+            parsed["jobs"] = int(value)
+        elif option in ('-C', '--cache'):
+            parsed["cache_ttl"] = int(value)
+        elif option in ('-x', '--from-xml'):
+            parsed["from_xml"] = value
+        elif option in ('-r', '--record'):
+            parsed["record"] = value
+        elif option in ('-R', '--replay'):
+            parsed["replay"] = value
         elif option in ('-s', '--show'):
             if value == 'c':
                 print(
@@ -183,20 +387,104 @@ def parse(argv):
 
             exit(0)
 
-    # validate target IP
-    # TODO convert this to use exceptions if it gets too big
 
-    if parsed["target"] is None:
-        print("No target specified. Use -t")
-        print_usage()
-        return None
+def parse_targets(target):
+    """
+    Expands a target specification into a list of IP addresses
 
-    try:
-        ipaddress.ip_address(parsed["target"])
-    except ValueError:
-        # not a valid ip address
-        print("Target not a valid IP address")
-        print_usage()
-        return None
+    Accepts a single IP address, a CIDR block, a range (either 10.0.0.1-20 or 10.0.0.1-10.0.0.20),
+    a comma separated list of these or the path of a file holding one of these per line
+    (empty lines and lines starting with # are ignored).
 
-    return parsed
+    :param target: target specification string
+    :return: list of IP address strings without duplicates, in the order they were given
+    :raises: ValueError if any of the items is not valid, is not IPv4 or if there are more than max_targets addresses
+    """
+
+    if os.path.isfile(target):
+        with open(target) as f:
+            items = [line.split('#')[0].strip() for line in f]
+    else:
+        items = target.split(',')
+
+    targets = []
+    seen = set()
+
+    for item in items:
+
+        item = item.strip()
+
+        if not item:
+            continue
+
+        for address in _expand_target(item):
+            if address not in seen:
+                seen.add(address)
+                targets.append(address)
+
+        if len(targets) > max_targets:
+            raise ValueError("more than " + str(max_targets) + " target addresses")
+
+    return targets
+
+
+def _expand_target(item):
+    """
+    Expands one item of a target specification
+
+    :param item: IP address, CIDR block or range
+    :return: list of IP address strings
+    :raises: ValueError if the item is not valid, is not IPv4 or holds more than max_targets addresses
+    """
+
+    if '/' in item:
+        network = ipaddress.ip_network(item, strict=False)
+
+        _check_ipv4(network, item)
+
+        if network.num_addresses > max_targets:
+            raise ValueError("block " + item + " holds more than " + str(max_targets) + " addresses")
+
+        if network.num_addresses <= 2:
+            # /31 and /32 have no network/broadcast addresses to skip
+            return [str(address) for address in network]
+
+        return [str(address) for address in network.hosts()]
+
+    if '-' in item:
+        start, end = item.split('-', 1)
+        start = ipaddress.ip_address(start.strip())
+        end = end.strip()
+
+        if end.isdigit() and start.version == 4:
+            # short form, only the last octet is given for the end of the range
+            end = ipaddress.ip_address(str(start).rsplit('.', 1)[0] + '.' + end)
+        else:
+            end = ipaddress.ip_address(end)
+
+        _check_ipv4(start, item)
+        _check_ipv4(end, item)
+
+        if end < start:
+            raise ValueError("range " + item + " ends before it starts")
+
+        if int(end) - int(start) + 1 > max_targets:
+            raise ValueError("range " + item + " holds more than " + str(max_targets) + " addresses")
+
+        return [str(ipaddress.ip_address(a)) for a in range(int(start), int(end) + 1)]
+
+    address = ipaddress.ip_address(item)
+
+    _check_ipv4(address, item)
+
+    return [str(address)]
+
+
+def _check_ipv4(address, item):
+    """
+    :param address: IP address or network
+    :param item: target specification it comes from
+    :raises: ValueError for IPv6, the scan results only hold IPv4 addresses
+    """
+    if address.version != 4:
+        raise ValueError(item + " is not an IPv4 address, IPv6 targets are not supported")
@@ -51,10 +51,9 @@ import sys
 import os
 
 import argv_parser
-from honeypots.honeypot import Honeypot, ScanFailure
-from tests.test_platform import TestPlatform
 
-from tests import *
+# everything else is imported once the command line has been parsed, so --show and usage errors
+# return right away (the start-up time is checked by startup_test() in ci_automated_tests.py)
 
 
 def first_run():
@@ -87,6 +86,30 @@ def first_run():
         sys.exit(0)
 
 
+def get_test_list(registry, scan_level, scan_os):
+    """
+    Builds the list of tests for the requested scan level, only the modules of these tests are imported
+
+    :param registry: TestRegistry holding all available tests
+    :param scan_level: maximum scanning level
+    :param scan_os: OS information is available
+    :return: list of Test objects
+    """
+    return registry.create_tests(scan_level, scan_os)
+
+
+def get_required_scripts(registry, scan_level, scan_os):
+    """
+    Collects the nmap scripts needed by the tests of a scan level so they can be executed during the scan
+
+    :param registry: TestRegistry holding all available tests
+    :param scan_level: maximum scanning level
+    :param scan_os: OS information is available
+    :return: sorted list of script names
+    """
+    return sorted({script for spec in registry.select(scan_level, scan_os) for script in spec.nmap_scripts})
+
+
 def main(argv):
     """Entry point for the main application"""
 
@@ -105,64 +128,155 @@ def main(argv):
 
     first_run()
 
-    # run scan
-
-    print("Running scan on " + options["target"])
+    from honeypots.recorder import Recorder
+    from honeypots.limiter import TargetLimiter
+    from tests.registry import default_registry
 
-    hp = Honeypot(options["target"], options["scan_os"])
+    recorder = None
 
-    test_list = []
+    if options["record"] or options["replay"]:
+        try:
+            recorder = Recorder(options["record"] or options["replay"], replay=options["replay"] is not None)
+        except (OSError, ValueError) as e:
+            print("Could not load recording:", e)
+            sys.exit(2)
 
-    print("Scanning ports ...\n")
+    limiter = None
 
-    # collect data
+    if options["rate_limit"] or options["max_connections"]:
+        # the same limits for all targets and all ways of contacting them
+        limiter = TargetLimiter(rate=options["rate_limit"], max_connections=options["max_connections"] or 8)
 
     try:
-        if options["port_range"]:
-            hp.scan(port_range=options["port_range"], fast=options["fast"])  # TODO restrict access to this?
-        else:
-            hp.scan()
-    except ScanFailure as e:
-        print("Scan failed: " + str(e))
+        failed = check_targets(options, default_registry(), recorder, limiter)
+    finally:
+        if recorder is not None and not recorder.replaying:
+            recorder.save()
+            print("\nSaved", len(recorder), "network interactions to", recorder.path)
+
+    if failed:
         sys.exit(1)
 
-    # run tests
 
-    if options["scan_level"] > 0:
+def check_targets(options, registry, recorder=None, limiter=None):
+    """
+    Scans all targets requested on the command line and runs the tests on them
+
+    :param options: options dict returned by argv_parser.parse()
+    :param registry: TestRegistry holding all available tests
+    :param recorder: Recorder for all network interactions or None
+    :param limiter: TargetLimiter for all traffic sent to the targets or None
+    :return: True if any of the targets could not be checked
+    """
+    from honeypots.honeypot import Honeypot, ScanFailure
+    from tests.test_platform import TestPlatform
+
+    if options["from_xml"]:
 
-        test_list.append(direct_fingerprinting.DirectFingerprintTest())
+        # no scan, the data comes from a saved report
 
-        if options["scan_os"]:
-            test_list.append(direct_fingerprinting.OSServiceCombinationTest())
+        print("Loading scan from " + options["from_xml"] + "\n")
 
-        test_list.append(direct_fingerprinting.DefaultServiceCombinationTest())
-        test_list.append(direct_fingerprinting.DuplicateServicesCheck())
+        hp = Honeypot(None, options["scan_os"], recorder=recorder, limiter=limiter)
 
-    if options["scan_level"] > 1:
-        test_list.append(default_ftp.DefaultFTPBannerTest())
+        try:
+            hp.load_scan(options["from_xml"])
+        except ScanFailure as e:
+            print("Scan failed: " + str(e))
+            return True
 
-        test_list.append(service_implementation.HTTPTest())
-        test_list.append(default_http.DefaultWebsiteTest())
-        test_list.append(default_http.DefaultGlastopfWebsiteTest())
-        test_list.append(default_http.DefaultStylesheetTest())
-        test_list.append(default_http.CertificateValidationTest())
+        for view in hp.get_host_views():
 
-        test_list.append(default_imap.DefaultIMAPBannerTest())
+            if len(hp.hosts) > 1:
+                print("\nResults for " + view.host)
 
-        test_list.append(default_smtp.DefaultSMTPBannerTest())
-        test_list.append(service_implementation.SMTPTest())
+            tp = TestPlatform(get_test_list(registry, options["scan_level"], options["scan_os"]), view)
 
-        test_list.append(default_telnet.DefaultTelnetBannerTest())
-        test_list.append(old_version_bugs.KippoErrorMessageBugTest())
+            tp.run_tests(verbose=True, brief=options["brief"], time_limit=options["time_limit"],
+                         test_time_limit=options["test_time_limit"], workers=options["jobs"])
 
-        test_list.append(default_templates.DefaultTemplateFileTest())
+        return False
 
-    if options["scan_level"] > 2:
-        pass
+    targets = options["targets"]
+    group_size = options["group_size"]
+    scripts = get_required_scripts(registry, options["scan_level"], options["scan_os"])
+    failed = False
 
-    tp = TestPlatform(test_list, hp, )
+    for i in range(0, len(targets), group_size):
 
-    tp.run_tests(verbose=True, brief=options["brief"])
+        # scan a whole group of targets with a single nmap run
+
+        group = targets[i:i + group_size]
+
+        if len(group) == 1:
+            print("Running scan on " + group[0])
+            hp = Honeypot(group[0], options["scan_os"], scan_cache_ttl=options["cache_ttl"],
+                          recorder=recorder, limiter=limiter)
+        else:
+            print("Running scan on " + group[0] + " ... " + group[-1] + " (" + str(len(group)) + " targets)")
+            hp = Honeypot(group, options["scan_os"], scan_cache_ttl=options["cache_ttl"], recorder=recorder,
+                          limiter=limiter)
+
+        print("Scanning ports ...\n")
+
+        if options["chunk_size"]:
+
+            # collect data and run tests at the same time
+
+            tp = TestPlatform(get_test_list(registry, options["scan_level"], options["scan_os"]), hp)
+
+            try:
+                tp.run_tests_during_scan(lambda on_port: hp.scan(port_range=options["port_range"],
+                                                                 fast=options["fast"],
+                                                                 scripts=scripts,
+                                                                 on_port=on_port,
+                                                                 chunk_size=options["chunk_size"],
+                                                                 sweep_window=options["sweep_window"],
+                                                                 adaptive=options["adaptive"],
+                                                                 checkpoint=options["checkpoint"],
+                                                                 udp_ports=options["udp_ports"]),
+                                         verbose=True, brief=options["brief"], time_limit=options["time_limit"],
+                                         test_time_limit=options["test_time_limit"], workers=options["jobs"])
+            except ScanFailure as e:
+                print("Scan failed: " + str(e))
+                failed = True
+
+            continue
+
+        # collect data
+
+        try:
+            if options["port_range"]:
+                # TODO restrict access to this?
+                hp.scan(port_range=options["port_range"], fast=options["fast"], scripts=scripts,
+                        sweep_window=options["sweep_window"], adaptive=options["adaptive"],
+                        checkpoint=options["checkpoint"], udp_ports=options["udp_ports"])
+            else:
+                hp.scan(scripts=scripts, adaptive=options["adaptive"], checkpoint=options["checkpoint"],
+                        udp_ports=options["udp_ports"])
+        except ScanFailure as e:
+            print("Scan failed: " + str(e))
+            failed = True
+            continue
+
+        for address in group:
+            if address not in hp.hosts:
+                print("Scan failed: host " + address + " not available")
+                failed = True
+
+        # run tests
+
+        for view in hp.get_host_views():
+
+            if len(targets) > 1:
+                print("\nResults for " + view.host)
+
+            tp = TestPlatform(get_test_list(registry, options["scan_level"], options["scan_os"]), view)
+
+            tp.run_tests(verbose=True, brief=options["brief"], time_limit=options["time_limit"],
+                         test_time_limit=options["test_time_limit"], workers=options["jobs"])
+
+    return failed
 
 
 if __name__ == '__main__':
@@ -49,11 +49,18 @@
 
 import time
 import sys
+import json
+import os
+import io
+import contextlib
+import subprocess
+import shutil
+import tempfile
+import threading
 from termcolor import colored, cprint
 from datetime import timedelta
 
-from containers.manager import Manager
-from honeypots.honeypot import Honeypot
+from honeypots.honeypot import Honeypot, Probe, ScanFailure
 from tests.test import Test
 from tests.test import TestResult
 from tests.test_platform import TestPlatform
@@ -63,7 +70,61 @@ import argv_parser
 from tests import *
 
 
-manager = Manager(verbose=True, build_info=False)
+manager = None  # connected to Docker by get_manager() when the first container is needed
+
+startup_budget = 0.05  # seconds checkpot may take to import and parse the command line
+startup_forbidden = ['bs4', 'docker']  # modules that must not be imported before a test needs them
+
+# nmap -oX report of two hosts used by the offline tests, with progress output, OS detection and script output
+sample_report = b"""<?xml version="1.0" encoding="UTF-8"?>
+<nmaprun scanner="nmap" args="nmap -oX - -sV -O --script s7-info 10.0.0.1 10.0.0.2" start="1" version="7.80">
+<scaninfo type="syn" protocol="tcp" numservices="1000" services="1-1000"/>
+<taskprogress task="Service scan" time="2" percent="50.00" remaining="3" etc="5"/>
+<host starttime="1" endtime="2"><status state="up" reason="echo-reply" reason_ttl="63"/>
+<address addr="10.0.0.2" addrtype="ipv4"/>
+<address addr="02:42:AC:11:00:02" addrtype="mac" vendor="Siemens"/>
+<hostnames><hostname name="plc.example.com" type="PTR"/></hostnames>
+<ports><extraports state="closed" count="997"/>
+<port protocol="tcp" portid="80"><state state="open" reason="syn-ack" reason_ttl="63"/>\
+<service name="http" product="nginx" version="1.10.3" extrainfo="Ubuntu" method="probed" conf="10">\
+<cpe>cpe:/a:igor_sysoev:nginx:1.10.3</cpe></service></port>
+<port protocol="tcp" portid="102"><state state="open" reason="syn-ack" reason_ttl="63"/>\
+<service name="iso-tsap" product="Siemens S7 PLC" method="probed" conf="10"/>\
+<script id="s7-info" output="&#xa;  Module: 6ES7 315-2EH14-0AB0&#xa;  System Name: Technodrome"/></port>
+<port protocol="tcp" portid="8080"><state state="open" reason="syn-ack" reason_ttl="63"/>\
+<service name="http" product="nginx" version="1.10.3" extrainfo="Ubuntu" method="probed" conf="10"/></port>
+</ports>
+<os><osmatch name="Linux 3.2 - 4.9" accuracy="96" line="1">\
+<osclass type="general purpose" vendor="Linux" osfamily="Linux" osgen="3.X" accuracy="96">\
+<cpe>cpe:/o:linux:linux_kernel:3</cpe></osclass></osmatch></os>
+</host>
+<host starttime="1" endtime="2"><status state="up" reason="syn-ack" reason_ttl="0"/>
+<address addr="10.0.0.1" addrtype="ipv4"/>
+<hostnames/>
+<ports>
+<port protocol="tcp" portid="21"><state state="open" reason="syn-ack" reason_ttl="0"/>\
+<service name="ftp" product="Dionaea honeypot ftpd" method="probed" conf="10"/></port>
+<port protocol="udp" portid="161"><state state="open" reason="udp-response" reason_ttl="0"/>\
+<service name="snmp" product="net-snmp" method="probed" conf="10"/></port>
+</ports>
+</host>
+<runstats><finished time="2" timestr="Thu Jan  1 00:00:02 1970" elapsed="1.50" exit="success"/>\
+<hosts up="2" down="0" total="2"/></runstats>
+</nmaprun>
+"""
+
+
+def get_manager():
+    """
+    :return: the container Manager, the Docker SDK is only imported by the tests that start containers
+    """
+    global manager
+
+    if manager is None:
+        from containers.manager import Manager
+        manager = Manager(verbose=True, build_info=False)
+
+    return manager
 
 
 def honeypot_test(container_name, tests, port_range=None):
@@ -84,11 +145,11 @@ def honeypot_test(container_name, tests, port_range=None):
     assert all(isinstance(test, Test) for test in test_list)
     assert all(isinstance(result, TestResult) for result in expected_results)
 
-    manager.start_honeypot(container_name)
+    get_manager().start_honeypot(container_name)
 
     time.sleep(10)  # TODO wait for container to start, catch some sort of signal
 
-    hp = Honeypot(manager.get_honeypot_ip(container_name), scan_os=False, verbose_scan=False)
+    hp = Honeypot(get_manager().get_honeypot_ip(container_name), scan_os=False, verbose_scan=False)
 
     print(">", colored("Collecting data ...", color="yellow"))
     print("> Test", colored(container_name, color="yellow"), "started at:",
@@ -96,17 +157,19 @@ def honeypot_test(container_name, tests, port_range=None):
 
     start_time = time.time()
 
+    scripts = sorted({script for test in test_list for script in test.nmap_scripts})
+
     if port_range:
-        hp.scan(port_range)
+        hp.scan(port_range, scripts=scripts)
     else:
-        hp.scan()
+        hp.scan(scripts=scripts)
 
     print(">", colored("Running tests ...", color="yellow"))
     tp = TestPlatform(test_list, hp)
 
     tp.run_tests()
 
-    manager.stop_honeypot(container_name)
+    get_manager().stop_honeypot(container_name)
 
     for i, result in enumerate(tp.results):
 
@@ -127,6 +190,1270 @@ def honeypot_test(container_name, tests, port_range=None):
     print("Elapsed time =", colored(timedelta(seconds=end_time - start_time), color="blue"), "\n")
 
 
+def check(condition, *error):
+    """
+    Stops the tests with an error message if a condition does not hold
+
+    :param condition: boolean
+    :param error: description of the failure
+    """
+    if not condition:
+        print("ERROR:", *error)
+        sys.exit(1)
+
+
+@contextlib.contextmanager
+def loopback_server(handler):
+    """
+    Runs a TCP server on a free port of the loopback interface for the offline tests
+
+    :param handler: socketserver request handler class (e.g. a http.server.BaseHTTPRequestHandler)
+    :return: port number of the server, the server is shut down at the end of the with block
+    """
+    import socketserver
+
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+
+    try:
+        yield server.server_address[1]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def cache_test():
+    """Test the LRU and scan generation rules of the data cache"""
+    print("Testing data cache ...")
+
+    from honeypots.cache import DataCache
+
+    cache = DataCache(max_entries=3)
+
+    cache.store('banner', (21, 'tcp'), b'220 ftp')
+    cache.store('banner', (25, 'tcp'), b'220 smtp')
+    cache.store('websites', (80,), ['<html>'])
+
+    check(cache.get('banner', (21, 'tcp')) == b'220 ftp', "stored value not returned")
+    check(cache.get('banner', (23, 'tcp')) is None, "missing value returned")
+    check(cache.get('banner', (23, 'tcp'), 'default') == 'default', "default not returned on miss")
+    check(cache.stats('banner') == (1, 2), "hits and misses counted wrong:", cache.stats('banner'))
+
+    # (21, 'tcp') was used last, (25, 'tcp') is the least recently used entry
+    cache.store('css', (80,), [])
+    check(len(cache) == 3, "cache grew beyond max_entries")
+    check(not cache.contains('banner', (25, 'tcp')), "least recently used entry kept")
+    check(cache.contains('banner', (21, 'tcp')), "recently used entry dropped")
+
+    cache.store('banner', (21, 'tcp'), b'other', replace=False)
+    check(cache.get('banner', (21, 'tcp')) == b'220 ftp', "value replaced with replace=False")
+
+    cache.store('banner', (21, 'tcp'), b'other')
+    check(cache.get('banner', (21, 'tcp')) == b'other', "value not replaced")
+
+    check(cache.new_generation() == 1, "generation not advanced")
+    check(cache.get('banner', (21, 'tcp')) is None, "value of an older scan returned")
+    check(not cache.contains('css', (80,)), "value of an older scan reported")
+
+    cache.store('banner', (21, 'tcp'), b'new scan', replace=False)
+    check(cache.get('banner', (21, 'tcp')) == b'new scan', "value of an older scan blocked a new one")
+
+    print("OK")
+
+
+def parser_test():
+    """Test the streaming nmap XML parser with a report fed byte by byte and all at once"""
+    print("Testing nmap report parser ...")
+
+    from honeypots.nmap_runner import NmapXMLParser, NmapError, parse_nmap_xml
+
+    events = []
+    parser = NmapXMLParser(on_host=lambda host, record: events.append(('host', host)),
+                           on_port=lambda host, protocol, port, record: events.append(('port', host, protocol, port)),
+                           on_progress=lambda task, percent, remaining: events.append(('progress', task, percent)))
+
+    for position in range(len(sample_report)):
+        parser.feed(sample_report[position:position + 1])
+
+        # a host is reported as soon as its element is complete, not at the end of the report
+        if sample_report[:position + 1].endswith(b'</host>') and parser.hosts_found == 1:
+            check(('host', '10.0.0.2') in events, "host not reported when its element ended")
+
+    parser.close()
+
+    check(events == [('progress', 'Service scan', '50.00'),
+                     ('host', '10.0.0.2'), ('port', '10.0.0.2', 'tcp', 80), ('port', '10.0.0.2', 'tcp', 102),
+                     ('port', '10.0.0.2', 'tcp', 8080),
+                     ('host', '10.0.0.1'), ('port', '10.0.0.1', 'tcp', 21), ('port', '10.0.0.1', 'udp', 161)],
+          "callbacks not called in report order:", events)
+
+    result = parser.result
+
+    check(result.all_hosts() == ['10.0.0.1', '10.0.0.2'], "hosts not sorted by address:", result.all_hosts())
+    check(result.command_line.startswith('nmap -oX - -sV -O'), "command line not read")
+    check(result.stats == {'elapsed': '1.50', 'timestr': 'Thu Jan  1 00:00:02 1970'}, "run stats not read")
+
+    plc = result['10.0.0.2']
+
+    check(plc.addresses == {'ipv4': '10.0.0.2', 'mac': '02:42:AC:11:00:02'}, "addresses not read")
+    check(plc.vendor == {'02:42:AC:11:00:02': 'Siemens'}, "mac vendor not read")
+    check(plc.hostnames == [{'name': 'plc.example.com', 'type': 'PTR'}], "hostnames not read")
+    check(plc.status == {'state': 'up', 'reason': 'echo-reply'}, "host status not read")
+    check(plc.osmatch[0]['osclass'][0]['osfamily'] == 'Linux', "OS detection not read")
+
+    web = plc.port('tcp', 80)
+
+    check((web.state, web.name, web.product, web.version, web.extrainfo, web.cpe) ==
+          ('open', 'http', 'nginx', '1.10.3', 'Ubuntu', 'cpe:/a:igor_sysoev:nginx:1.10.3'), "port record wrong:", web)
+    check(web.description == 'nginx 1.10.3 Ubuntu', "description wrong:", web.description)
+    check(plc.port('tcp', 102).scripts == {'s7-info': '\n  Module: 6ES7 315-2EH14-0AB0\n  System Name: Technodrome'},
+          "script output not read")
+    check(plc.port('tcp', 443) is None and plc.port('udp', 80) is None, "port not in the report returned")
+
+    check(plc.services('tcp') == {'http': (80, 8080), 'iso-tsap': (102,)}, "service index wrong")
+    check(plc.products('tcp')['nginx'] == (80, 8080), "product index wrong")
+    check(plc.descriptions('tcp')['nginx 1.10.3 Ubuntu'] == (80, 8080), "description index wrong")
+    check(result['10.0.0.1'].services('udp') == {'snmp': (161,)}, "udp ports not indexed")
+    check(result['10.0.0.1'].osmatch is None, "OS match invented")
+
+    # the same report parsed at once gives the same records
+    whole = parse_nmap_xml(sample_report)
+
+    for host in result.all_hosts():
+        check(repr(sorted(whole[host].ports['tcp'].items())) == repr(sorted(result[host].ports['tcp'].items())),
+              "parsing at once and byte by byte differ for", host)
+
+    # a later chunk of the same host is merged into a new record, the newer port record wins
+    chunk = parse_nmap_xml(sample_report.replace(b'portid="21"><state state="open"', b'portid="21"><state state="closed"')
+                           .replace(b'portid="161"', b'portid="162"'))
+    first = result['10.0.0.1']
+    merged = result.add_host('10.0.0.1', chunk['10.0.0.1'])
+
+    check(merged is not first and first.port('tcp', 21).state == 'open', "stored record changed in place")
+    check(merged.port('tcp', 21).state == 'closed', "newer port record not used")
+    check(sorted(merged.ports['udp']) == [161, 162], "ports of both records not kept")
+    check(merged.services('udp') == {'snmp': (161, 162)}, "merged record not indexed")
+
+    for report, problem in ((sample_report[:len(sample_report) // 2], "truncated"),
+                            (sample_report.replace(b'</ports>', b'</port>', 1), "invalid")):
+        try:
+            parse_nmap_xml(report)
+        except NmapError:
+            continue
+
+        check(False, problem, "report accepted")
+
+    print("OK")
+
+
+def scan_cache_test():
+    """Test that cached scan reports are found regardless of the timing and limiter options"""
+    print("Testing scan cache ...")
+
+    from honeypots.limiter import TargetLimiter
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        hp = Honeypot('10.0.0.1', verbose_scan=False, scan_cache_ttl=3600, scan_cache_dir=directory,
+                      limiter=TargetLimiter(rate=5))
+        hp._runner.nmap_path = os.path.join(directory, 'no-nmap')  # starting nmap fails
+
+        def measure_rtt(addresses, ports, count=3, timeout=2):
+            raise AssertionError("round trip time measured for a cached scan")
+
+        hp._probe_engine.measure_rtt = measure_rtt
+
+        # report of an earlier adaptive scan with other limits
+        with open(hp._runner._cache_file('10.0.0.1', '-sV -n --stats-every 1s -p 1-1000'), 'wb') as f:
+            f.write(sample_report)
+
+        hp.scan('1-1000', adaptive=True)
+
+        check(hp.host == '10.0.0.1' and hp.has_tcp(21), "cached report not used")
+        check(hp.timing is None, "timing measured for a cached scan")
+
+        check(not hp._runner.cached('10.0.0.1', '-sV -n --stats-every 1s -p 1-2000'), "other ports found in cache")
+
+        try:
+            hp.scan('1-2000')
+            check(False, "scan not in the cache did not start nmap")
+        except ScanFailure:
+            pass
+    finally:
+        shutil.rmtree(directory)
+
+    print("OK")
+
+
+def free_port():
+    """
+    :return: a port on the loopback interface nothing listens on
+    """
+    import socket
+
+    with contextlib.closing(socket.socket()) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def probe_engine_test():
+    """Test the connect sweep, scripted probes, timeouts and connection limits of the probe engine"""
+    print("Testing probe engine ...")
+
+    import socketserver
+    from honeypots.honeypot import ProbeEngine, Probe
+
+    open_connections = []
+    most_connections = []
+
+    class SMTPHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            open_connections.append(self)
+            most_connections.append(len(open_connections))
+
+            time.sleep(0.05)
+            self.wfile.write(b'220 smtp ready\r\n')
+            command = self.rfile.readline()
+
+            # the client closes the connection as soon as it has the reply
+            open_connections.remove(self)
+
+            if command.startswith(b'EHLO'):
+                self.wfile.write(b'250 ok\r\n')
+
+    class SilentHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            self.request.recv(1)  # until the client gives up
+
+    engine = ProbeEngine(per_target_limit=2)
+    closed = free_port()
+
+    with loopback_server(SilentHandler) as silent, loopback_server(SilentHandler) as other:
+        found = engine.sweep(['127.0.0.1'], [(closed, closed), (silent, silent), (other, other)], window=4, timeout=1)
+
+    check(found == {'127.0.0.1': sorted([silent, other])}, "sweep found", found)
+
+    with loopback_server(SMTPHandler) as smtp, loopback_server(SilentHandler) as silent:
+        probes = engine.run([Probe('127.0.0.1', smtp, script=[b'EHLO checkpot\r\n'], timeout=2) for _ in range(6)])
+        probes += engine.run([Probe('127.0.0.1', closed, timeout=2), Probe('127.0.0.1', silent, timeout=0.2)])
+
+    check(all(probe.responses == [b'220 smtp ready\r\n', b'250 ok\r\n'] for probe in probes[:6]),
+          "conversation not completed:", probes[0].responses, probes[0].error)
+    check(max(most_connections) == 2, "not 2 connections to the target at a time:", max(most_connections))
+    check(not probes[6].connected and 'failed' in probes[6].error.value, "closed port not reported")
+    check(probes[7].connected and 'timed out' in probes[7].error.value, "silent service not timed out")
+    check(not engine.limiter._open, "connection slots not released")
+
+    print("OK")
+
+
+def banner_cache_test():
+    """Test that banners are read once per scan and failures are retried only with a longer timeout"""
+    print("Testing banner cache ...")
+
+    import socketserver
+
+    connections = []
+    delay = [0]
+
+    class BannerHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            connections.append(self.server.server_address[1])
+            time.sleep(delay[0])
+            self.request.sendall(b'220 banner\r\n')
+
+    hp = Honeypot('127.0.0.1', verbose_scan=False)
+
+    with loopback_server(BannerHandler) as port, loopback_server(BannerHandler) as slow:
+
+        # the probes of a test fill the cache too
+        hp.probe([Probe('127.0.0.1', port, timeout=2)])
+
+        check(hp.get_banner(port) == b'220 banner\r\n', "banner not read")
+        check(hp.get_banners([port])[port] == b'220 banner\r\n', "banner not cached")
+        check(connections == [port], "banner read more than once:", len(connections), "connections")
+        check(hp.cache_stats('banner')[0] == 2, "cache hits not counted:", hp.cache_stats('banner'))
+
+        # too slow for the first caller, the failure is kept for callers that do not wait longer
+        delay[0] = 0.3
+
+        check(isinstance(hp.get_banners([slow], timeout=0.1)[slow], ScanFailure), "slow banner not timed out")
+        check(isinstance(hp.get_banners([slow], timeout=0.1)[slow], ScanFailure), "failure not cached")
+        check(connections.count(slow) == 1, "failure not served from the cache")
+        check(hp.get_banners([slow], timeout=2)[slow] == b'220 banner\r\n', "failure not retried with more time")
+        check(connections.count(slow) == 2, "longer timeout not tried once")
+
+        # a new scan reads the banners again
+        delay[0] = 0
+        hp._cache.new_generation()
+        hp.get_banner(port)
+
+        check(connections.count(port) == 2, "banner of an older scan used")
+
+    print("OK")
+
+
+def udp_discovery_test():
+    """Test finding UDP services on the loopback interface and merging them into the scan results"""
+    print("Testing UDP discovery ...")
+
+    import socket
+    from honeypots.honeypot import ProbeEngine
+    from honeypots.udp import top_udp_ports, udp_host_record
+
+    requests = []
+    stop = threading.Event()
+
+    def serve(sock):
+        sock.settimeout(0.05)
+
+        while not stop.is_set():
+            try:
+                data, address = sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+
+            requests.append(data)
+
+            if len(requests) > 1:  # the first request is lost
+                sock.sendto(b'reply', address)
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # receives but never answers
+
+    try:
+        server.bind(('127.0.0.1', 0))
+        silent.bind(('127.0.0.1', 0))
+
+        thread = threading.Thread(target=serve, args=(server,), daemon=True)
+        thread.start()
+
+        port = server.getsockname()[1]
+        quiet = silent.getsockname()[1]
+        closed = free_port()
+
+        found = ProbeEngine().udp_discover(['127.0.0.1'], [(port, 'domain', b'query'), (quiet, 'ntp', b'time'),
+                                                           (closed, 'snmp', b'get')], timeout=0.2, retries=1)
+
+        stop.set()
+        thread.join()
+    finally:
+        server.close()
+        silent.close()
+
+    check(found == {'127.0.0.1': {port: 'domain'}}, "UDP discovery found", found)
+    check(requests == [b'query', b'query'], "request not sent again after a timeout:", requests)
+
+    record = udp_host_record('127.0.0.1', found['127.0.0.1'])
+
+    check(record.port('udp', port).state == 'open' and record.services('udp') == {'domain': (port,)},
+          "UDP record wrong")
+    check([port for port, name, payload in top_udp_ports(3)] == [53, 123, 161], "most common UDP services changed")
+
+    print("OK")
+
+
+def recorder_test():
+    """Test recording probes and web pages on the loopback interface and replaying them without network access"""
+    print("Testing record and replay ...")
+
+    import asyncio
+    import gzip
+    import http.client
+    import http.server
+    import socketserver
+    from honeypots.honeypot import ProbeEngine, Probe, WebFetcher
+    from honeypots.recorder import Recorder
+
+    class BannerHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            self.request.sendall(b'220 recorded banner\r\n')
+
+    class PageHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = b'<html>recorded page</html>'
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'session.json.gz')
+
+    try:
+        recorder = Recorder(path)
+
+        with loopback_server(BannerHandler) as banner_port, loopback_server(PageHandler) as web_port:
+            probes = ProbeEngine(recorder=recorder).run([Probe('127.0.0.1', banner_port, timeout=2),
+                                                         Probe('127.0.0.1', banner_port, script=[b'EHLO'], timeout=2)])
+            content, errors = WebFetcher(recorder=recorder).fetch('127.0.0.1', [web_port], ['/'], 2)
+
+        check(probes[0].banner == b'220 recorded banner\r\n' and not errors, "nothing to record:", errors)
+
+        recorder.record('test', ('key', 1, b'\x00'), {'bytes': b'\xff\xfe', 'nested': [1, ('a', None)]})
+        recorder.save()
+
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            check(json.load(f)['version'] == Recorder.version, "recording is not gzip compressed JSON")
+
+        # nothing may connect anywhere while replaying
+        def no_network(*args, **kwargs):
+            raise AssertionError("network used while replaying")
+
+        open_connection, connect = asyncio.open_connection, http.client.HTTPConnection.connect
+        asyncio.open_connection = http.client.HTTPConnection.connect = no_network
+
+        try:
+            replay = Recorder(path, replay=True)
+            engine = ProbeEngine(recorder=replay)
+
+            replayed = engine.run([Probe('127.0.0.1', banner_port, timeout=2),
+                                   Probe('127.0.0.1', banner_port, script=[b'EHLO'], timeout=2),
+                                   Probe('127.0.0.1', banner_port, script=[b'HELO'], timeout=2)])
+            pages, page_errors = WebFetcher(recorder=replay).fetch('127.0.0.1', [web_port], ['/', '/x'])
+        finally:
+            asyncio.open_connection, http.client.HTTPConnection.connect = open_connection, connect
+
+        check([p.responses for p in replayed[:2]] == [p.responses for p in probes], "probes replayed differently")
+        check(replayed[2].error is not None and 'not in the recording' in replayed[2].error.value,
+              "probe missing from the recording did not fail")
+        check(pages == content and (web_port, '/x') in page_errors, "web pages replayed differently")
+        check(replay.lookup('test', ['key', 1, b'\x00']) == {'bytes': b'\xff\xfe', 'nested': [1, ['a', None]]},
+              "values changed by the recording")
+
+        replay.record('test', 'new', 1)
+        check(replay.lookup('test', 'new') is None, "recorded while replaying")
+
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump({'version': Recorder.version + 1, 'entries': []}, f)
+
+        try:
+            Recorder(path, replay=True)
+            check(False, "recording of another version accepted")
+        except ValueError:
+            pass
+    finally:
+        shutil.rmtree(directory)
+
+    print("OK")
+
+
+def web_fetcher_test():
+    """Test keep-alive reuse and redirect following of the web fetcher on the loopback interface"""
+    print("Testing web fetcher ...")
+
+    import http.server
+    from honeypots.honeypot import WebFetcher
+    from honeypots.limiter import TargetLimiter
+
+    connections = []  # (server port, client port) of every connection accepted
+    other_port = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive
+
+        def setup(self):
+            super().setup()
+            connections.append((self.server.server_address[1], self.client_address[1]))
+
+        def do_GET(self):
+            locations = {'/moved': '/', '/away': 'http://localhost:' + str(other_port[0]) + '/elsewhere',
+                         '/loop': '/loop'}
+
+            if self.path in locations:
+                self.send_response(302)
+                self.send_header('Location', locations[self.path])
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            body = ('page ' + self.path).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    limiter = TargetLimiter(max_connections=1)
+    fetcher = WebFetcher(limiter=limiter)
+
+    with loopback_server(Handler) as port, loopback_server(Handler) as other:
+        other_port.append(other)
+
+        content, errors = fetcher.fetch('127.0.0.1', [port], ['/', '/style.css', '/index.html'], 2)
+
+        check(not errors and content[(port, '/style.css')] == 'page /style.css', "pages not fetched:", errors)
+        check(len(connections) == 1, "keep-alive connection not reused:", len(connections), "connections")
+
+        del connections[:]
+
+        # one slot per target, the redirect to the target itself must not wait for the slot held by the fetcher
+        content, errors = fetcher.fetch('127.0.0.1', [port], ['/moved', '/away', '/loop'], 2)
+
+        check(content.get((port, '/moved')) == 'page /', "redirect on the same host not followed:", errors)
+        check(content.get((port, '/away')) == 'page /elsewhere', "redirect to another host not followed:", errors)
+        check('Too many redirects' in str(errors.get((port, '/loop'))), "redirect loop not stopped")
+        check(any(server == other for server, client in connections), "other host not contacted")
+
+    check(not limiter._open, "connection slots not released:", limiter._open)
+
+    print("OK")
+
+
+def checkpoint_test():
+    """Test resuming an interrupted chunked scan from its checkpoint"""
+    print("Testing scan checkpoints ...")
+
+    from honeypots.nmap_runner import NmapRunner, NmapError
+
+    directory = tempfile.mkdtemp()
+    ran = []  # port chunks given to nmap
+    interrupt = []  # port chunks on which nmap fails
+
+    def run(targets, arguments, sudo=False, on_host=None, on_port=None, result=None, output=None, cache_key=None):
+        chunk = arguments.split(' -p ')[1]
+        ran.append(chunk)
+
+        if chunk in interrupt:
+            raise NmapError("interrupted")
+
+        if output is not None:
+            output.write(sample_report)
+
+        return NmapRunner._parse_report(sample_report, on_host, on_port, result)
+
+    try:
+        hp = Honeypot('10.0.0.1', verbose_scan=False)
+        hp._runner.run = run
+
+        interrupt.append('2001-3000')
+
+        try:
+            hp.scan('1-3000', chunk_size=1000, checkpoint=True, checkpoint_dir=directory)
+            check(False, "interrupted scan did not fail")
+        except ScanFailure:
+            pass
+
+        check(ran == ['1-1000', '1001-2000', '2001-3000'], "chunks not scanned in order:", ran)
+
+        # resumed, the first two chunks come from the checkpoint
+        del interrupt[:], ran[:]
+        hp.scan('1-3000', chunk_size=1000, checkpoint=True, checkpoint_dir=directory)
+
+        check(ran == ['2001-3000'], "finished chunks scanned again:", ran)
+        check(hp.host == '10.0.0.1' and hp.has_tcp(21), "results of the saved chunks not used")
+        check(not os.listdir(directory), "checkpoint of a finished scan not removed")
+
+        # other options, the checkpoint of the same targets and ports does not apply
+        interrupt.append('2001-3000')
+
+        try:
+            hp.scan('1-3000', chunk_size=1000, checkpoint=True, checkpoint_dir=directory)
+        except ScanFailure:
+            pass
+
+        del interrupt[:], ran[:]
+        hp.scan('1-3000', fast=True, chunk_size=1000, checkpoint=True, checkpoint_dir=directory)
+
+        check(ran == ['1-1000', '1001-2000', '2001-3000'], "checkpoint of other options used:", ran)
+    finally:
+        shutil.rmtree(directory)
+
+    print("OK")
+
+
+def port_range_test():
+    """Test parsing, building and splitting nmap port specifications"""
+    print("Testing port ranges ...")
+
+    from honeypots.nmap_runner import parse_port_range, split_port_range, format_port_range
+
+    parsed = {
+        '-': [(1, 65535)],
+        '80': [(80, 80)],
+        '20-100,102': [(20, 100), (102, 102)],
+        '-1024, 60000-': [(1, 1024), (60000, 65535)],
+        'http,22': None,
+        'T:22,U:53': None,
+    }
+
+    for port_range, expected in parsed.items():
+        check(parse_port_range(port_range) == expected, port_range, "parsed as", parse_port_range(port_range))
+
+    chunks = {
+        ('1-10', 4): ['1-4', '5-8', '9-10'],
+        ('1-10', 10): ['1-10'],
+        ('21,22,80-83,443', 3): ['21,22,80', '81-83', '443'],
+        ('5,7', 1): ['5', '7'],
+        ('http,22', 1): ['http,22'],
+    }
+
+    for (port_range, chunk_size), expected in chunks.items():
+        check(split_port_range(port_range, chunk_size) == expected,
+              port_range, "split in", split_port_range(port_range, chunk_size))
+
+    # all ports in chunks of 4096, no port lost or scanned twice
+    chunks = split_port_range('-', 4096)
+    ports = [port for chunk in chunks for start, end in parse_port_range(chunk) for port in range(start, end + 1)]
+
+    check(len(chunks) == 16, "wrong number of chunks for all ports:", len(chunks))
+    check(ports == list(range(1, 65536)), "chunks do not cover all ports exactly once")
+
+    # open ports found by the sweep
+    check(format_port_range([80, 21, 22, 23, 443, 22]) == '21-23,80,443', "port list not merged into ranges")
+    check(format_port_range(range(1, 65536)) == '1-65535', "all ports not merged into one range")
+    check(format_port_range([]) == '', "empty port list")
+
+    # every other port open, too long for one command line argument
+    port_range = format_port_range(range(1, 65536, 2))
+    chunks = split_port_range(port_range, max_length=1000)
+    ports = [port for chunk in chunks for start, end in parse_port_range(chunk) for port in range(start, end + 1)]
+
+    check(max(len(chunk) for chunk in chunks) <= 1000, "chunk longer than max_length")
+    check(ports == list(range(1, 65536, 2)), "long port list not split exactly")
+    check(split_port_range('1-10,20', 4, max_length=5) == ['1-4', '5-8', '9-10', '20'],
+          "chunk size and length limits not combined")
+
+    print("OK")
+
+
+def limiter_test():
+    """Test the connection slots and the token bucket of the per-target limiter"""
+    print("Testing target limiter ...")
+
+    from honeypots.honeypot import run_coroutine
+    from honeypots.limiter import TargetLimiter
+
+    limiter = TargetLimiter(max_connections=2)
+
+    limiter.acquire('10.0.0.1')
+    limiter.acquire('10.0.0.1')
+    limiter.acquire('10.0.0.2')  # other targets have their own slots
+
+    waiter = threading.Thread(target=limiter.acquire, args=('10.0.0.1',))
+    waiter.start()
+    waiter.join(0.2)
+    check(waiter.is_alive(), "third connection to a target allowed with max_connections=2")
+
+    limiter.release('10.0.0.1')
+    waiter.join(1)
+    check(not waiter.is_alive(), "released slot not given to the waiting connection")
+
+    limiter.acquire('10.0.0.1', slot=False)  # no slot is taken, so no wait
+    check(limiter._open == {'10.0.0.1': 2, '10.0.0.2': 1}, "slots counted wrong:", limiter._open)
+
+    # 10 new connections per second after a burst of 2
+    limiter = TargetLimiter(rate=10, burst=2, max_connections=None)
+    start = time.monotonic()
+
+    for _ in range(5):
+        limiter.acquire('10.0.0.1', slot=False)
+
+    elapsed = time.monotonic() - start
+    check(0.25 < elapsed < 0.6, "5 connections took", round(elapsed, 2), "seconds instead of 0.3")
+
+    async def open_connections():
+        async with limiter.connection('10.0.0.3'):
+            await limiter.acquire_async('10.0.0.3', slot=False)
+
+    run_coroutine(open_connections())
+    check(not limiter._open, "async connection slot not released")
+
+    check(TargetLimiter().nmap_arguments() == '--max-parallelism 8', "default nmap limits wrong")
+    check(TargetLimiter(rate=2.5, max_connections=4).nmap_arguments(3) == '--max-rate 7.5 --max-parallelism 12',
+          "nmap limits not scaled by the number of targets")
+    check(TargetLimiter(max_connections=None).nmap_arguments() == '', "nmap limits without limits")
+
+    print("OK")
+
+
+def timing_test():
+    """Test the round trip time measurement of adaptive scans and the timing derived from it"""
+    print("Testing adaptive timing ...")
+
+    import itertools
+    from honeypots.honeypot import ProbeEngine
+    from honeypots.timing import Timing
+
+    engine = ProbeEngine()
+    attempts = itertools.count()
+
+    async def handshake(address, port, timeout):
+        # 20 ms target, only port 80 is open, the firewall drops everything else
+        return 0.02 if port == 80 else None
+
+    engine._handshake = handshake
+    timing = Timing(engine.measure_rtt(['10.0.0.1'], [80, 443, 22], count=2))
+
+    check(timing.sent >= 6, "answering port not measured again:", timing.sent, "samples")
+    check(timing.loss == 0, "dropped ports counted as loss:", timing)
+    check('--max-retries 1' in timing.nmap_arguments() and '--min-parallelism' in timing.nmap_arguments(),
+          "clean path got", timing.nmap_arguments())
+    check(timing.probe_timeout < 2, "probe timeout of a clean path:", timing.probe_timeout)
+
+    async def lossy_handshake(address, port, timeout):
+        # every second attempt to the open port gets no answer
+        return 0.02 if port == 80 and not next(attempts) % 2 else None
+
+    engine._handshake = lossy_handshake
+    timing = Timing(engine.measure_rtt(['10.0.0.1'], [80, 443, 22], count=2))
+
+    check(0.3 < timing.loss < 0.7, "loss of the open port not measured:", timing)
+    check('--max-retries 6' in timing.nmap_arguments() and '--min-parallelism' not in timing.nmap_arguments(),
+          "lossy path got", timing.nmap_arguments())
+
+    async def no_handshake(address, port, timeout):
+        return None
+
+    engine._handshake = no_handshake
+    timing = Timing(engine.measure_rtt(['10.0.0.1'], [80, 443, 22], count=2))
+
+    check(not timing.measured and timing.nmap_arguments() == '', "timing without answers:", timing)
+    check(timing.probe_timeout == Timing.default_timeout, "probe timeout without answers:", timing.probe_timeout)
+
+    print("OK")
+
+
+def signature_test():
+    """Test banner, hash and template lookups of the signature database and its compiled cache"""
+    print("Testing signature database ...")
+
+    import hashlib
+    from tests.signatures import SignatureDatabase
+
+    source = {
+        'alpha': {'banners': {'ftp': ['220 Alpha FTP\r\n']},
+                  'banner_prefixes': {'ftp': ['220 Alpha'], 'telnet': ['\xff\xfb\x01']},
+                  'hashes': {'website': [hashlib.sha256(b'<html>alpha</html>').hexdigest().upper()]},
+                  'templates': {'s7-info': ['Version: 0.0', 'System Name: Alpha', 'Serial: 1']}},
+        'beta': {'banner_prefixes': {'ftp': ['220 Alpha FTP v2']},
+                 'templates': {'s7-info': ['Version: 0.0', 'System Name: Beta']}},
+    }
+
+    database = SignatureDatabase.compile(source)
+
+    banners = {
+        ('ftp', b'220 Alpha FTP\r\n'): 'alpha',  # exact
+        ('ftp', b'220 Alpha FTP v1.1\r\n'): 'alpha',  # prefix
+        ('ftp', b'220 Alpha FTP v2.0\r\n'): 'beta',  # longest prefix wins
+        ('ftp', b'220 Alpha FTP v2'): 'beta',  # banner ends with the prefix
+        ('ftp', b'220 Alph'): None,  # shorter than any prefix
+        ('ftp', b'220 Beta FTP\r\n'): None,
+        ('telnet', b'\xff\xfb\x01\xff\xfb\x03'): 'alpha',  # bytes above 127
+        ('smtp', b'220 Alpha FTP\r\n'): None,  # other service
+    }
+
+    for (service, banner), family in banners.items():
+        check(database.match_banner(service, banner) == family,
+              service, banner, "matched", database.match_banner(service, banner), "instead of", family)
+
+    check(database.match_hash('website', '<html>alpha</html>') == 'alpha', "hash of a string not matched")
+    check(database.match_hash('website', b'<html>alpha</html>') == 'alpha', "hash of bytes not matched")
+    check(database.match_hash('stylesheet', b'<html>alpha</html>') is None, "hash matched for another kind")
+    check(database.match_hash('website', b'<html>alpha </html>') is None, "different content matched")
+
+    templates = {
+        ('Version: 0.0', 'System Name: Alpha', 'Serial: 1'): ('alpha', 3, 3),
+        ('Version: 0.0', 'System Name: Beta', 'Serial: 1'): ('beta', 2, 2),
+        ('Version: 0.0', 'System Name: Gamma', 'Serial: 1'): ('alpha', 2, 3),
+        ('Version: 0.0', 'System Name: Gamma'): ('beta', 1, 2),  # the larger share of a template wins
+        ('Version: 0.0',): ('beta', 1, 2),
+        ('Version: 1.0', 'System Name: Beta', 'Serial: 1'): ('beta', 1, 2),
+        ('System Name: Alpha', 'Version: 0.0'): None,  # fields are compared position by position
+    }
+
+    for fields, expected in templates.items():
+        check(database.match_template('s7-info', list(fields)) == expected,
+              fields, "matched", database.match_template('s7-info', list(fields)), "instead of", expected)
+
+    check(len(database) == 7, "wrong number of signatures:", len(database))
+
+    try:
+        SignatureDatabase.compile({'alpha': {'banners': {'ftp': ['220 x']}}, 'beta': {'banners': {'ftp': ['220 x']}}})
+        check(False, "banner claimed by two families accepted")
+    except ValueError:
+        pass
+
+    # the compiled cache is used while the source is unchanged and rebuilt when it changes or is damaged
+    directory = tempfile.mkdtemp()
+    source_file = os.path.join(directory, 'signatures.json')
+    cache_file = os.path.join(directory, 'cache', 'signatures.db')
+
+    try:
+        with open(source_file, 'w') as f:
+            json.dump(source, f)
+
+        loaded = SignatureDatabase.load(source_file, cache_file)
+        check(os.path.isfile(cache_file), "compiled signatures not cached")
+        check(loaded.match_banner('ftp', b'220 Alpha FTP v2.0') == 'beta', "compiled signatures differ")
+
+        cached = SignatureDatabase.load(source_file, cache_file)
+        check(cached.match_template('s7-info', ['Version: 0.0', 'System Name: Beta']) == ('beta', 2, 2),
+              "cached signatures differ")
+
+        source['beta']['banners'] = {'ftp': ['220 Beta FTP\r\n']}
+
+        with open(source_file, 'w') as f:
+            json.dump(source, f)
+
+        check(SignatureDatabase.load(source_file, cache_file).match_banner('ftp', b'220 Beta FTP\r\n') == 'beta',
+              "outdated cache used after the source changed")
+
+        with open(cache_file, 'r+b') as f:
+            f.seek(len(SignatureDatabase.magic) + 32)
+            f.write(b'damaged')
+
+        check(SignatureDatabase.load(source_file, cache_file).match_banner('ftp', b'220 Beta FTP\r\n') == 'beta',
+              "damaged cache not rebuilt")
+
+        # the signatures shipped with checkpot
+        shipped = SignatureDatabase.load(cache_file=os.path.join(directory, 'shipped.db'))
+        check(shipped.match_banner('ftp', b'220 DiskStation FTP server ready.\r\n') == 'dionaea',
+              "shipped ftp banner not matched")
+        check(shipped.match_template('s7-info', ['Version: 0.0', 'System Name: Technodrome'])[0] == 'conpot',
+              "shipped s7 template not matched")
+    finally:
+        shutil.rmtree(directory)
+
+    print("OK")
+
+
+def product_matcher_test():
+    """Test the Aho-Corasick matcher for product descriptions"""
+    print("Testing product matcher ...")
+
+    from tests.product_matcher import ProductMatcher
+
+    # overlapping patterns and patterns ending inside other patterns need the failure links
+    matcher = ProductMatcher({'a': ['he', 'hers'], 'b': ['she', 'his'], 'c': ['Microsoft SQL']})
+
+    matches = {
+        'ushers': {'a': {'he', 'hers'}, 'b': {'she'}},
+        'HIS SHE': {'a': {'he'}, 'b': {'his', 'she'}},
+        'microsoft sql server 2008': {'c': {'microsoft sql'}},
+        'mIcRoSoFt SqL': {'c': {'microsoft sql'}},
+        'microsoft sq': {},
+        'hhhhe': {'a': {'he'}},
+        '': {},
+    }
+
+    for description, expected in matches.items():
+        check(matcher.match(description) == expected,
+              repr(description), "matched", matcher.match(description), "instead of", expected)
+
+    shared = ProductMatcher.shared()
+
+    check(shared.match('Dionaea Honeypot ftpd') == {'honeypot': {'honeypot'}}, "honeypot product not found")
+    check(shared.match('Microsoft IIS httpd 7.5') == {'windows-only': {'microsoft', 'iis'}},
+          "windows product not found")
+    check(shared.match('OpenSSH 6.0p1 Debian 4+deb7u2') == {}, "indicator found in a linux product")
+
+    hits = shared.match_ports({'Dionaea Honeypot ftpd': (21,), 'nginx': (80, 8080), 'Microsoft IIS httpd': (81, 82)})
+
+    check(sorted(hits) == [21, 81, 82], "ports without indicators reported:", sorted(hits))
+    check(hits[82] == ('Microsoft IIS httpd', {'windows-only': {'microsoft', 'iis'}}), "port hit wrong:", hits[82])
+
+    print("OK")
+
+
+def profile_index_test():
+    """Test the scores of the port profile index"""
+    print("Testing service profiles ...")
+
+    import math
+    from tests.service_profiles import ProfileIndex
+
+    profiles = {'a': [1, 2, 3, 4], 'b': [3, 4, 5, 5], 'c': [9]}
+
+    def close(score, expected):
+        return all(math.isclose(value, other) for value, other in zip(score, expected))
+
+    # duplicate ports count once, profiles sharing no port are left out
+    scores = ProfileIndex(profiles, weighted=False).score([1, 2, 3, 5, 5])
+
+    check(sorted(scores) == ['a', 'b'], "wrong profiles scored:", sorted(scores))
+    check(close(scores['a'], (3 / 5, 3 / 4, 3 / 4)), "unweighted score of a wrong:", scores['a'])
+    check(close(scores['b'], (2 / 5, 2 / 3, 2 / 4)), "unweighted score of b wrong:", scores['b'])
+
+    # ports found in one of three profiles weigh log(4), in two of them log(2.5), unknown ports count as rare
+    index = ProfileIndex(profiles)
+
+    check(math.isclose(index.weight(1), math.log(4)) and math.isclose(index.weight(3), math.log(2.5)),
+          "port weights wrong")
+    check(math.isclose(index.weight(12345), math.log(4)), "unknown port weight wrong")
+
+    rare, common = math.log(4), math.log(2.5)
+    scores = index.score([1, 2, 3, 5, 12345])
+    shared = 2 * rare + common
+
+    check(close(scores['a'], (shared / (2 * rare + 2 * common + 4 * rare + common - shared),
+                              shared / (2 * rare + 2 * common), shared / (4 * rare + common))),
+          "weighted score of a wrong:", scores['a'])
+
+    check(index.score([]) == {} and index.score([12345]) == {}, "target without known ports scored")
+
+    shipped = ProfileIndex.load()
+
+    with open(ProfileIndex.source_file) as f:
+        amun = json.load(f)['amun']
+
+    check(math.isclose(shipped.score(amun)['amun'].profile_in_target, 1), "amun profile not found in itself")
+    check(shipped.score(amun + [1, 2, 3])['amun'].target_in_profile < 1, "extra target ports not counted")
+
+    print("OK")
+
+
+def page_similarity_test():
+    """Test the fingerprints and lookups of the near-duplicate page index"""
+    print("Testing page similarity index ...")
+
+    from tests.page_similarity import PageIndex
+
+    page = ('<html><head><title>Overview - Siemens, SIMATIC, S7-200</title></head><body><h2>Technodrome</h2>' +
+            ''.join('<tr><td>Module %d</td><td>running</td></tr>' % n for n in range(20)) +
+            '<p>Current time: 14:02:37</p></body></html>')
+
+    index = PageIndex()
+
+    check(index.tokens('<P class="x">Time:  12:30</P>') == ['<p class="x">', 'time:', '0:0', '</p>'],
+          "tokens not normalized:", index.tokens('<P class="x">Time:  12:30</P>'))
+    check(index.tokens(b'<p>caf\xc3\xa9</p>') == ['<p>', 'caf\xe9', '</p>'], "page as bytes not decoded")
+    check(index.fingerprint('') is None and not index.add('conpot', ' '), "empty page fingerprinted")
+    check(index.match(page) is None, "match found in an empty index")
+
+    index.add('conpot', page)
+
+    check(index.match(page.replace('14:02:37', '09:59:01').encode()) == ('conpot', 1.0),
+          "page differing in numbers only not matched")
+
+    edited = index.match(page.replace('running', 'stopped', 5))
+    check(edited is not None and 0.6 < edited[1] < 1, "edited page not scored as similar:", edited)
+
+    check(index.match('<html><body><h1>It works!</h1></body></html>') is None, "unrelated page matched")
+
+    # signatures survive saving and loading
+    directory = tempfile.mkdtemp()
+
+    try:
+        index.save(os.path.join(directory, 'pages.json'))
+        loaded = PageIndex.load(os.path.join(directory, 'pages.json'))
+    finally:
+        shutil.rmtree(directory)
+
+    check(len(loaded) == 1 and loaded.match(page) == ('conpot', 1.0), "saved fingerprints differ")
+
+    # default website of conpot as served at another time, layout whitespace does not matter
+    conpot = ('<HTML> <HEAD> <TITLE>Overview - Siemens, SIMATIC, S7-200</TITLE> </HEAD> <BODY> <h2>Technodrome</h2>'
+              ' <hr> &nbsp;<br> <b>Status:</b><br> &nbsp;<br> <table border="0"> <tr> <td style="width:150px;">'
+              '<b>Current time:</b></td> <td>23:15:02</td> </tr> <tr> <td style="width:150px;"><b>System uptime:</b>'
+              '</td> <td>8841 timeticks (deciseconds)</td> </tr> </table> </BODY> </HTML>')
+
+    check(PageIndex.load().match(conpot) == ('conpot', 1.0), "shipped conpot page not matched")
+
+    print("OK")
+
+
+def deadline_test():
+    """Test that cancelled tests keep their resources until they stop and can not overwrite later results"""
+    print("Testing test deadlines ...")
+
+    hp = Honeypot('127.0.0.1', verbose_scan=False)
+    gate = threading.Event()
+    active = []  # tests using the 'websites' resource right now
+    overlaps = []
+
+    class StuckTest(Test):
+        name = "Stuck"
+        resources = ['websites']
+        time_budget = 0.1
+
+        def run(self):
+            active.append(self)
+            gate.wait(5)
+            active.remove(self)
+            self.set_result(TestResult.OK, "result after the deadline")
+
+    class NextTest(Test):
+        name = "Next"
+        resources = ['websites']
+
+        def run(self):
+            overlaps.append(len(active))
+            self.set_result(TestResult.OK)
+
+    stuck = StuckTest()
+    following = NextTest()
+
+    # the stuck test stops a little after its deadline, the next test waits for the resource until then
+    threading.Timer(0.3, gate.set).start()
+    TestPlatform([stuck, following], hp).run_tests(test_time_limit=2)
+
+    check(stuck.result == TestResult.UNKNOWN, "result of a cancelled test accepted:", stuck.report)
+    check(following.result == TestResult.OK and overlaps == [0], "resource shared with a cancelled test")
+
+    # the stuck test does not stop within the budget of the next one
+    gate.clear()
+    overlaps.clear()
+    TestPlatform([stuck, following], hp).run_tests(test_time_limit=0.2)
+    gate.set()
+
+    check(following.result == TestResult.UNKNOWN and not overlaps, "test ran while its resource was in use")
+
+    # a cancelled run that finishes during the next run of the same test
+    first_run = threading.Event()
+    finish = threading.Event()
+    finished = threading.Event()
+
+    class RerunTest(Test):
+        name = "Rerun"
+        time_budget = 0.1
+
+        def run(self):
+            if not first_run.is_set():
+                first_run.set()
+                finish.wait(5)
+                self.set_result(TestResult.OK, "stale result")
+                finished.set()
+            else:
+                self.set_result(TestResult.WARNING, "current result")
+
+    rerun = RerunTest()
+    platform = TestPlatform([rerun], hp)
+
+    platform.run_tests()
+    check(rerun.result == TestResult.UNKNOWN, "slow test not cancelled")
+
+    platform.run_tests()
+    finish.set()
+    finished.wait(5)
+
+    check(rerun.result == TestResult.WARNING and rerun.report == "current result",
+          "cancelled run overwrote the next run:", rerun.report)
+
+    print("OK")
+
+
+def platform_test():
+    """Test concurrent test runs: start order, dependencies, shared resources, result order and timeouts"""
+    print("Testing concurrent test platform ...")
+
+    hp = Honeypot('127.0.0.1', verbose_scan=False)
+    both_running = threading.Barrier(2, timeout=0.3)
+    release = threading.Event()
+    started = []
+    active = []  # tests using the 'websites' resource right now
+    overlaps = []
+
+    class FirstTest(Test):
+        name = "First"
+
+        def run(self):
+            started.append(self.name)
+            time.sleep(0.1)
+            self.set_result(TestResult.OK)
+
+    class DependentTest(Test):
+        name = "Dependent"
+        depends_on = [FirstTest]
+
+        def run(self):
+            started.append(self.name)
+            self.set_result(TestResult.OK)
+
+    class WebsiteTest(Test):
+        resources = ['websites']
+
+        def run(self):
+            started.append(self.name)
+            active.append(self)
+            overlaps.append(len(active))
+            time.sleep(0.05)
+            active.remove(self)
+            self.set_result(TestResult.OK)
+
+    class StuckTest(Test):
+        name = "Stuck"
+
+        def run(self):
+            started.append(self.name)
+            release.wait(5)
+            self.set_result(TestResult.OK)
+
+    class CheapTest(Test):
+        name = "Cheap"
+
+        def run(self):
+            both_running.wait()
+            self.set_result(TestResult.OK)
+
+    class ExpensiveTest(Test):
+        name = "Expensive"
+        cost = 5
+
+        def run(self):
+            both_running.wait()
+            self.set_result(TestResult.OK)
+
+    websites = [WebsiteTest() for _ in range(3)]
+
+    for number, test in enumerate(websites):
+        test.name = "Website " + str(number)
+
+    test_list = [FirstTest(), DependentTest(), websites[0], StuckTest(), websites[1], websites[2]]
+    platform = TestPlatform(test_list, hp)
+
+    output = io.StringIO()
+
+    try:
+        with contextlib.redirect_stdout(output):
+            platform.run_tests(verbose=True, test_time_limit=0.5, workers=4)
+    finally:
+        release.set()
+
+    results = dict((name, result) for name, report, result, karma in platform.results)
+
+    check(started.index("Dependent") > started.index("First") and results["Dependent"] == TestResult.OK,
+          "dependent test started before its dependency:", started)
+    check(overlaps == [1, 1, 1], "tests sharing a resource ran at the same time")
+    check(results["Stuck"] == TestResult.UNKNOWN and results["First"] == TestResult.OK, "wrong results:", results)
+    check([name for name, report, result, karma in platform.results] == [test.name for test in test_list],
+          "results not in the order of the test list")
+
+    printed = output.getvalue()
+    positions = [printed.find(test.name + " ") for test in test_list]
+
+    check(-1 not in positions and positions == sorted(positions), "results not printed in the order of the test list")
+
+    # the expensive test starts before the cheap ones, otherwise the stuck test would keep it waiting
+    release.clear()
+
+    try:
+        TestPlatform([CheapTest(), StuckTest(), ExpensiveTest()], hp).run_tests(test_time_limit=0.5, workers=2)
+    except threading.BrokenBarrierError:
+        check(False, "expensive test not started first")
+    finally:
+        release.set()
+
+    # tests waiting for each other can never start
+    class CircleTest(Test):
+        name = "Circle"
+
+    class OtherCircleTest(Test):
+        name = "Other circle"
+        depends_on = [CircleTest]
+
+    CircleTest.depends_on = [OtherCircleTest]
+
+    try:
+        TestPlatform([CircleTest(), OtherCircleTest()], hp).run_tests(workers=2)
+        check(False, "circular dependencies not detected")
+    except ValueError:
+        pass
+
+    print("OK")
+
+
+def registry_test():
+    """Test that registered tests are imported only when needed, including the ones found through entry points"""
+    print("Testing test registry ...")
+
+    import tests.registry
+    from tests.registry import TestRegistry
+
+    directory = tempfile.mkdtemp()
+
+    with open(os.path.join(directory, 'checkpot_lazy_tests.py'), 'w') as f:
+        f.write("from tests.test import Test\n"
+                "\n"
+                "class LazyTest(Test):\n"
+                "    name = 'Lazy'\n"
+                "    required_services = [('http', 'tcp')]\n")
+
+    class EntryPoint:
+        def __init__(self, name, function):
+            self.name = name
+            self.function = function
+
+        def load(self):
+            return self.function
+
+    def register(registry):
+        registry.register('checkpot_lazy_tests:LazyTest', 2, required_services=[('http', 'tcp')], cost=3)
+
+    def broken(registry):
+        raise ImportError("missing dependency")
+
+    class EntryPoints(dict):
+        """Result of importlib.metadata.entry_points() on Python 3.10 and newer"""
+
+        def select(self, group):
+            return self.get(group, [])
+
+    published = {TestRegistry.entry_point_group: [EntryPoint('lazy', register), EntryPoint('broken', broken)],
+                 'other.group': [EntryPoint('other', broken)]}
+    entry_points = tests.registry.entry_points
+    sys.path.insert(0, directory)
+
+    try:
+        for found in (EntryPoints(published), dict(published)):  # Python 3.10+ and 3.8/3.9
+            tests.registry.entry_points = lambda: found
+            registry = TestRegistry()
+
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                count = registry.discover()
+
+            check(count == 1, "packages registering tests:", count)
+
+            check("Could not load tests from broken" in output.getvalue(), "broken package not reported")
+            check([spec.path for spec in registry.select(1)] == [], "level 2 test selected for level 1")
+
+            spec, = registry.select(2)
+
+            check('checkpot_lazy_tests' not in sys.modules, "registered test imported before it was needed")
+
+            test, = registry.create_tests(2)
+
+            check(test.name == 'Lazy' and test.cost == 3, "registered test not created")
+            check(spec.load() is type(test), "test class imported again")
+
+            del sys.modules['checkpot_lazy_tests']
+
+        registry = TestRegistry()
+        registry.register('checkpot_lazy_tests:LazyTest', 2)
+        registry.register('checkpot_lazy_tests:MissingTest', 2)
+
+        for spec in registry.select(2):
+            try:
+                spec.load()
+                check(False, "test with wrong metadata loaded:", spec)
+            except ValueError:
+                pass
+
+        try:
+            registry.register('checkpot_lazy_tests:LazyTest', 3)
+            check(False, "test registered twice")
+        except ValueError:
+            pass
+    finally:
+        tests.registry.entry_points = entry_points
+        sys.path.remove(directory)
+        sys.modules.pop('checkpot_lazy_tests', None)
+        shutil.rmtree(directory)
+
+    print("OK")
+
+
 def interface_test():
     """Test argument parsing"""
     print("Testing argument parser ...")
@@ -137,7 +1464,7 @@ def interface_test():
     expected = {'target': '172.17.0.2', 'scan_os': True, 'scan_level': 5, 'port_range': '20-100,102', 'fast': False,
                 'brief': False}
 
-    if parsed != expected:
+    if {key: parsed[key] for key in expected} != expected:
         print("ERROR: parsed != expected")
         sys.exit(1)
 
@@ -145,7 +1472,7 @@ def interface_test():
     expected = {'target': '172.17.0.2', 'scan_os': False, 'scan_level': 5, 'port_range': '20-1000', 'fast': False,
                 'brief': False}
 
-    if parsed != expected:
+    if {key: parsed[key] for key in expected} != expected:
         print("ERROR: parsed != expected")
         sys.exit(1)
 
@@ -153,7 +1480,7 @@ def interface_test():
     expected = {'target': '172.17.0.2', 'scan_os': True, 'scan_level': 3, 'port_range': None, 'fast': False,
                 'brief': False}
 
-    if parsed != expected:
+    if {key: parsed[key] for key in expected} != expected:
         print("ERROR: parsed != expected")
         sys.exit(1)
 
@@ -161,7 +1488,7 @@ def interface_test():
     expected = {'target': '172.17.0.2', 'scan_os': True, 'scan_level': 3, 'port_range': None, 'fast': True,
                 'brief': False}
 
-    if parsed != expected:
+    if {key: parsed[key] for key in expected} != expected:
         print("ERROR: parsed != expected")
         sys.exit(1)
 
@@ -169,17 +1496,132 @@ def interface_test():
     expected = {'target': '172.17.0.2', 'scan_os': True, 'scan_level': 3, 'port_range': None, 'fast': False,
                 'brief': False}
 
-    if parsed != expected:
+    if {key: parsed[key] for key in expected} != expected:
         print("ERROR: parsed != expected")
         sys.exit(1)
 
+    # target forms, all expanded to a list of addresses without duplicates
+
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+        f.write("# lab network\n10.0.1.1\n\n10.0.1.2  # second\n10.0.0.0/31\n")
+
+    target_forms = {
+        '10.0.0.0/30': ['10.0.0.1', '10.0.0.2'],
+        '10.0.0.7/32': ['10.0.0.7'],
+        '10.0.0.1-3': ['10.0.0.1', '10.0.0.2', '10.0.0.3'],
+        '10.0.0.254-10.0.1.1': ['10.0.0.254', '10.0.0.255', '10.0.1.0', '10.0.1.1'],
+        '10.0.0.2,10.0.0.0/30, 10.0.0.9': ['10.0.0.2', '10.0.0.1', '10.0.0.9'],
+        f.name: ['10.0.1.1', '10.0.1.2', '10.0.0.0', '10.0.0.1'],
+    }
+
+    try:
+        for target, expected in target_forms.items():
+
+            parsed = argv_parser.parse(['checkpot.py', '-t', target])
+
+            if parsed is None or parsed["targets"] != expected:
+                print("ERROR: targets of", target, "parsed as", parsed and parsed["targets"], "instead of", expected)
+                sys.exit(1)
+    finally:
+        os.remove(f.name)
+
+    # invalid command lines must be rejected with a usage message, not a traceback
+    invalid = [['-t', '::/64'], ['-t', 'fe80::1'], ['-t', '10.0.0.0/12'], ['-t', '10.0.0.1-10.2.0.0'],
+               ['-t', '10.0.0.9-1'], ['-t', '10.0.0.300'], ['-t', '10.0.0.1', '-g', 'x'],
+               ['-t', '10.0.0.1', '-l', 'high'], ['-t', '10.0.0.1', '-L', 'fast']]
+
+    for arguments in invalid:
+
+        start = time.time()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            parsed = argv_parser.parse(['checkpot.py'] + arguments)
+
+        if parsed is not None or time.time() - start > 1:
+            print("ERROR: invalid command line accepted:", ' '.join(arguments))
+            sys.exit(1)
+
+    print("OK")
+
+
+def startup_test(runs=5):
+    """
+    Test that checkpot starts fast: importing it and parsing the command line must fit in startup_budget
+    and must not import any of the startup_forbidden modules, neither must building the level 1 test list
+
+    :param runs: number of fresh interpreters measured, the fastest one is compared to the budget
+    """
+    print("Testing start-up time ...")
+
+    # runs in a fresh interpreter, nothing is imported yet
+    code = (
+        "import io, json, sys, time, contextlib\n"
+        "start = time.perf_counter()\n"
+        "import checkpot\n"
+        "with contextlib.redirect_stdout(io.StringIO()):\n"
+        "    checkpot.argv_parser.parse(['checkpot.py'])\n"
+        "elapsed = time.perf_counter() - start\n"
+        "started = sorted(sys.modules)\n"
+        "from tests.registry import default_registry\n"
+        "checkpot.get_test_list(default_registry(discover=False), 1, False)\n"
+        "print(json.dumps([elapsed, started, sorted(sys.modules)]))\n"
+    )
+
+    best = None
+
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        elapsed, started, level_one = json.loads(output.decode().splitlines()[-1])
+        best = elapsed if best is None else min(best, elapsed)
+
+        for module in startup_forbidden:
+            if module in started or module in level_one:
+                print("ERROR:", module, "imported during start-up or by the level 1 tests")
+                sys.exit(1)
+
+    print("Start-up took", round(best * 1000, 1), "ms, budget", round(startup_budget * 1000), "ms")
+
+    if best > startup_budget:
+        print("ERROR: start-up exceeded its time budget")
+        sys.exit(1)
+
     print("OK")
 
 
+def offline_tests():
+    """Tests that need neither containers nor network access"""
+
+    cache_test()
+    parser_test()
+    scan_cache_test()
+    probe_engine_test()
+    banner_cache_test()
+    udp_discovery_test()
+    recorder_test()
+    web_fetcher_test()
+    port_range_test()
+    checkpoint_test()
+    limiter_test()
+    timing_test()
+    signature_test()
+    product_matcher_test()
+    profile_index_test()
+    page_similarity_test()
+    deadline_test()
+    platform_test()
+    registry_test()
+
+    interface_test()
+
+    startup_test()
+
+
 def main():
     """
     Entry point for the Continuous Integration tools.
     Write all tests here.
+    Run with --offline to run only the tests that need no containers.
     """
 
     print(
@@ -459,9 +1901,12 @@ def main():
                   },
                   port_range='-')
 
-    # test the interface
-    interface_test()
+    # test the data structures, the interface and the start-up time
+    offline_tests()
 
 
 if __name__ == '__main__':
-    main()
+    if sys.argv[1:] == ['--offline']:
+        offline_tests()
+    else:
+        main()
@@ -0,0 +1,147 @@
+# Checkpot - Honeypot Checker
+# Copyright (C) 2018  Vlad Florea
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# DISCLAIMER: All prerequisites (containers, additional programs, etc.)
+# and libraries that might be needed to run this program are property
+# of their original authors and carry their own separate licenses that
+# you should read to inform yourself about their terms.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# As this software is PROVIDED WITH ABSOLUTELY NO WARRANTY OF ANY KIND,
+# YOU USE THIS SOFTWARE AT YOUR OWN RISK!
+#
+# By using this tool YOU TAKE FULL LEGAL RESPONSIBILITY FOR ANY
+# POSSIBLE OUTCOME.
+#
+# We strongly recommend that you read all the information in the README.md
+# file (found in the root folder of this project) and even the
+# documentation (which you can find locally in the /docs/ folder or
+# at http://checkpot.readthedocs.io/) to make sure you fully
+# understand how this tool works and consult all laws that apply
+# to your use case.
+#
+# We strongly suggest that you keep this notice intact for all files.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# The local copy of the license should be located in the root folder of the app
+# in the file gpl-3.0.txt.
+#
+# You can contact the author and team at any time via the Checkpot official
+# GitHub page: https://github.com/honeynet/checkpot or via the Honeynet
+# official Slack channel: https://gsoc-slack.honeynet.org/ or
+#                         https://honeynetpublic.slack.com/
+#
+# You can contact us at any time and with any question, we are here to help!
+#
+# If you consider any information in this copyright notice might be incorrect,
+# outdated, arises any questions, raises any problems, etc. please contact us
+# and we will make it our top priority to fix it. We have the deepest respect
+# for the work of all authors and for all of our users.
+
+from collections import OrderedDict
+import threading
+
+
+class DataCache:
+    """
+    Size bounded LRU cache for all data derived from a scan (websites, banners, script output, etc.).
+    Every entry is tagged with the scan generation it was created in, entries from older
+    generations are never returned and get dropped as soon as they are found.
+    Safe to use from several threads (tests running at the same time).
+    """
+
+    def __init__(self, max_entries=1024, generation=0):
+        """
+        :param max_entries: maximum number of entries kept, the least recently used ones are dropped first
+        :param generation: initial scan generation
+        """
+        self.max_entries = max_entries
+        self.generation = generation
+
+        self._entries = OrderedDict()  # (kind, key) -> (generation, value)
+        self._hits = {}  # kind -> number of hits
+        self._misses = {}  # kind -> number of misses
+        self._lock = threading.Lock()
+
+    def new_generation(self):
+        """
+        Invalidates all cached data, called after every scan
+
+        :return: the new generation
+        """
+        with self._lock:
+            self.generation += 1
+            return self.generation
+
+    def get(self, kind, key, default=None):
+        """
+        Returns a cached value and records the hit or miss
+
+        :param kind: category of the data (e.g. 'banner')
+        :param key: key inside the category
+        :param default: returned on miss
+        :return: cached value or default
+        """
+        with self._lock:
+            entry = self._entries.get((kind, key))
+
+            if entry is not None and entry[0] == self.generation:
+                self._entries.move_to_end((kind, key))
+                self._hits[kind] = self._hits.get(kind, 0) + 1
+                return entry[1]
+
+            if entry is not None:
+                # left over from an older scan
+                del self._entries[(kind, key)]
+
+            self._misses[kind] = self._misses.get(kind, 0) + 1
+            return default
+
+    def contains(self, kind, key):
+        """
+        Checks for a value of the current generation without recording a hit or miss
+
+        :param kind: category of the data
+        :param key: key inside the category
+        :return: boolean
+        """
+        entry = self._entries.get((kind, key))
+        return entry is not None and entry[0] == self.generation
+
+    def store(self, kind, key, value, replace=True):
+        """
+        Stores a value for the current generation
+
+        :param kind: category of the data
+        :param key: key inside the category
+        :param value: data to store
+        :param replace: overwrite a value already stored for the current generation
+        """
+        with self._lock:
+            if not replace and self.contains(kind, key):
+                return
+
+            self._entries[(kind, key)] = (self.generation, value)
+            self._entries.move_to_end((kind, key))
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self, kind):
+        """
+        :param kind: category of the data
+        :return: tuple of (hits, misses)
+        """
+        return self._hits.get(kind, 0), self._misses.get(kind, 0)
+
+    def __len__(self):
+        return len(self._entries)
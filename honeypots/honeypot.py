@@ -47,11 +47,26 @@
 # and we will make it our top priority to fix it. We have the deepest respect
 # for the work of all authors and for all of our users.
 
-import nmap
 import platform
+import re
 import urllib.request
 import urllib.error
-import socket
+import urllib.parse
+import http.client
+import io
+import ssl
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import DataCache
+from .timing import Timing
+from .limiter import TargetLimiter
+from .udp import top_udp_ports, udp_host_record
+from .nmap_runner import (NmapRunner, NmapError, ScanResult, ScanCheckpoint, parse_port_range, split_port_range,
+                          format_port_range)
 
 
 class Honeypot:
@@ -62,35 +77,128 @@ class Honeypot:
 
     __debug = False  # enables debug prints
 
-    scan_id = 0
-    websites = []  # cached web page data for current honeypot
-    css = []  # cached css data for current honeypot
+    rtt_ports = [80, 443, 22, 21, 23, 25]  # measured for adaptive timing when no open port is known yet
+    rtt_targets = 8  # maximum number of addresses of a group measured for adaptive timing
+    checkpoint_chunk_size = 4096  # ports scanned between two checkpoints when no chunk size is given
+    max_port_argument = 16384  # characters of the -p option of one nmap run, longer port lists are split
 
-    def __init__(self, address, scan_os=False, verbose_scan=True):
+    def __init__(self, address, scan_os=False, verbose_scan=True, cache_size=1024, scan_cache_ttl=0,
+                 scan_cache_dir=None, recorder=None, limiter=None):
         """
-        :param address: ip address of the target
+        :param address: ip address of the target or list of ip addresses to be scanned as one group
         :param scan_os: scan for Operating System information (requires elevated privileges)
         :param verbose_scan: print progress bars and stats when running a scan
+        :param cache_size: maximum number of entries in the cache of data derived from the scan
+        :param scan_cache_ttl: seconds for which nmap reports are kept on disk and reused, 0 disables it
+        :param scan_cache_dir: folder of the saved nmap reports
+        :param recorder: Recorder which archives all network interactions or answers them from an archive
+        :param limiter: TargetLimiter for all traffic sent to the targets, including the nmap scan,
+                        by default only the connections of the probes are limited (8 per target)
         """
         self.address = address
         self.scan_os = scan_os
         self.host = None
+        self.hosts = []
+        self.scan_scripts = []  # names of the .nse scripts that ran during the last scan
+        self.timing = None  # Timing measured by the last adaptive scan
+        self._deadlines = threading.local()  # deadline of the calling thread, see deadline()
+        self._limiter = limiter
+        self._probe_engine = ProbeEngine(recorder=recorder, limiter=limiter)
+        self._web_fetcher = WebFetcher(recorder=recorder, limiter=self._probe_engine.limiter)
+        self._cache = DataCache(cache_size)  # websites, css, banners and script output of the current scan
+
+        self._runner = NmapRunner(show_progress=verbose_scan, cache_ttl=scan_cache_ttl, cache_dir=scan_cache_dir,
+                                  recorder=recorder)
+        self._scan_result = ScanResult()
+
+    @classmethod
+    def _view(cls, parent, host):
+        """
+        Creates a Honeypot which reads the data of one host from the scan results of a group scan
 
-        if verbose_scan:
-            try:
-                self._nm = nmap.PrintProgressPortScanner()
-            except AttributeError:
-                # not running the modded version of python-nmap
-                print("\nWARNING: Cannot display progress bars as you have an unsupported version of python-nmap. "
-                      "Please install from requirements.txt.")
-                print("Example: pip install -r requirements.txt\n")
-                self._nm = nmap.PortScanner()
-        else:
-            self._nm = nmap.PortScanner()
+        :param parent: Honeypot that ran the group scan
+        :param host: scanned host
+        :return: Honeypot object
+        """
+        view = cls.__new__(cls)
+        view.address = host
+        view.scan_os = parent.scan_os
+        view.host = host
+        view.hosts = [host]
+        view.scan_scripts = parent.scan_scripts
+        view.timing = parent.timing
+        view._limiter = parent._limiter
+        view._deadlines = threading.local()
+        view._runner = parent._runner
+        view._scan_result = parent._scan_result
+        view._probe_engine = parent._probe_engine
+        view._web_fetcher = parent._web_fetcher
+        view._cache = DataCache(parent._cache.max_entries, parent.scan_generation)
+
+        return view
+
+    @property
+    def _scan_targets(self):
+        """Target specification passed to nmap"""
+
+        if isinstance(self.address, str):
+            return self.address
+
+        return ' '.join(self.address)
+
+    @property
+    def _sweep_targets(self):
+        """List of addresses to sweep"""
 
-    def scan(self, port_range=None, fast=False):
+        if isinstance(self.address, str):
+            return [self.address]
+
+        return list(self.address)
+
+    def get_host_views(self):
+        """
+        Splits the results of a group scan into one Honeypot for every host that was found.
+        The returned objects share the scan results of this object and can be used by Tests directly,
+        they should not be scanned again.
+
+        :return: list of Honeypot objects, one for each available host
+        """
+        if len(self.hosts) == 1 and self.address == self.host:
+            return [self]
+
+        return [self._view(self, host) for host in self.hosts]
+
+    def scan(self, port_range=None, fast=False, scripts=None, on_host=None, on_port=None, chunk_size=None,
+             sweep_window=None, sweep_timeout=1, adaptive=False, checkpoint=False, checkpoint_dir=None, udp_ports=0):
         """
         Runs a scan on this Honeypot for data acquisition.
+        When a group of addresses was given all of them are scanned by a single nmap run,
+        use get_host_views() to access the results for each host.
+
+        Results are available through the accessors as soon as nmap reports them, so they can
+        already be used from other threads (e.g. by on_port) while the scan is still running.
+
+        :param port_range: ports to scan (e.g. '20-100' or '-' for all ports)
+        :param fast: use -Pn and -T5
+        :param scripts: list of .nse scripts to run during the scan, their output is
+                        served later by run_nmap_script() without starting nmap again
+        :param on_host: called with (host, host record) as soon as nmap reports a host
+        :param on_port: called with (host, protocol, port, port record) as soon as nmap reports a port
+        :param chunk_size: split port_range in chunks of this many ports which are scanned one after another,
+                           so the ports of the first chunks are reported before the whole range is done
+        :param sweep_window: find open ports in port_range with a TCP connect sweep keeping this many
+                             connection attempts in flight, then run nmap only on the open ports
+        :param sweep_timeout: seconds to wait for each connection of the sweep
+        :param adaptive: measure the round trip time to the targets first and derive the nmap timing options
+                         and the timeouts used later by probe(), get_banners() and the web requests from it,
+                         nothing is measured if the reports of all nmap runs are cached or checkpointed
+        :param checkpoint: save the report of every finished chunk on disk and reuse the saved chunks
+                           of an interrupted scan with the same targets and options, the port range is split
+                           in chunks of checkpoint_chunk_size ports if chunk_size is not given
+        :param checkpoint_dir: folder for the checkpoints
+        :param udp_ports: look for this many of the most common UDP services at the same time as nmap runs
+                          (see honeypots.udp), the ones which answer are added to the results as open udp ports
+        :raises: ScanFailure
         """
 
         args = '-sV -n --stats-every 1s'
@@ -98,58 +206,260 @@ class Honeypot:
         if fast:
             args += ' -Pn -T5'
 
-        if port_range:
-            args += ' -p '+port_range
+        scan_scripts = sorted({self._script_name(script) for script in scripts or []})
+
+        if scan_scripts:
+            args += ' --script ' + ','.join(scan_scripts)
+
+        sudo = False
 
         if self.scan_os:
 
             args += ' -O'
 
-            if platform.system() == 'Windows':
-                # No sudo on Windows systems, let UAC handle this
-                # FIXME workaround for the subnet python-nmap-bug.log also?
-                # FIXME somehow this also makes the command history of the terminal vanish?
-                self._nm.scan(hosts=self.address, arguments=args, sudo=False)
+            # No sudo on Windows systems, let UAC handle this
+            sudo = platform.system() != 'Windows'
+
+        open_ports = []
+
+        if port_range and sweep_window and parse_port_range(port_range):
+
+            # two phase scan, version detection runs only on the ports found open by the sweep
+
+            open_ports = self._probe_engine.sweep(self._sweep_targets, parse_port_range(port_range),
+                                                  sweep_window, sweep_timeout)
+
+            open_ports = sorted({port for ports in open_ports.values() for port in ports})
+
+            if open_ports:
+                port_range = format_port_range(open_ports)
+
+                if ' -Pn' not in args:
+                    args += ' -Pn'  # the hosts are known to be up
             else:
-                try:
-                    # FIXME this is just a workaround for the bug shown in python-nmap-bug.log
-                    self._nm.scan(hosts=self.address, arguments=args, sudo=True)
-                except Exception as e:
-                    if self.__debug:
-                        print(e.__class__, "occured trying again with get_last_output")
-                    self._nm.get_nmap_last_output()
-                    self._nm.scan(hosts=self.address, arguments=args, sudo=True)
+                # nothing to identify, only report which hosts are up
+                args = '-sn -n'
+                port_range = None
+
+        # the measured timing and the limits change from run to run, they must not keep a cached report
+        # or a checkpoint from being found
+        scan_args = args
+
+        if checkpoint and port_range and not chunk_size:
+            chunk_size = self.checkpoint_chunk_size
+
+        if port_range and (chunk_size or len(port_range) > self.max_port_argument):
+            # long port lists would not fit on the command line, see max_port_argument
+            chunks = split_port_range(port_range, chunk_size, self.max_port_argument)
         else:
+            chunks = [port_range]
 
-            try:
-                # FIXME this is just a workaround for the bug shown in python-nmap-bug.log
-                self._nm.scan(hosts=self.address, arguments=args, sudo=False)
-            except Exception as e:
-                if self.__debug:
-                    print(e.__class__, "occured trying again with get_last_output")
-                self._nm.get_nmap_last_output()
-                self._nm.scan(hosts=self.address, arguments=args, sudo=False)
-
-        hosts = self._nm.all_hosts()
-
-        if hosts:
-            self.host = hosts[0]
+        chunk_args = [scan_args + (' -p ' + chunk if chunk else '') for chunk in chunks]
+
+        if checkpoint:
+            checkpoint = ScanCheckpoint(self._scan_targets, scan_args, [chunk or '' for chunk in chunks],
+                                        checkpoint_dir)
+
+            if checkpoint.completed and self._runner.show_progress:
+                print("Resuming scan,", checkpoint.completed, "of", len(chunks), "port ranges already done")
+
+        # nothing to measure if nmap will not run
+        self.timing = None
+
+        if adaptive and not all((checkpoint and checkpoint.report_file(index)) or
+                                self._runner.cached(self._scan_targets, chunk_args[index])
+                                for index in range(len(chunks))):
+
+            # ports found by the sweep answer for sure, otherwise try some common ones (RSTs are fine too,
+            # the ones without any answer are left out)
+            rtt_ports = open_ports[:3] or self.rtt_ports
+
+            self.timing = Timing(self._probe_engine.measure_rtt(self._sweep_targets[:self.rtt_targets], rtt_ports,
+                                                                count=2))
+
+            if self.timing.measured:
+                max_parallelism = self._limiter.max_parallelism(len(self._sweep_targets)) if self._limiter else None
+                args += ' ' + self.timing.nmap_arguments(max_parallelism)
+
+        if self._limiter is not None and self._limiter.nmap_arguments():
+            args += ' ' + self._limiter.nmap_arguments(len(self._sweep_targets))
+
+        self._cache.new_generation()
+        self.scan_scripts = scan_scripts
+        self._scan_result = ScanResult()
+        self.hosts = []
+        self.host = None
+
+        def host_found(host, record):
+            if self.host is None:
+                self.host = host
+
+            if on_host:
+                on_host(host, record)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+
+            # UDP discovery mostly waits for answers, so it runs next to nmap instead of after it
+            udp = executor.submit(self._probe_engine.udp_discover, self._sweep_targets, top_udp_ports(udp_ports),
+                                  min(2, self.probe_timeout)) if udp_ports else None
+
+            for index, chunk in enumerate(chunks):
+                try:
+                    if checkpoint and checkpoint.report_file(index):
+                        # done by an earlier run
+                        self._runner.replay(checkpoint.report_file(index), on_host=host_found, on_port=on_port,
+                                            result=self._scan_result)
+                        continue
+
+                    report = io.BytesIO() if checkpoint else None
+
+                    self._runner.run(self._scan_targets, args + (' -p ' + chunk if chunk else ''), sudo=sudo,
+                                     on_host=host_found, on_port=on_port, result=self._scan_result, output=report,
+                                     cache_key=chunk_args[index])
+
+                    if checkpoint:
+                        checkpoint.save(index, report.getvalue())
+
+                except (NmapError, OSError) as e:
+                    self.hosts = []
+                    self.host = None
+                    raise ScanFailure("Scan failed,", e)
+
+        if udp is not None:
+            for address, ports in udp.result().items():
+
+                if not ports:
+                    continue
+
+                record = udp_host_record(address, ports)
+                self._scan_result.add_host(address, record)
+
+                if on_port:
+                    for port, port_record in record.ports['udp'].items():
+                        on_port(address, 'udp', port, port_record)
+
+        if checkpoint:
+            checkpoint.remove()
+
+        self.hosts = self._scan_result.all_hosts()
+
+        if self.hosts:
+            self.host = self.hosts[0]
         else:
             self.host = None
             raise ScanFailure("Requested host not available")
 
-        # TODO error on connection refused, check if self._nm[self.host]['status']['reason'] = conn_refused
+        # TODO error on connection refused, check if self._scan_result[self.host].status['reason'] = conn_refused
         # TODO also add -Pn option?
 
+    def load_scan(self, xml_file):
+        """
+        Uses a saved nmap XML report (e.g. from nmap -oX) instead of running a scan.
+        The address of this Honeypot is replaced by the hosts found in the report.
+
+        :param xml_file: path of the report
+        :raises: ScanFailure
+        """
+
+        self._cache.new_generation()
+        self._scan_result = ScanResult()
+
+        try:
+            self._runner.replay(xml_file, result=self._scan_result)
+        except (NmapError, OSError) as e:
+            self.hosts = []
+            self.host = None
+            raise ScanFailure("Could not load scan from", xml_file + ",", e)
+
+        self.hosts = self._scan_result.all_hosts()
+
+        if not self.hosts:
+            self.host = None
+            raise ScanFailure("No available host in", xml_file)
+
+        self.host = self.hosts[0]
+        self.address = self.host if len(self.hosts) == 1 else list(self.hosts)
+
+        # scripts that ran during the saved scan, their output is served from the report
+        match = re.search(r'--script[ =](\S+)', self._scan_result.command_line or '')
+        self.scan_scripts = sorted({self._script_name(script) for script in match.group(1).split(",")}) if match else []
+
+    @property
+    def probe_timeout(self):
+        """
+        Seconds to wait for a connection or a reply of a service, measured if the scan was adaptive.
+        Never longer than the time left until the deadline of the calling thread.
+        """
+        if self.timing is not None:
+            timeout = self.timing.probe_timeout
+        else:
+            timeout = Probe.default_timeout
+
+        return self._within_deadline(timeout)
+
+    def _within_deadline(self, timeout):
+        """
+        :param timeout: seconds
+        :return: the timeout shortened to the time left until the deadline of the calling thread
+        """
+        deadline = getattr(self._deadlines, 'at', None)
+
+        if deadline is None:
+            return timeout
+
+        # a timeout of 0 would mean no timeout at all for sockets
+        return max(0.01, min(timeout, deadline - time.monotonic()))
+
+    @contextmanager
+    def deadline(self, seconds):
+        """
+        Limits the network timeouts of the calling thread to the time left in the with block,
+        so a test that ran out of time stops waiting for the target soon
+
+        :param seconds: time available
+        """
+        self._deadlines.at = time.monotonic() + seconds
+
+        try:
+            yield
+        finally:
+            self._deadlines.at = None
+
+    @property
+    def scan_generation(self):
+        """Number of the current scan, cached data from older scans is not used"""
+        return self._cache.generation
+
+    @property
+    def banner_cache_hits(self):
+        return self._cache.stats('banner')[0]
+
+    @property
+    def banner_cache_misses(self):
+        return self._cache.stats('banner')[1]
+
+    def cache_stats(self, kind):
+        """
+        Reports the usage of the data cache
+        :param kind: 'websites' / 'css' / 'banner' / 'script'
+        :return: tuple of (hits, misses)
+        """
+        return self._cache.stats(kind)
+
+    @property
+    def _record(self):
+        """HostRecord of the current host"""
+        return self._scan_result[self.host]
+
     @property
     def os(self):
-        if self.scan_os and self.host and 'osmatch' in self._nm[self.host]:
-            if self._nm[self.host]['osmatch'] and self._nm[self.host]['osmatch'][0]['osclass']:
-                return self._nm[self.host]['osmatch'][0]['osclass'][0]['osfamily']
+        if self.scan_os and self.host and self._record.osmatch:
+            if self._record.osmatch[0]['osclass']:
+                return self._record.osmatch[0]['osclass'][0]['osfamily']
 
     @property
     def ip(self):
-        return self._nm[self.host]['addresses']['ipv4']
+        return self._record.addresses['ipv4']
 
     def has_tcp(self, port_number):
         """
@@ -157,7 +467,7 @@ class Honeypot:
         :param port_number: port number
         :return: port status boolean
         """
-        return self._nm[self.host].has_tcp(port_number)
+        return self._record.port('tcp', port_number) is not None
 
     def get_service_ports(self, service_name, protocol):
         """
@@ -166,16 +476,15 @@ class Honeypot:
         :param protocol: 'tcp' or 'udp'
         :return: list of port numbers (a certain service can run on multiple ports)
         """
-        results = []
+        return list(self._record.services(protocol).get(service_name, ()))
 
-        if protocol not in self._nm[self.host]:
-            return results
-
-        for port, attributes in self._nm[self.host][protocol].items():
-            if attributes['name'] == service_name:
-                results.append(port)
-
-        return results
+    def get_services(self, protocol):
+        """
+        Groups the ports of the Honeypot by service
+        :param protocol: 'tcp' or 'udp'
+        :return: dict of service name -> list of port numbers
+        """
+        return {name: list(ports) for name, ports in self._record.services(protocol).items()}
 
     def get_service_name(self, port, protocol):
         """
@@ -184,10 +493,10 @@ class Honeypot:
         :param protocol: 'tcp' or 'udp'
         :return: service name
         """
-        if protocol not in self._nm[self.host]:
+        if protocol not in self._record.ports:
             return None
 
-        return self._nm[self.host][protocol][port]["name"]
+        return self._record.ports[protocol][port].name
 
     def get_all_ports(self, protocol):
         """
@@ -195,10 +504,7 @@ class Honeypot:
         :param protocol: 'tcp' / 'udp'
         :return: list of ports
         """
-        if protocol not in self._nm[self.host]:
-            return []
-        else:
-            return list((self._nm[self.host][protocol]).keys())
+        return list(self._record.ports.get(protocol, ()))
 
     def get_service_product(self, protocol, port):
         """
@@ -207,15 +513,31 @@ class Honeypot:
         :param port: port number
         :return: description string
         """
-        # TODO cache requests for all parsers
-        if protocol not in self._nm[self.host]:
+        if protocol not in self._record.ports:
             return None
         else:
-            return self._nm[self.host][protocol][port]['product']
+            return self._record.ports[protocol][port].product
+
+    def get_products(self, protocol):
+        """
+        Groups the ports of the Honeypot by the product description reported by nmap
+        :param protocol: 'tcp' / 'udp'
+        :return: dict of product description -> list of port numbers
+        """
+        return {product: list(ports) for product, ports in self._record.products(protocol).items()}
+
+    def get_product_descriptions(self, protocol):
+        """
+        Groups the ports of the Honeypot by product, version and extra info reported by nmap
+        :param protocol: 'tcp' / 'udp'
+        :return: dict of description (e.g. 'OpenSSH 5.1p1 Debian 5 protocol 2.0') -> list of port numbers
+        """
+        return {text: list(ports) for text, ports in self._record.descriptions(protocol).items()}
 
     def run_nmap_script(self, script, port, protocol='tcp'):
         """
-        Runs a .nse script on the specified port range
+        Runs a .nse script on the specified port range.
+        Scripts requested when the scan was started are not executed again, their output is taken from the scan.
         :param script: <script_name>.nse
         :param port: port / port range
         :param protocol: 'tcp'/'udp'
@@ -223,15 +545,74 @@ class Honeypot:
         :raises: ScanFailure
         """
 
-        tmp = nmap.PortScanner()
-        tmp.scan(hosts=self.address, arguments="--script " + script + " -p " + str(port))
+        name = self._script_name(script)
 
-        port_info = tmp[self.address][protocol][int(port)]
+        if name in self.scan_scripts:
+            # already executed during the scan, no need to start nmap again
+            port_record = self._record.port(protocol, int(port))
 
-        if 'script' in port_info:
-            return port_info['script'][script.split('.')[0]]
-        else:
-            raise ScanFailure("Script execution failed")
+            if port_record is not None and port_record.scripts and name in port_record.scripts:
+                return port_record.scripts[name]
+            else:
+                raise ScanFailure("Script execution failed")
+
+        output = self._cache.get('script', (script, str(port), protocol))
+
+        if output is None:
+
+            try:
+                args = "--script " + script + " -p " + str(port)
+                scan_args = args
+
+                if self._limiter is not None and self._limiter.nmap_arguments():
+                    args += ' ' + self._limiter.nmap_arguments()
+
+                tmp = self._runner.run(self.address, args, cache_key=scan_args)
+                scripts = tmp[self.address].port(protocol, int(port)).scripts or {}
+            except (NmapError, KeyError, AttributeError):
+                scripts = {}
+
+            if name in scripts:
+                output = scripts[name]
+            else:
+                output = ScanFailure("Script execution failed")
+
+            self._cache.store('script', (script, str(port), protocol), output)
+
+        if isinstance(output, ScanFailure):
+            raise output
+
+        return output
+
+    @staticmethod
+    def _script_name(script):
+        """
+        :param script: <script_name>.nse or <script_name>
+        :return: <script_name>
+        """
+        if script.endswith('.nse'):
+            return script[:-len('.nse')]
+
+        return script
+
+    def probe(self, probes):
+        """
+        Runs a list of probes concurrently on the shared probe engine.
+        Banners read by the probes are added to the banner cache.
+        :param probes: list of Probe objects
+        :return: the same list of Probe objects, completed
+        """
+        for probe in probes:
+            if probe.timeout is not None:
+                probe.timeout = self._within_deadline(probe.timeout)
+
+        self._probe_engine.run(probes, self.probe_timeout)
+
+        for probe in probes:
+            if probe.address == self.address and probe.banner is not None:
+                self._cache.store('banner', (probe.port, 'tcp'), probe.banner, replace=False)
+
+        return probes
 
     def get_banner(self, port, protocol='tcp'):
         """
@@ -241,53 +622,100 @@ class Honeypot:
         :return: banner as string
         :raises: ScanFailure
         """
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.settimeout(5)
+        banner = self.get_banners([port], protocol)[port]
 
-        try:
-            s.connect((self.address, port))
-            recv = s.recv(1024)
-        except socket.error as e:
-            raise ScanFailure("Banner grab failed for port", port, e)
+        if isinstance(banner, ScanFailure):
+            raise banner
 
-        return recv
+        return banner
 
-    def get_websites(self):
+    def get_banners(self, ports, protocol='tcp', timeout=None):
         """
-        Gets websites for all active web servers found on the target
-        :return: list of website content strings
+        Grab banners on all specified ports at the same time.
+        Each banner is read only once per scan, afterwards it is served from the cache.
+        Failures are cached too, together with the timeout they happened with, a caller
+        willing to wait longer tries again.
+        :param ports: list of port numbers
+        :param protocol: 'tcp' / 'udp'
+        :param timeout: seconds to wait for the connection and for the banner, None for probe_timeout
+        :return: dict of port -> banner, or port -> ScanFailure if the banner grab failed
         """
+        if timeout is None:
+            timeout = self.probe_timeout
 
-        if self.websites and self.scan_id == id(self.host):
-            # if cache is not empty and we are still on the most recent scan
-            return self.websites
+        banners = {port: self._cache.get('banner', (port, protocol)) for port in ports}
 
-        # refresh cache
+        missing = [port for port in ports if banners[port] is None or
+                   (isinstance(banners[port], ScanFailure) and banners[port].timeout is not None and
+                    banners[port].timeout < self._within_deadline(timeout))]
 
-        self.websites = []
+        for probe in self.probe([Probe(self.address, port, timeout=timeout) for port in missing]):
+            if probe.error:
+                banners[probe.port] = ScanFailure("Banner grab failed for port", probe.port, probe.error.value)
+                banners[probe.port].timeout = probe.timeout
+            else:
+                banners[probe.port] = probe.banner
 
-        target_ports = self.get_service_ports('http', 'tcp')
-        # TODO target_ports += self.get_service_ports('https', 'tcp')
+            self._cache.store('banner', (probe.port, protocol), banners[probe.port])
 
-        for port in target_ports:
+        return banners
 
-            try:
+    def _web_ports(self):
+        """
+        :return: tuple of the web server ports found so far, the key of the website and css caches
+        """
+        # TODO add self.get_service_ports('https', 'tcp')
+        return tuple(sorted(self.get_service_ports('http', 'tcp')))
 
-                request = urllib.request.urlopen('http://' + self.ip + ':' + str(port) + '/',
-                                                 timeout=5)
+    def _fetch_web_content(self, target_ports):
+        """
+        Fetches the homepage and the stylesheet of all active web servers in one pass
+        and refreshes both the website and the css caches.
+        The caches are keyed by the ports, a scan that is still running may find more web servers.
+        :param target_ports: tuple from _web_ports()
+        :return: tuple of (list of website content, list of stylesheets)
+        """
 
-                if request.headers.get_content_charset() is None:
-                    content = request.read()
-                else:
-                    content = request.read().decode(request.headers.get_content_charset())
+        paths = ['/', '/style.css']
+
+        content, errors = self._web_fetcher.fetch(self.ip, target_ports, paths, self.probe_timeout)
+
+        if self.__debug:
+            for (port, path), e in errors.items():
+                print('Failed to fetch', path, 'for site', self.ip, str(port), e)
 
-                self.websites.append(content)
+        websites = [content[(port, '/')] for port in target_ports if (port, '/') in content]
+        css = [content[(port, '/style.css')] for port in target_ports if (port, '/style.css') in content]
 
-            except Exception as e:
-                if self.__debug:
-                    print('Failed to fetch homepage for site', self.ip, str(port), e)
+        self._cache.store('websites', target_ports, websites)
+        self._cache.store('css', target_ports, css)
 
-        return self.websites
+        return websites, css
+
+    def get_certificate_error(self, port):
+        """
+        Verifies the SSL certificate of a https server
+        :param port: port number
+        :return: None if the certificate is valid, otherwise the reason reported by ssl
+                 (e.g. 'CERTIFICATE_VERIFY_FAILED')
+        :raises: ScanFailure if the connection failed for other reasons
+        """
+        return self._web_fetcher.check_certificate(self.ip, port, self.probe_timeout)
+
+    def get_websites(self):
+        """
+        Gets websites for all active web servers found on the target
+        :return: list of website content strings
+        """
+
+        target_ports = self._web_ports()
+        websites = self._cache.get('websites', target_ports)
+
+        if websites is None:
+            # cache is not filled for the most recent scan or for these ports
+            websites, css = self._fetch_web_content(target_ports)
+
+        return websites
 
     def get_websites_css(self):
         """
@@ -296,36 +724,566 @@ class Honeypot:
         """
         # TODO create a Website class containing stylesheet and others?
 
-        if self.css and self.scan_id == id(self.host):
-            # if cache is not empty and we are still on the most recent scan
-            return self.css
+        target_ports = self._web_ports()
+        css = self._cache.get('css', target_ports)
 
-        # refresh cache
+        if css is None:
+            # cache is not filled for the most recent scan or for these ports
+            websites, css = self._fetch_web_content(target_ports)
 
-        self.css = []
+        return css
 
-        target_ports = self.get_service_ports('http', 'tcp')
-        # target_ports += self.get_service_ports('https', 'tcp')
 
-        for port in target_ports:
+class WebFetcher:
+    """
+    Fetches a list of paths from the web servers of a target.
+    All ports are queried in parallel and every port uses a single keep-alive connection for all its paths.
+    """
 
-            try:
+    redirect_codes = (301, 302, 303, 307, 308)
+    max_redirects = 10  # same as urllib
+
+    def __init__(self, timeout=5, max_workers=16, recorder=None, limiter=None):
+        """
+        :param timeout: socket timeout in seconds for every request
+        :param max_workers: maximum number of ports queried at the same time
+        :param recorder: Recorder for the requests and responses
+        :param limiter: TargetLimiter shared with the other users of the targets
+        """
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.recorder = recorder
+        self.limiter = limiter or TargetLimiter()
+
+    def fetch(self, address, ports, paths, timeout=None):
+        """
+        Fetches every path from every port
+        :param address: ip address of the target
+        :param ports: list of http ports
+        :param paths: list of paths to request from each port
+        :param timeout: socket timeout for these requests, None for the timeout of the fetcher
+        :return: tuple of two dicts keyed by (port, path), the first one holds the content
+                 (decoded if the server specified a charset, bytes otherwise), the second one
+                 holds the exception for each failed request
+        """
+        content = {}
+        errors = {}
+
+        if not ports:
+            return content, errors
+
+        if self.recorder is not None and self.recorder.replaying:
+            return self._replay(address, ports, paths)
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(ports))) as executor:
+            for port_content, port_errors in executor.map(
+                    lambda port: self._fetch_port(address, port, paths, timeout or self.timeout), ports):
+                content.update(port_content)
+                errors.update(port_errors)
+
+        if self.recorder is not None:
+            for (port, path), page in content.items():
+                self.recorder.record('http', (address, port, path), {'content': page})
+
+            for (port, path), e in errors.items():
+                self.recorder.record('http', (address, port, path), {'error': str(e)})
+
+        return content, errors
 
-                request = urllib.request.urlopen('http://' + self.ip + ':' + str(port) + '/style.css',
-                                                 timeout=5)
+    def _replay(self, address, ports, paths):
 
-                if request.headers.get_content_charset() is None:
-                    content = request.read()
+        content = {}
+        errors = {}
+
+        for port in ports:
+            for path in paths:
+                response = self.recorder.lookup('http', (address, port, path), {'error': "not in the recording"})
+
+                if 'content' in response:
+                    content[(port, path)] = response['content']
                 else:
-                    content = request.read().decode(request.headers.get_content_charset())
+                    errors[(port, path)] = ScanFailure(response['error'])
+
+        return content, errors
+
+    def check_certificate(self, address, port, timeout=None):
+        """
+        Connects to a https server and verifies its certificate
+        :param address: ip address of the target
+        :param port: port number
+        :param timeout: socket timeout, None for the timeout of the fetcher
+        :return: None if the certificate is valid, otherwise the reason reported by ssl
+        :raises: ScanFailure if the connection failed for other reasons
+        """
+
+        if self.recorder is not None and self.recorder.replaying:
+            outcome = self.recorder.lookup('certificate', (address, port), {'failure': "not in the recording"})
+        else:
+            conn = http.client.HTTPSConnection(address, port=port, timeout=timeout or self.timeout)
+
+            with self.limiter.connection(address):
+                try:
+                    conn.request('GET', '/')
+                    outcome = {'reason': None}
+                except ssl.SSLError as e:
+                    outcome = {'reason': e.reason}
+                except Exception as e:
+                    outcome = {'failure': str(e)}
+                finally:
+                    conn.close()
+
+            if self.recorder is not None:
+                self.recorder.record('certificate', (address, port), outcome)
+
+        if 'failure' in outcome:
+            raise ScanFailure(outcome['failure'])
+
+        return outcome['reason']
+
+    def _fetch_port(self, address, port, paths, timeout):
+
+        content = {}
+        errors = {}
+
+        conn = http.client.HTTPConnection(address, port=port, timeout=timeout)
+
+        # one slot for the kept-alive connection of the port
+        with self.limiter.connection(address):
+            try:
+                for number, path in enumerate(paths):
+
+                    if number and conn.sock is None:
+                        # closed after an error or by the server, opened again for this path
+                        self.limiter.acquire(address, slot=False)
+
+                    try:
+                        content[(port, path)] = self._get(conn, address, port, path, timeout)
+                    except Exception as e:
+                        errors[(port, path)] = e
+                        conn.close()  # start over with a clean connection for the next path
+            finally:
+                conn.close()
+
+        return content, errors
+
+    def _get(self, conn, address, port, path, timeout):
+
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # the server closed the kept-alive connection, try once more on a new one
+            conn.close()
+            self.limiter.acquire(address, slot=False)
+            conn.request('GET', path)
+            response = conn.getresponse()
+
+        body = response.read()
+        url = 'http://' + address + ':' + str(port) + path
+        redirects = 0
+
+        while response.status in self.redirect_codes and response.headers.get('Location'):
+
+            if redirects == self.max_redirects:
+                raise urllib.error.HTTPError(url, response.status, "Too many redirects", response.headers, None)
+
+            redirects += 1
+            url = urllib.parse.urljoin(url, response.headers['Location'])
+
+            if urllib.parse.urlsplit(url).hostname == address:
+                # the slot held for the port covers the new connection, the kept-alive one is given up for it
+                conn.close()
+
+            response, body = self._follow(url, address, timeout)
+
+        if response.status >= 400:
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+
+        if response.headers.get_content_charset() is None:
+            return body
+        else:
+            return body.decode(response.headers.get_content_charset())
+
+    def _follow(self, url, address, timeout):
+        """
+        Requests the location of a redirect on a new connection, within the limits of its server
+        :param url: absolute url
+        :param address: ip address of the target, its slot is already held by the caller
+        :param timeout: socket timeout
+        :return: tuple of (response, body)
+        """
+        parts = urllib.parse.urlsplit(url)
+
+        if parts.scheme == 'https':
+            conn = http.client.HTTPSConnection(parts.hostname, port=parts.port, timeout=timeout)
+        elif parts.scheme == 'http':
+            conn = http.client.HTTPConnection(parts.hostname, port=parts.port, timeout=timeout)
+        else:
+            raise ScanFailure("Redirect to unsupported location", url)
+
+        path = parts.path or '/'
+
+        if parts.query:
+            path += '?' + parts.query
+
+        if parts.hostname == address:
+            # the slot is held by the caller, only the rate limit applies
+            self.limiter.acquire(address, slot=False)
+            return self._request(conn, path)
+
+        with self.limiter.connection(parts.hostname):
+            return self._request(conn, path)
+
+    @staticmethod
+    def _request(conn, path):
+        """
+        Sends one GET request and closes the connection
+        :param conn: HTTPConnection or HTTPSConnection
+        :param path: path with query
+        :return: tuple of (response, body)
+        """
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            return response, response.read()
+        finally:
+            conn.close()
+
+
+class Probe:
+    """
+    One conversation with a port: connect, optionally read the greeting of the service
+    and then send each payload of the script, reading one reply after every payload.
+    """
+
+    default_timeout = 5  # seconds
+
+    def __init__(self, address, port, script=(), read_banner=True, timeout=None, recv_size=1024):
+        """
+        :param address: ip address of the target
+        :param port: port number
+        :param script: list of byte strings to send, one reply is read after each of them
+        :param read_banner: read the greeting of the service before sending anything
+        :param timeout: seconds to wait for the connection and for every reply,
+                        None for the timeout of the Honeypot or engine running the probe
+        :param recv_size: maximum number of bytes read for every reply
+        """
+        self.address = address
+        self.port = port
+        self.script = list(script)
+        self.read_banner = read_banner
+        self.timeout = timeout
+        self.recv_size = recv_size
+
+        self.connected = False  # connection was established
+        self.responses = []  # banner (if requested) followed by the reply to each payload
+        self.error = None  # ScanFailure describing what interrupted the conversation
+
+    @property
+    def banner(self):
+        """Greeting of the service or None if it was not read"""
+        if self.read_banner and self.responses:
+            return self.responses[0]
+
+    @property
+    def response(self):
+        """Last reply received or None"""
+        if self.responses:
+            return self.responses[-1]
+
+
+class ProbeEngine:
+    """
+    Runs Probes concurrently using asyncio.
+    The number of simultaneous connections is limited both in total and for each target.
+    """
+
+    def __init__(self, per_target_limit=8, limit=64, recorder=None, limiter=None):
+        """
+        :param per_target_limit: maximum number of open connections to a single target, if no limiter is given
+        :param limit: maximum number of open connections in total
+        :param recorder: Recorder for the conversations
+        :param limiter: TargetLimiter shared with the other users of the targets
+        """
+        self.limit = limit
+        self.recorder = recorder
+        self.limiter = limiter or TargetLimiter(max_connections=per_target_limit)
+
+    def run(self, probes, default_timeout=Probe.default_timeout):
+        """
+        Runs all probes and waits for them to finish. Failures are stored in Probe.error, nothing is raised.
+        :param probes: list of Probe objects
+        :param default_timeout: timeout for the probes which do not specify one
+        :return: the same list of Probe objects, completed
+        """
+        for probe in probes:
+            if probe.timeout is None:
+                probe.timeout = default_timeout
 
-                self.css.append(content)
+        if self.recorder is not None and self.recorder.replaying:
+            for probe in probes:
+                self._replay_probe(probe)
 
-            except Exception as e:
-                if self.__debug:
-                    print('Failed to fetch stylesheet for site', self.ip, str(port), e)
+            return probes
+
+        if probes:
+            run_coroutine(self._run_all(probes))
+
+        if self.recorder is not None:
+            for probe in probes:
+                self.recorder.record('probe', self._probe_key(probe),
+                                     {'connected': probe.connected, 'responses': probe.responses,
+                                      'error': probe.error.value if probe.error else None})
+
+        return probes
+
+    @staticmethod
+    def _probe_key(probe):
+        return probe.address, probe.port, probe.script, probe.read_banner, probe.recv_size
+
+    def _replay_probe(self, probe):
+
+        conversation = self.recorder.lookup('probe', self._probe_key(probe))
+
+        if conversation is None:
+            probe.error = ScanFailure("Connection to port", probe.port, "failed:", "not in the recording")
+            return
+
+        probe.connected = conversation['connected']
+        probe.responses = conversation['responses']
+
+        if conversation['error']:
+            probe.error = ScanFailure(conversation['error'])
+
+    def sweep(self, addresses, port_ranges, window=256, timeout=1):
+        """
+        Finds open TCP ports with a connect sweep. Needs no special privileges.
+
+        :param addresses: list of ip addresses
+        :param port_ranges: list of (first port, last port) tuples
+        :param window: maximum number of connection attempts in flight
+        :param timeout: seconds to wait for each connection
+        :return: dict of address -> sorted list of open ports
+        """
+        if self.recorder is not None and self.recorder.replaying:
+            recorded = self.recorder.lookup('sweep', (addresses, port_ranges), {})
+            return {address: recorded.get(address, []) for address in addresses}
+
+        open_ports = {address: [] for address in addresses}
+
+        # ports are the outer loop so the load is spread over all targets
+        jobs = ((address, port) for start, end in port_ranges for port in range(start, end + 1)
+                for address in addresses)
+
+        run_coroutine(self._sweep(jobs, open_ports, window, timeout))
+
+        open_ports = {address: sorted(ports) for address, ports in open_ports.items()}
+
+        if self.recorder is not None:
+            self.recorder.record('sweep', (addresses, port_ranges), open_ports)
+
+        return open_ports
+
+    def measure_rtt(self, addresses, ports, count=3, timeout=2):
+        """
+        Measures the round trip time with TCP handshakes. Refused connections are measured too.
+        Each port gets one handshake first, only the ports which answered it are measured further,
+        so ports dropped by a firewall do not count as packet loss. Attempts to those ports without
+        an answer are lost.
+
+        :param addresses: list of ip addresses
+        :param ports: list of ports to try on every address
+        :param count: number of handshakes for every port, the answering ports get more of them
+                      if only a few of the ports answered
+        :param timeout: seconds after which an attempt counts as lost
+        :return: list of round trip times in seconds, None for every lost attempt,
+                 empty if no port answered at all
+        """
+        if self.recorder is not None and self.recorder.replaying:
+            return self.recorder.lookup('rtt', (addresses, ports, count), [])
+
+        jobs = [(address, port) for address in addresses for port in ports]
+
+        first = run_coroutine(self._measure_all(jobs, timeout))
+        answering = [job for job, rtt in zip(jobs, first) if rtt is not None]
+
+        samples = [rtt for rtt in first if rtt is not None]
+
+        if answering:
+            # as many samples as if all ports had answered, within reason
+            repeat = min(-(-len(jobs) * count // len(answering)) - 1, 4 * count)
+            samples += run_coroutine(self._measure_all(answering * repeat, timeout))
+
+        if self.recorder is not None:
+            self.recorder.record('rtt', (addresses, ports, count), samples)
+
+        return samples
+
+    async def _measure_all(self, jobs, timeout):
+
+        return await asyncio.gather(*(self._handshake(address, port, timeout) for address, port in jobs))
+
+    async def _handshake(self, address, port, timeout):
+
+        async with self.limiter.connection(address):
+
+            start = time.monotonic()
+
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(address, port), timeout)
+            except ConnectionRefusedError:
+                return time.monotonic() - start  # the RST came back just as fast as a SYN/ACK would
+            except (OSError, asyncio.TimeoutError):
+                return None
+
+            rtt = time.monotonic() - start
+            writer.close()
+
+            return rtt
+
+    def udp_discover(self, addresses, services, timeout=2, retries=1):
+        """
+        Finds open UDP ports by sending each service a request it answers to. Needs no special privileges.
+        Ports without an answer are either closed, filtered or not running the expected service.
+
+        :param addresses: list of ip addresses
+        :param services: list of (port, service name, payload) tuples, see honeypots.udp
+        :param timeout: seconds to wait for an answer after each request
+        :param retries: number of times the request is sent again if there is no answer
+        :return: dict of address -> {port -> service name} for the ports which answered
+        """
+        ports = [port for port, name, payload in services]
+
+        if self.recorder is not None and self.recorder.replaying:
+            recorded = self.recorder.lookup('udp', (addresses, ports), {})
+            return {address: {int(port): name for port, name in recorded.get(address, {}).items()}
+                    for address in addresses}
+
+        found = {address: {} for address in addresses}
+
+        run_coroutine(self._udp_all(addresses, services, timeout, retries, found))
+
+        if self.recorder is not None:
+            # JSON keys are strings
+            self.recorder.record('udp', (addresses, ports),
+                                 {address: {str(port): name for port, name in open_ports.items()}
+                                  for address, open_ports in found.items()})
+
+        return found
+
+    async def _udp_all(self, addresses, services, timeout, retries, found):
+
+        limit = asyncio.Semaphore(self.limit)
+
+        async def discover(address, port, name, payload):
+            async with limit, self.limiter.connection(address):
+                if await self._udp_request(address, port, payload, timeout, retries) is not None:
+                    found[address][port] = name
+
+        await asyncio.gather(*(discover(address, port, name, payload)
+                               for address in addresses for port, name, payload in services))
+
+    @staticmethod
+    async def _udp_request(address, port, payload, timeout, retries):
+
+        loop = asyncio.get_event_loop()
+        reply = loop.create_future()
+
+        class Receiver(asyncio.DatagramProtocol):
+
+            def datagram_received(self, data, addr):
+                if not reply.done():
+                    reply.set_result(data)
+
+            def error_received(self, exc):
+                if not reply.done():
+                    reply.set_result(None)  # ICMP port unreachable, the port is closed
+
+        try:
+            transport, protocol = await loop.create_datagram_endpoint(Receiver, remote_addr=(address, port))
+        except OSError:
+            return None
+
+        try:
+            for attempt in range(retries + 1):
+                transport.sendto(payload)
+
+                try:
+                    return await asyncio.wait_for(asyncio.shield(reply), timeout)
+                except asyncio.TimeoutError:
+                    continue
+        finally:
+            transport.close()
+
+        return None
+
+    async def _sweep(self, jobs, open_ports, window, timeout):
+
+        async def worker():
+            for address, port in jobs:
+
+                # the window limits the attempts in flight, only the rate is limited per target
+                await self.limiter.acquire_async(address, slot=False)
+
+                try:
+                    reader, writer = await asyncio.wait_for(asyncio.open_connection(address, port), timeout)
+                except (OSError, asyncio.TimeoutError):
+                    continue
+
+                open_ports[address].append(port)
+                writer.close()
+
+        await asyncio.gather(*(worker() for _ in range(window)))
+
+    async def _run_all(self, probes):
+
+        limit = asyncio.Semaphore(self.limit)
+
+        await asyncio.gather(*(self._run_probe(probe, limit) for probe in probes))
+
+    async def _run_probe(self, probe, limit):
+
+        async with limit, self.limiter.connection(probe.address):
+
+            try:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(probe.address, probe.port),
+                                                        probe.timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                probe.error = ScanFailure("Connection to port", probe.port, "failed:",
+                                          getattr(e, "strerror", None) or "timed out")
+                return
+
+            probe.connected = True
+
+            try:
+                if probe.read_banner:
+                    probe.responses.append(await asyncio.wait_for(reader.read(probe.recv_size), probe.timeout))
+
+                for payload in probe.script:
+                    writer.write(payload)
+                    await asyncio.wait_for(writer.drain(), probe.timeout)
+                    probe.responses.append(await asyncio.wait_for(reader.read(probe.recv_size), probe.timeout))
+
+            except (OSError, asyncio.TimeoutError) as e:
+                probe.error = ScanFailure("Communication with port", probe.port, "failed:",
+                                          getattr(e, "strerror", None) or "timed out")
+            finally:
+                writer.close()
+
+
+def run_coroutine(coroutine):
+    """
+    Runs a coroutine on a new event loop and waits for it (asyncio.run() is not available on Python 3.6)
+
+    :param coroutine: coroutine object
+    :return: result of the coroutine
+    """
+    loop = asyncio.new_event_loop()
 
-        return self.css
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
 
 
 class ScanFailure(Exception):
@@ -336,6 +1294,7 @@ class ScanFailure(Exception):
         :param report: description of the error
         """
         self.value = " ".join(str(r) for r in report)
+        self.timeout = None  # seconds waited before giving up, if the failure depends on it
 
     def __str__(self):
         return repr(self.value)
@@ -0,0 +1,210 @@
+# Checkpot - Honeypot Checker
+# Copyright (C) 2018  Vlad Florea
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# DISCLAIMER: All prerequisites (containers, additional programs, etc.)
+# and libraries that might be needed to run this program are property
+# of their original authors and carry their own separate licenses that
+# you should read to inform yourself about their terms.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# As this software is PROVIDED WITH ABSOLUTELY NO WARRANTY OF ANY KIND,
+# YOU USE THIS SOFTWARE AT YOUR OWN RISK!
+#
+# By using this tool YOU TAKE FULL LEGAL RESPONSIBILITY FOR ANY
+# POSSIBLE OUTCOME.
+#
+# We strongly recommend that you read all the information in the README.md
+# file (found in the root folder of this project) and even the
+# documentation (which you can find locally in the /docs/ folder or
+# at http://checkpot.readthedocs.io/) to make sure you fully
+# understand how this tool works and consult all laws that apply
+# to your use case.
+#
+# We strongly suggest that you keep this notice intact for all files.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# The local copy of the license should be located in the root folder of the app
+# in the file gpl-3.0.txt.
+#
+# You can contact the author and team at any time via the Checkpot official
+# GitHub page: https://github.com/honeynet/checkpot or via the Honeynet
+# official Slack channel: https://gsoc-slack.honeynet.org/ or
+#                         https://honeynetpublic.slack.com/
+#
+# You can contact us at any time and with any question, we are here to help!
+#
+# If you consider any information in this copyright notice might be incorrect,
+# outdated, arises any questions, raises any problems, etc. please contact us
+# and we will make it our top priority to fix it. We have the deepest respect
+# for the work of all authors and for all of our users.
+
+
+import asyncio
+import threading
+import time
+
+
+class TargetLimiter:
+    """
+    Limits the traffic sent to every target address, shared by all ways of talking to a target
+    (probes, sweeps, web requests, TLS handshakes) and turned into nmap options for the scan itself.
+
+    Each new connection takes a token from the token bucket of its target (rate tokens per second,
+    up to burst saved up) and one of the max_connections slots of the target until it is closed.
+    Can be used from threads and from asyncio code at the same time.
+    """
+
+    poll_interval = 0.05  # seconds between two checks while waiting for a free slot in asyncio code
+
+    def __init__(self, rate=None, burst=None, max_connections=8):
+        """
+        :param rate: new connections per second to each target, None for no limit
+        :param burst: connections which may be opened at once after an idle period, defaults to max_connections
+        :param max_connections: connections open to each target at the same time, None for no limit
+        """
+        self.rate = rate
+        self.burst = burst or max_connections or 1
+        self.max_connections = max_connections
+
+        self._condition = threading.Condition()
+        self._tokens = {}  # address -> (tokens, time of the last refill)
+        self._open = {}  # address -> number of open connections
+
+    def _try_acquire(self, address, slot=True):
+        """
+        Takes a token and a connection slot if both are available, must be called with the condition held
+
+        :param slot: take a connection slot, otherwise only a token
+        :return: 0 if acquired, otherwise seconds after which it makes sense to try again
+                 (None if it depends on a slot being released)
+        """
+        if slot and self.max_connections is not None and self._open.get(address, 0) >= self.max_connections:
+            return None  # wait for a release
+
+        if self.rate:
+            now = time.monotonic()
+            tokens, last = self._tokens.get(address, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+
+            if tokens < 1:
+                self._tokens[address] = (tokens, now)
+                return (1 - tokens) / self.rate
+
+            self._tokens[address] = (tokens - 1, now)
+
+        if slot:
+            self._open[address] = self._open.get(address, 0) + 1
+
+        return 0
+
+    def acquire(self, address, slot=True):
+        """
+        Waits until a new connection to the target is allowed, blocks the calling thread
+
+        :param address: ip address of the target
+        :param slot: take a connection slot which has to be released, otherwise only wait for the rate limit
+                     (for connections opened again under a slot that is already held)
+        """
+        with self._condition:
+            while True:
+                delay = self._try_acquire(address, slot)
+
+                if delay == 0:
+                    return
+
+                self._condition.wait(delay)
+
+    async def acquire_async(self, address, slot=True):
+        """
+        Waits until a new connection to the target is allowed without blocking the event loop
+
+        :param address: ip address of the target
+        :param slot: take a connection slot which has to be released, otherwise only wait for the rate limit
+                     (for connection attempts which are closed right away, e.g. by the connect sweep)
+        """
+        while True:
+            with self._condition:
+                delay = self._try_acquire(address, slot)
+
+            if delay == 0:
+                return
+
+            await asyncio.sleep(delay if delay is not None else self.poll_interval)
+
+    def release(self, address):
+        """
+        Gives back the slot of a closed connection
+
+        :param address: ip address of the target
+        """
+        with self._condition:
+            self._open[address] -= 1
+
+            if not self._open[address]:
+                del self._open[address]
+
+            self._condition.notify_all()
+
+    def connection(self, address):
+        """
+        Holds a connection slot of the target for the duration of a with block (or an async with block)
+
+        :param address: ip address of the target
+        """
+        return _Connection(self, address)
+
+    def nmap_arguments(self, target_count=1):
+        """
+        nmap has no limits per target, the limits of all targets scanned by one run are passed instead
+
+        :param target_count: number of targets scanned by the nmap run
+        :return: nmap options as string
+        """
+        arguments = []
+
+        if self.rate:
+            arguments += ['--max-rate', '{:g}'.format(self.rate * target_count)]
+
+        if self.max_connections is not None:
+            arguments += ['--max-parallelism', str(self.max_parallelism(target_count))]
+
+        return ' '.join(arguments)
+
+    def max_parallelism(self, target_count=1):
+        """
+        :param target_count: number of targets scanned by the nmap run
+        :return: maximum number of probes nmap may have in flight or None if unlimited
+        """
+        if self.max_connections is None:
+            return None
+
+        return self.max_connections * target_count
+
+
+class _Connection:
+    """Context manager returned by TargetLimiter.connection()"""
+
+    def __init__(self, limiter, address):
+        self.limiter = limiter
+        self.address = address
+
+    def __enter__(self):
+        self.limiter.acquire(self.address)
+
+    def __exit__(self, *exc_info):
+        self.limiter.release(self.address)
+
+    async def __aenter__(self):
+        await self.limiter.acquire_async(self.address)
+
+    async def __aexit__(self, *exc_info):
+        self.limiter.release(self.address)
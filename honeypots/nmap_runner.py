@@ -0,0 +1,822 @@
+# Checkpot - Honeypot Checker
+# Copyright (C) 2018  Vlad Florea
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# DISCLAIMER: All prerequisites (containers, additional programs, etc.)
+# and libraries that might be needed to run this program are property
+# of their original authors and carry their own separate licenses that
+# you should read to inform yourself about their terms.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# As this software is PROVIDED WITH ABSOLUTELY NO WARRANTY OF ANY KIND,
+# YOU USE THIS SOFTWARE AT YOUR OWN RISK!
+#
+# By using this tool YOU TAKE FULL LEGAL RESPONSIBILITY FOR ANY
+# POSSIBLE OUTCOME.
+#
+# We strongly recommend that you read all the information in the README.md
+# file (found in the root folder of this project) and even the
+# documentation (which you can find locally in the /docs/ folder or
+# at http://checkpot.readthedocs.io/) to make sure you fully
+# understand how this tool works and consult all laws that apply
+# to your use case.
+#
+# We strongly suggest that you keep this notice intact for all files.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# The local copy of the license should be located in the root folder of the app
+# in the file gpl-3.0.txt.
+#
+# You can contact the author and team at any time via the Checkpot official
+# GitHub page: https://github.com/honeynet/checkpot or via the Honeynet
+# official Slack channel: https://gsoc-slack.honeynet.org/ or
+#                         https://honeynetpublic.slack.com/
+#
+# You can contact us at any time and with any question, we are here to help!
+#
+# If you consider any information in this copyright notice might be incorrect,
+# outdated, arises any questions, raises any problems, etc. please contact us
+# and we will make it our top priority to fix it. We have the deepest respect
+# for the work of all authors and for all of our users.
+
+import hashlib
+import ipaddress
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+
+
+class NmapRunner:
+    """
+    Runs nmap with its XML report written to stdout and parses the report while the scan is running.
+    Host and port records are handed to the callbacks as soon as nmap reports them
+    (nmap writes the ports of a host once that host is finished).
+    """
+
+    default_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'checkpot', 'scans')
+
+    def __init__(self, nmap_path='nmap', show_progress=False, cache_ttl=0, cache_dir=None, recorder=None):
+        """
+        :param nmap_path: nmap executable
+        :param show_progress: print the progress reported by nmap (requires --stats-every in the arguments)
+        :param cache_ttl: keep the report of every scan on disk and reuse it for this many seconds
+                          when the same targets are scanned with the same arguments (0 disables the cache)
+        :param cache_dir: folder for the cached reports
+        :param recorder: Recorder which archives the reports or provides them instead of nmap
+        """
+        self.nmap_path = nmap_path
+        self.show_progress = show_progress
+        self.cache_ttl = cache_ttl
+        self.cache_dir = cache_dir or self.default_cache_dir
+        self.recorder = recorder
+
+    def run(self, targets, arguments, sudo=False, on_host=None, on_port=None, result=None, output=None,
+            cache_key=None):
+        """
+        Runs a scan and waits for it to finish.
+        If the scan cache is enabled and holds a fresh report for the same targets and arguments,
+        nmap is not started and the cached report is used instead. The same goes for a replaying recorder.
+
+        :param targets: target specification (space separated addresses)
+        :param arguments: nmap arguments
+        :param cache_key: the arguments which define the results of the scan, used instead of arguments
+                          to find a cached report (e.g. without timing options that change from run to run)
+        :param sudo: run nmap with sudo
+        :param on_host: called with (host, host record) for every host in the report
+        :param on_port: called with (host, protocol, port, port record) for every port in the report
+        :param result: ScanResult to add the hosts to (e.g. when a scan is split in several runs)
+        :param output: binary file object which receives a copy of the XML report once the scan is done
+        :return: ScanResult object
+        :raises: NmapError
+        """
+        command = [self.nmap_path, '-oX', '-'] + shlex.split(arguments) + targets.split()
+
+        if sudo:
+            command = ['sudo'] + command
+
+        if self.recorder is not None and self.recorder.replaying:
+
+            recorded = self.recorder.lookup('nmap', (targets, arguments))
+
+            if recorded is None:
+                raise NmapError("no recorded scan of", targets, "with arguments", arguments)
+
+            result = self._parse_report(recorded, on_host, on_port, result)
+
+            if output is not None:
+                output.write(recorded)
+
+            return result
+
+        cache_file = None
+
+        if self.cache_ttl > 0:
+            cache_file = self._cache_file(targets, cache_key or arguments)
+
+            try:
+                if time.time() - os.path.getmtime(cache_file) < self.cache_ttl:
+
+                    with open(cache_file, 'rb') as f:
+                        cached = f.read()
+
+                    result = self._parse_report(cached, on_host, on_port, result)
+
+                    if self.recorder is not None:
+                        self.recorder.record('nmap', (targets, arguments), cached)
+
+                    if output is not None:
+                        output.write(cached)
+
+                    return result
+            except (OSError, NmapError):
+                pass  # missing, expired or broken, scan again
+
+        recorded = [] if self.recorder is not None or output is not None else None
+
+        parser = NmapXMLParser(on_host, on_port, self._print_progress if self.show_progress else None, result)
+
+        with tempfile.TemporaryFile() as errors, _CacheWriter(cache_file) as report:
+
+            try:
+                process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=errors)
+            except OSError as e:
+                raise NmapError("could not start nmap:", e)
+
+            with process.stdout:
+                for chunk in iter(lambda: process.stdout.read1(65536), b''):
+                    parser.feed(chunk)
+
+                    if report:
+                        report.write(chunk)
+
+                    if recorded is not None:
+                        recorded.append(chunk)
+
+            process.wait()
+
+            errors.seek(0)
+            error_output = errors.read().decode(errors='replace').strip()
+
+            if self.show_progress:
+                print()
+
+            if process.returncode != 0 and not parser.hosts_found:
+                raise NmapError("nmap exited with code", process.returncode, error_output)
+
+            parser.close()
+
+            if report and process.returncode == 0:
+                report.keep = True
+
+        if self.recorder is not None:
+            self.recorder.record('nmap', (targets, arguments), b''.join(recorded))
+
+        if output is not None:
+            output.write(b''.join(recorded))
+
+        return parser.result
+
+    def replay(self, xml_file, on_host=None, on_port=None, result=None):
+        """
+        Reads a report saved by a previous scan (e.g. with nmap -oX) as if nmap was running
+
+        :param xml_file: path of the nmap XML report
+        :param on_host: called with (host, host record) for every host in the report
+        :param on_port: called with (host, protocol, port, port record) for every port in the report
+        :param result: ScanResult to add the hosts to
+        :return: ScanResult object
+        :raises: NmapError, OSError if the file can not be read
+        """
+        parser = NmapXMLParser(on_host, on_port, None, result)
+
+        with open(xml_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                parser.feed(chunk)
+
+        parser.close()
+
+        return parser.result
+
+    @staticmethod
+    def _parse_report(report, on_host, on_port, result):
+
+        parser = NmapXMLParser(on_host, on_port, None, result)
+        parser.feed(report)
+        parser.close()
+
+        return parser.result
+
+    def cached(self, targets, arguments):
+        """
+        :param targets: target specification
+        :param arguments: nmap arguments or the cache_key given to run()
+        :return: True if run() would use a cached report instead of starting nmap
+        """
+        if self.cache_ttl <= 0:
+            return False
+
+        try:
+            return time.time() - os.path.getmtime(self._cache_file(targets, arguments)) < self.cache_ttl
+        except OSError:
+            return False
+
+    def _cache_file(self, targets, arguments):
+
+        key = hashlib.sha256((self.nmap_path + '\0' + targets + '\0' + arguments).encode()).hexdigest()
+
+        return os.path.join(self.cache_dir, key + '.xml')
+
+    @staticmethod
+    def _print_progress(task, percent, remaining):
+
+        line = "\r" + task + ": " + percent + "%"
+
+        if remaining:
+            line += " (" + remaining + "s remaining)"
+
+        print("{:60}".format(line), end='', flush=True)
+
+
+class _CacheWriter:
+    """
+    Writes a report next to its final location and moves it there only if keep was set.
+    Entering gives None if path is None (caching disabled) or the cache folder is not writable.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: destination of the report or None
+        """
+        self.path = path
+        self.keep = False
+        self._file = None
+
+    def __enter__(self):
+
+        if self.path is None:
+            return None
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = tempfile.NamedTemporaryFile(dir=os.path.dirname(self.path), suffix='.part', delete=False)
+        except OSError:
+            return None  # caching is not possible, scan anyway
+
+        return self
+
+    def write(self, data):
+        self._file.write(data)
+
+    def __exit__(self, *exc_info):
+
+        if self._file is None:
+            return
+
+        self._file.close()
+
+        try:
+            if self.keep and exc_info[0] is None:
+                os.replace(self._file.name, self.path)
+            else:
+                os.remove(self._file.name)
+        except OSError:
+            pass
+
+
+class ScanCheckpoint:
+    """
+    Keeps the reports of the finished parts of a scan split in several nmap runs (e.g. port chunks) on disk,
+    so an interrupted scan can be resumed by replaying them and running only the missing parts.
+    Each part is written atomically once its nmap run is done.
+    """
+
+    default_dir = os.path.join(os.path.expanduser('~'), '.cache', 'checkpot', 'checkpoints')
+
+    def __init__(self, targets, arguments, parts, directory=None):
+        """
+        :param targets: target specification of the scan
+        :param arguments: nmap arguments shared by all parts
+        :param parts: list of strings telling the parts apart (e.g. the port range of each chunk)
+        :param directory: folder for the checkpoints
+        """
+        key = hashlib.sha256('\0'.join([targets, arguments] + list(parts)).encode()).hexdigest()
+
+        self.path = os.path.join(directory or self.default_dir, key)
+        self.parts = list(parts)
+
+    def report_file(self, index):
+        """
+        :param index: index of the part
+        :return: path of the saved report of the part or None if it is not done
+        """
+        path = os.path.join(self.path, str(index) + '.xml')
+
+        return path if os.path.isfile(path) else None
+
+    @property
+    def completed(self):
+        """Number of parts already done"""
+        return sum(1 for index in range(len(self.parts)) if self.report_file(index))
+
+    def save(self, index, report):
+        """
+        Saves the report of a part, failures are ignored (the part will simply be scanned again)
+
+        :param index: index of the part
+        :param report: XML report as bytes
+        """
+        with _CacheWriter(os.path.join(self.path, str(index) + '.xml')) as writer:
+            if writer:
+                writer.write(report)
+                writer.keep = True
+
+    def remove(self):
+        """Drops the checkpoint, called when the whole scan is done"""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class NmapXMLParser:
+    """
+    Incremental parser for nmap XML reports. Finished host elements are converted to HostRecords
+    and dropped from the element tree right away.
+    """
+
+    def __init__(self, on_host=None, on_port=None, on_progress=None, result=None):
+        """
+        :param on_host: called with (host, host record) for every host
+        :param on_port: called with (host, protocol, port, port record) for every port
+        :param on_progress: called with (task, percent, remaining seconds) for every progress report
+        :param result: ScanResult to add the hosts to, a new one is created by default
+        """
+        self.result = result if result is not None else ScanResult()
+        self._hosts_found = 0
+
+        self._on_host = on_host
+        self._on_port = on_port
+        self._on_progress = on_progress
+
+        self._parser = ET.XMLPullParser(events=('start', 'end'))
+        self._root = None
+
+    def feed(self, data):
+        """
+        :param data: next chunk of the report
+        :raises: NmapError if the report is not valid XML
+        """
+        try:
+            self._parser.feed(data)
+
+            # some errors are only raised while the events are read
+            for event, element in self._parser.read_events():
+                self._handle(event, element)
+        except ET.ParseError as e:
+            raise NmapError("invalid nmap XML output:", e)
+
+    def _handle(self, event, element):
+
+        if event == 'start':
+            if self._root is None:
+                self._root = element
+                self.result.command_line = element.get('args')
+            return
+
+        if element.tag == 'host':
+            self._add_host(element)
+        elif element.tag == 'taskprogress':
+            if self._on_progress:
+                self._on_progress(element.get('task', ''), element.get('percent', ''), element.get('remaining'))
+        elif element.tag == 'finished':
+            self.result.stats['elapsed'] = element.get('elapsed')
+            self.result.stats['timestr'] = element.get('timestr')
+        else:
+            return
+
+        if element in self._root:
+            self._root.remove(element)
+
+    @property
+    def hosts_found(self):
+        """Number of hosts parsed so far"""
+        return self._hosts_found
+
+    def close(self):
+        """
+        Finishes parsing
+        :raises: NmapError if the report is incomplete
+        """
+        try:
+            self._parser.close()
+        except ET.ParseError as e:
+            raise NmapError("incomplete nmap XML output:", e)
+
+    def _add_host(self, element):
+
+        host, record = host_record(element)
+
+        self._hosts_found += 1
+        self.result.add_host(host, record)
+
+        if self._on_host:
+            self._on_host(host, record)
+
+        if self._on_port:
+            for protocol, ports in record.ports.items():
+                for port, port_record in ports.items():
+                    self._on_port(host, protocol, port, port_record)
+
+
+def host_record(element):
+    """
+    Converts a <host> element of the nmap report
+
+    :param element: host Element
+    :return: tuple of (host address, HostRecord)
+    """
+    record = HostRecord()
+
+    host = None
+
+    for address in element.findall('address'):
+        record.addresses[address.get('addrtype')] = address.get('addr')
+
+        if address.get('addrtype') == 'mac' and address.get('vendor') is not None:
+            record.vendor[address.get('addr')] = address.get('vendor')
+
+    for addrtype in ('ipv4', 'ipv6'):
+        if addrtype in record.addresses:
+            host = record.addresses[addrtype]
+            break
+
+    if host is None and record.addresses:
+        host = next(iter(record.addresses.values()))
+
+    for hostname in element.findall('hostnames/hostname'):
+        record.hostnames.append({'name': hostname.get('name'), 'type': hostname.get('type')})
+
+    status = element.find('status')
+
+    if status is not None:
+        record.status = {'state': status.get('state'), 'reason': status.get('reason')}
+
+    for port in element.findall('ports/port'):
+
+        state = port.find('state')
+        service = port.find('service')
+
+        port_record = PortRecord(state.get('state', '') if state is not None else '',
+                                 state.get('reason', '') if state is not None else '')
+
+        if service is not None:
+            port_record.name = sys.intern(service.get('name', ''))
+            port_record.product = sys.intern(service.get('product', ''))
+            port_record.version = sys.intern(service.get('version', ''))
+            port_record.extrainfo = service.get('extrainfo', '')
+            port_record.conf = sys.intern(service.get('conf', ''))
+
+            for cpe in service.findall('cpe'):
+                port_record.cpe = sys.intern(cpe.text)
+
+        scripts = {script.get('id'): script.get('output') for script in port.findall('script')}
+
+        if scripts:
+            port_record.scripts = scripts
+
+        record.ports.setdefault(sys.intern(port.get('protocol')), {})[int(port.get('portid'))] = port_record
+
+    osmatches = element.findall('os/osmatch')
+
+    if osmatches:
+        record.osmatch = []
+
+        for osmatch in osmatches:
+            record.osmatch.append({
+                'name': osmatch.get('name'),
+                'accuracy': osmatch.get('accuracy'),
+                'line': osmatch.get('line'),
+                'osclass': [{
+                    'type': osclass.get('type'),
+                    'vendor': osclass.get('vendor'),
+                    'osfamily': osclass.get('osfamily'),
+                    'osgen': osclass.get('osgen'),
+                    'accuracy': osclass.get('accuracy'),
+                    'cpe': [cpe.text for cpe in osclass.findall('cpe')]
+                } for osclass in osmatch.findall('osclass')]
+            })
+
+    record.build_index()
+
+    return host, record
+
+
+class PortRecord:
+    """
+    What nmap found out about one port.
+    Strings repeated across ports and hosts (state, service name, product, ...) are interned,
+    so holding the results of many targets costs little more than the port numbers.
+    """
+
+    __slots__ = ('state', 'reason', 'name', 'product', 'version', 'extrainfo', 'conf', 'cpe', 'scripts')
+
+    def __init__(self, state='', reason=''):
+        """
+        :param state: port state (e.g. 'open')
+        :param reason: reason for the state (e.g. 'syn-ack')
+        """
+        self.state = sys.intern(state)
+        self.reason = sys.intern(reason)
+        self.name = ''
+        self.product = ''
+        self.version = ''
+        self.extrainfo = ''
+        self.conf = ''
+        self.cpe = ''
+        self.scripts = None  # script id -> output, for the scripts that ran on this port
+
+    @property
+    def description(self):
+        """Product, version and extra info as one string (e.g. 'OpenSSH 5.1p1 Debian 5 protocol 2.0')"""
+        return ' '.join(part for part in (self.product, self.version, self.extrainfo) if part)
+
+    def __repr__(self):
+        return 'PortRecord(' + ', '.join(slot + '=' + repr(getattr(self, slot)) for slot in self.__slots__) + ')'
+
+
+class HostRecord:
+    """
+    Everything nmap reported about one host.
+    Besides the port table it holds a service name -> ports, a product -> ports and a description -> ports
+    index for every protocol, all are built once when the record is created so lookups do not walk the port table.
+    Records are not changed after build_index(), merging creates a new record.
+    """
+
+    __slots__ = ('addresses', 'hostnames', 'vendor', 'status', 'osmatch', 'ports', '_services', '_products',
+                 '_descriptions')
+
+    def __init__(self):
+        self.addresses = {}  # address type -> address
+        self.hostnames = []
+        self.vendor = {}  # mac address -> vendor
+        self.status = None  # {'state': ..., 'reason': ...}
+        self.osmatch = None  # list of OS matches, only when OS detection ran
+        self.ports = {}  # protocol -> {port number -> PortRecord}
+        self._services = {}  # protocol -> {service name -> tuple of ports}
+        self._products = {}  # protocol -> {product -> tuple of ports}
+        self._descriptions = {}  # protocol -> {product, version and extra info -> tuple of ports}
+
+    def build_index(self):
+        """Builds the service, product and description indexes from the port table"""
+
+        self._services = {}
+        self._products = {}
+        self._descriptions = {}
+
+        for protocol, ports in self.ports.items():
+
+            services = {}
+            products = {}
+            descriptions = {}
+
+            for port, port_record in ports.items():
+                services.setdefault(port_record.name, []).append(port)
+                products.setdefault(port_record.product, []).append(port)
+                descriptions.setdefault(port_record.description, []).append(port)
+
+            self._services[protocol] = {name: tuple(ports) for name, ports in services.items()}
+            self._products[protocol] = {product: tuple(ports) for product, ports in products.items()}
+            self._descriptions[protocol] = {text: tuple(ports) for text, ports in descriptions.items()}
+
+    def port(self, protocol, port):
+        """
+        :param protocol: 'tcp' / 'udp'
+        :param port: port number
+        :return: PortRecord or None if the port was not reported
+        """
+        return self.ports.get(protocol, {}).get(port)
+
+    def services(self, protocol):
+        """
+        :param protocol: 'tcp' / 'udp'
+        :return: dict of service name -> tuple of ports
+        """
+        return self._services.get(protocol, {})
+
+    def products(self, protocol):
+        """
+        :param protocol: 'tcp' / 'udp'
+        :return: dict of product description -> tuple of ports
+        """
+        return self._products.get(protocol, {})
+
+    def descriptions(self, protocol):
+        """
+        :param protocol: 'tcp' / 'udp'
+        :return: dict of product description (see PortRecord.description) -> tuple of ports
+        """
+        return self._descriptions.get(protocol, {})
+
+    def merged(self, other):
+        """
+        Combines this record with a newer record of the same host (e.g. from another port chunk)
+
+        :param other: HostRecord
+        :return: new HostRecord holding the ports of both, the other one takes precedence
+        """
+        record = HostRecord()
+
+        record.addresses = other.addresses or self.addresses
+        record.hostnames = other.hostnames or self.hostnames
+        record.vendor = other.vendor or self.vendor
+        record.status = other.status or self.status
+        record.osmatch = other.osmatch or self.osmatch
+
+        for protocol in set(self.ports) | set(other.ports):
+            record.ports[protocol] = dict(self.ports.get(protocol, {}))
+            record.ports[protocol].update(other.ports.get(protocol, {}))
+
+        record.build_index()
+
+        return record
+
+
+class ScanResult:
+    """Records of all hosts found by a scan, indexed by host address"""
+
+    def __init__(self):
+        self.command_line = None
+        self.stats = {}
+        self._hosts = {}
+
+    def add_host(self, host, record):
+        """
+        Adds the record of a host. If the host is already known both records are merged into a new one
+        which replaces the stored record, so the old one can still be read by other threads meanwhile.
+
+        :param host: host address
+        :param record: HostRecord
+        :return: the stored record
+        """
+        if host in self._hosts:
+            record = self._hosts[host].merged(record)
+
+        self._hosts[host] = record
+
+        return record
+
+    def all_hosts(self):
+        """
+        :return: list of host addresses sorted in numeric order
+        """
+        return sorted(self._hosts, key=_address_key)
+
+    def __getitem__(self, host):
+        return self._hosts[host]
+
+    def __contains__(self, host):
+        return host in self._hosts
+
+
+def parse_port_range(port_range):
+    """
+    Parses a numeric nmap port specification
+
+    :param port_range: port specification like '-', '1-1000' or '21,80,8000-8100'
+    :return: list of (first port, last port) tuples, or None if the specification is not purely numeric
+             (e.g. it holds service names or protocol prefixes)
+    """
+    ports = []
+
+    for item in port_range.split(','):
+
+        item = item.strip()
+
+        try:
+            if '-' in item:
+                start, end = item.split('-', 1)
+                start = int(start) if start else 1
+                end = int(end) if end else 65535
+            else:
+                start = end = int(item)
+        except ValueError:
+            return None
+
+        ports.append((start, end))
+
+    return ports
+
+
+def format_port_range(ports):
+    """
+    Builds an nmap port specification from a list of ports
+
+    :param ports: list of port numbers
+    :return: port specification, consecutive ports are written as a range (e.g. '21-23,80')
+    """
+    items = []
+
+    for port in sorted(set(ports)):
+        if items and items[-1][1] == port - 1:
+            items[-1][1] = port
+        else:
+            items.append([port, port])
+
+    return ','.join(str(start) if start == end else str(start) + '-' + str(end) for start, end in items)
+
+
+def split_port_range(port_range, chunk_size=None, max_length=None):
+    """
+    Splits an nmap port specification in smaller specifications of at most chunk_size ports each
+
+    :param port_range: port specification like '-', '1-1000' or '21,80,8000-8100'
+    :param chunk_size: maximum number of ports in a chunk, None for no limit
+    :param max_length: maximum number of characters of a chunk, None for no limit
+                       (the chunk is passed to nmap as a command line argument)
+    :return: list of port specifications, or [port_range] if it can not be split
+             (e.g. it holds service names or protocol prefixes)
+    """
+    ports = parse_port_range(port_range)
+
+    if ports is None:
+        return [port_range]
+
+    chunk_size = chunk_size or 65535
+    chunks = []
+    current = []
+    size = 0
+    length = 0
+
+    for start, end in ports:
+        while start <= end:
+            count = min(end - start + 1, chunk_size - size)
+            item = str(start) if count == 1 else str(start) + '-' + str(start + count - 1)
+
+            if current and max_length and length + 1 + len(item) > max_length:
+                chunks.append(','.join(current))
+                current = []
+                size = 0
+                length = 0
+                continue
+
+            current.append(item)
+            size += count
+            length += len(item) + (length > 0)
+            start += count
+
+            if size == chunk_size:
+                chunks.append(','.join(current))
+                current = []
+                size = 0
+                length = 0
+
+    if current:
+        chunks.append(','.join(current))
+
+    return chunks
+
+
+def _address_key(host):
+    try:
+        address = ipaddress.ip_address(host)
+        return address.version, int(address)
+    except ValueError:
+        return 99, host
+
+
+def parse_nmap_xml(data):
+    """
+    Parses a complete nmap XML report
+
+    :param data: report as bytes or string
+    :return: ScanResult object
+    :raises: NmapError
+    """
+    parser = NmapXMLParser()
+    parser.feed(data)
+    parser.close()
+
+    return parser.result
+
+
+class NmapError(Exception):
+    """Raised when nmap can not be run or its output can not be parsed"""
+
+    def __init__(self, *report):
+        """
+        :param report: description of the error
+        """
+        self.value = " ".join(str(r) for r in report)
+
+    def __str__(self):
+        return self.value
@@ -0,0 +1,170 @@
+# Checkpot - Honeypot Checker
+# Copyright (C) 2018  Vlad Florea
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# DISCLAIMER: All prerequisites (containers, additional programs, etc.)
+# and libraries that might be needed to run this program are property
+# of their original authors and carry their own separate licenses that
+# you should read to inform yourself about their terms.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# As this software is PROVIDED WITH ABSOLUTELY NO WARRANTY OF ANY KIND,
+# YOU USE THIS SOFTWARE AT YOUR OWN RISK!
+#
+# By using this tool YOU TAKE FULL LEGAL RESPONSIBILITY FOR ANY
+# POSSIBLE OUTCOME.
+#
+# We strongly recommend that you read all the information in the README.md
+# file (found in the root folder of this project) and even the
+# documentation (which you can find locally in the /docs/ folder or
+# at http://checkpot.readthedocs.io/) to make sure you fully
+# understand how this tool works and consult all laws that apply
+# to your use case.
+#
+# We strongly suggest that you keep this notice intact for all files.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# The local copy of the license should be located in the root folder of the app
+# in the file gpl-3.0.txt.
+#
+# You can contact the author and team at any time via the Checkpot official
+# GitHub page: https://github.com/honeynet/checkpot or via the Honeynet
+# official Slack channel: https://gsoc-slack.honeynet.org/ or
+#                         https://honeynetpublic.slack.com/
+#
+# You can contact us at any time and with any question, we are here to help!
+#
+# If you consider any information in this copyright notice might be incorrect,
+# outdated, arises any questions, raises any problems, etc. please contact us
+# and we will make it our top priority to fix it. We have the deepest respect
+# for the work of all authors and for all of our users.
+
+
+import base64
+import gzip
+import json
+import threading
+
+
+class Recorder:
+    """
+    Archive of all network interactions with the targets: nmap reports, probe conversations,
+    web pages and certificate checks.
+
+    In record mode every interaction is added to the archive as it happens, save() writes it to disk.
+    In replay mode the archive is loaded and the same calls are answered from it without any network I/O,
+    interactions missing from the archive fail like an unreachable target would.
+    """
+
+    version = 1
+
+    def __init__(self, path, replay=False):
+        """
+        :param path: archive file (gzip compressed JSON)
+        :param replay: load the archive and answer from it instead of recording
+        :raises: OSError, ValueError if the archive to replay can not be read
+        """
+        self.path = path
+        self.replaying = replay
+
+        self._entries = {}  # (kind, encoded key) -> encoded value
+        self._lock = threading.Lock()  # tests and the scan may record at the same time
+
+        if replay:
+            self._load()
+
+    def record(self, kind, key, value):
+        """
+        Adds an interaction to the archive, ignored in replay mode
+
+        :param kind: type of interaction (e.g. 'probe')
+        :param key: request, any combination of lists, tuples, strings, numbers and bytes
+        :param value: response, same types as the key plus dicts with string keys
+        """
+        if self.replaying:
+            return
+
+        with self._lock:
+            self._entries[(kind, self._key(key))] = _encode(value)
+
+    def lookup(self, kind, key, default=None):
+        """
+        :param kind: type of interaction
+        :param key: request as given to record()
+        :return: recorded response or default
+        """
+        with self._lock:
+            value = self._entries.get((kind, self._key(key)), _missing)
+
+        if value is _missing:
+            return default
+
+        return _decode(value)
+
+    def save(self):
+        """Writes the archive to disk"""
+
+        with self._lock:
+            entries = [[kind, json.loads(key), value] for (kind, key), value in self._entries.items()]
+
+        with gzip.open(self.path, 'wt', encoding='utf-8') as f:
+            json.dump({'version': self.version, 'entries': entries}, f)
+
+    def _load(self):
+
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            archive = json.load(f)
+
+        if not isinstance(archive, dict) or archive.get('version') != self.version:
+            raise ValueError("Not a valid recording: " + self.path)
+
+        for kind, key, value in archive['entries']:
+            self._entries[(kind, json.dumps(key))] = value
+
+    @staticmethod
+    def _key(key):
+        return json.dumps(_encode(key))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_missing = object()
+
+
+def _encode(value):
+    """Converts a value to JSON compatible types, bytes are stored as base64"""
+
+    if isinstance(value, bytes):
+        return {'b64': base64.b64encode(value).decode('ascii')}
+
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+
+    if isinstance(value, dict):
+        return {'dict': {k: _encode(v) for k, v in value.items()}}
+
+    return value
+
+
+def _decode(value):
+    """Inverse of _encode(), tuples come back as lists"""
+
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+
+    if isinstance(value, dict):
+        if 'b64' in value:
+            return base64.b64decode(value['b64'])
+
+        return {k: _decode(v) for k, v in value['dict'].items()}
+
+    return value
@@ -0,0 +1,161 @@
+# Checkpot - Honeypot Checker
+# Copyright (C) 2018  Vlad Florea
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# DISCLAIMER: All prerequisites (containers, additional programs, etc.)
+# and libraries that might be needed to run this program are property
+# of their original authors and carry their own separate licenses that
+# you should read to inform yourself about their terms.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# As this software is PROVIDED WITH ABSOLUTELY NO WARRANTY OF ANY KIND,
+# YOU USE THIS SOFTWARE AT YOUR OWN RISK!
+#
+# By using this tool YOU TAKE FULL LEGAL RESPONSIBILITY FOR ANY
+# POSSIBLE OUTCOME.
+#
+# We strongly recommend that you read all the information in the README.md
+# file (found in the root folder of this project) and even the
+# documentation (which you can find locally in the /docs/ folder or
+# at http://checkpot.readthedocs.io/) to make sure you fully
+# understand how this tool works and consult all laws that apply
+# to your use case.
+#
+# We strongly suggest that you keep this notice intact for all files.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# The local copy of the license should be located in the root folder of the app
+# in the file gpl-3.0.txt.
+#
+# You can contact the author and team at any time via the Checkpot official
+# GitHub page: https://github.com/honeynet/checkpot or via the Honeynet
+# official Slack channel: https://gsoc-slack.honeynet.org/ or
+#                         https://honeynetpublic.slack.com/
+#
+# You can contact us at any time and with any question, we are here to help!
+#
+# If you consider any information in this copyright notice might be incorrect,
+# outdated, arises any questions, raises any problems, etc. please contact us
+# and we will make it our top priority to fix it. We have the deepest respect
+# for the work of all authors and for all of our users.
+
+
+import statistics
+
+
+class Timing:
+    """
+    Timing parameters for a target derived from the round trip times of a few TCP handshakes.
+    A refused connection is as good as an accepted one for measuring. Unanswered attempts count as lost,
+    ports which never answered (e.g. dropped by a firewall) must be left out of the samples.
+
+    The nmap parameters follow the way nmap adapts its own timeouts (smoothed RTT plus four times the variation),
+    starting from the measured values instead of the conservative defaults.
+    """
+
+    default_timeout = 5  # seconds, used when nothing could be measured
+
+    def __init__(self, samples):
+        """
+        :param samples: list of handshake round trip times in seconds, None for attempts without answer,
+                        all of them to ports which answered at least once
+        """
+        self.sent = len(samples)
+        self.rtts = sorted(sample for sample in samples if sample is not None)
+
+    @property
+    def measured(self):
+        """At least one handshake was answered"""
+        return bool(self.rtts)
+
+    @property
+    def loss(self):
+        """Fraction of the attempts which got no answer"""
+        if not self.sent:
+            return 0.0
+
+        return 1 - len(self.rtts) / self.sent
+
+    @property
+    def srtt(self):
+        """Typical round trip time in seconds (median, so a single slow handshake does not count much)"""
+        return statistics.median(self.rtts) if self.rtts else None
+
+    @property
+    def rttvar(self):
+        """Mean deviation of the round trip time in seconds"""
+        if not self.rtts:
+            return None
+
+        srtt = self.srtt
+        return sum(abs(rtt - srtt) for rtt in self.rtts) / len(self.rtts)
+
+    @property
+    def rtt_timeout(self):
+        """Seconds to wait for a reply on the transport level"""
+        return self.srtt + 4 * self.rttvar
+
+    @property
+    def probe_timeout(self):
+        """
+        Seconds to wait for the connection and for each reply of a service.
+        Services need some time of their own to answer, so this never drops below one second,
+        lossy paths get more time because a lost segment costs a retransmission timeout.
+        """
+        if not self.measured:
+            return self.default_timeout
+
+        timeout = max(1.0, 1 + 10 * self.rtt_timeout) * (1 + 2 * self.loss)
+
+        return round(min(timeout, 2 * self.default_timeout), 2)
+
+    def nmap_arguments(self, max_parallelism=None):
+        """
+        :param max_parallelism: upper bound for the parallelism (e.g. from a TargetLimiter)
+        :return: nmap timing options as string, empty if nothing could be measured
+        """
+        if not self.measured:
+            return ''
+
+        # in milliseconds, nmap does not accept an initial timeout below 100ms
+        initial = max(100, int(self.rtt_timeout * 2000))
+        minimum = max(50, int(self.srtt * 1000))
+        maximum = max(initial, int(self.rtt_timeout * 8000), 300)
+
+        if self.loss == 0:
+            retries = 1
+        elif self.loss < 0.2:
+            retries = 3
+        else:
+            retries = 6
+
+        arguments = ['--min-rtt-timeout', str(minimum) + 'ms',
+                     '--initial-rtt-timeout', str(initial) + 'ms',
+                     '--max-rtt-timeout', str(maximum) + 'ms',
+                     '--max-retries', str(retries)]
+
+        if self.loss < 0.2:
+            # a clean path can take many probes in flight, more of them when they spend longer on the wire
+            parallelism = min(256, max(16, int(self.srtt * 1000)))
+
+            if max_parallelism is not None:
+                parallelism = min(parallelism, max_parallelism)
+
+            arguments += ['--min-parallelism', str(parallelism)]
+
+        return ' '.join(arguments)
+
+    def __repr__(self):
+        if not self.measured:
+            return 'Timing(no answers to ' + str(self.sent) + ' attempts)'
+
+        return 'Timing(srtt={:.1f}ms, rttvar={:.1f}ms, loss={:.0%})'.format(self.srtt * 1000, self.rttvar * 1000,
+                                                                           self.loss)
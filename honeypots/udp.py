@@ -0,0 +1,112 @@
+# Checkpot - Honeypot Checker
+# Copyright (C) 2018  Vlad Florea
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# DISCLAIMER: All prerequisites (containers, additional programs, etc.)
+# and libraries that might be needed to run this program are property
+# of their original authors and carry their own separate licenses that
+# you should read to inform yourself about their terms.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# As this software is PROVIDED WITH ABSOLUTELY NO WARRANTY OF ANY KIND,
+# YOU USE THIS SOFTWARE AT YOUR OWN RISK!
+#
+# By using this tool YOU TAKE FULL LEGAL RESPONSIBILITY FOR ANY
+# POSSIBLE OUTCOME.
+#
+# We strongly recommend that you read all the information in the README.md
+# file (found in the root folder of this project) and even the
+# documentation (which you can find locally in the /docs/ folder or
+# at http://checkpot.readthedocs.io/) to make sure you fully
+# understand how this tool works and consult all laws that apply
+# to your use case.
+#
+# We strongly suggest that you keep this notice intact for all files.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# The local copy of the license should be located in the root folder of the app
+# in the file gpl-3.0.txt.
+#
+# You can contact the author and team at any time via the Checkpot official
+# GitHub page: https://github.com/honeynet/checkpot or via the Honeynet
+# official Slack channel: https://gsoc-slack.honeynet.org/ or
+#                         https://honeynetpublic.slack.com/
+#
+# You can contact us at any time and with any question, we are here to help!
+#
+# If you consider any information in this copyright notice might be incorrect,
+# outdated, arises any questions, raises any problems, etc. please contact us
+# and we will make it our top priority to fix it. We have the deepest respect
+# for the work of all authors and for all of our users.
+
+
+import struct
+import sys
+
+from .nmap_runner import HostRecord, PortRecord
+
+# UDP services worth looking for, most common first, with a request each service answers to.
+# Closed or filtered UDP ports stay silent, so a generic probe would not tell open ports apart.
+# Service names are the ones nmap uses.
+
+udp_services = [
+    (53, 'domain', b'\x12\x34\x01\x00\x00\x01\x00\x00\x00\x00\x00\x00'
+                   b'\x07version\x04bind\x00\x00\x10\x00\x03'),  # TXT version.bind CH
+    (123, 'ntp', b'\x1b' + b'\x00' * 47),  # NTPv3 client request
+    (161, 'snmp', bytes.fromhex('302902010004067075626c6963a01c02040000000102010002010030'
+                                '0e300c06082b060102010101000500')),  # v1 get sysDescr.0, community public
+    (137, 'netbios-ns', b'\x80\xf0\x00\x10\x00\x01\x00\x00\x00\x00\x00\x00'
+                        b'\x20CK' + b'A' * 30 + b'\x00\x00\x21\x00\x01'),  # NBSTAT *
+    (1900, 'upnp', b'M-SEARCH * HTTP/1.1\r\nHOST: 239.255.255.250:1900\r\nMAN: "ssdp:discover"\r\n'
+                   b'MX: 1\r\nST: ssdp:all\r\n\r\n'),
+    (69, 'tftp', b'\x00\x01checkpot.txt\x00octet\x00'),  # read request, an error reply is fine too
+    (5060, 'sip', b'OPTIONS sip:nm SIP/2.0\r\nVia: SIP/2.0/UDP nm;branch=z9hG4bK776asdhds\r\n'
+                  b'From: <sip:nm@nm>;tag=root\r\nTo: <sip:nm2@nm2>\r\nCall-ID: 50000\r\nCSeq: 42 OPTIONS\r\n'
+                  b'Max-Forwards: 70\r\nContent-Length: 0\r\n\r\n'),
+    (111, 'rpcbind', struct.pack('>10I', 0x72fe1d13, 0, 2, 100000, 2, 0, 0, 0, 0, 0)),  # portmap NULL call
+    (1434, 'ms-sql-m', b'\x02'),  # instance enumeration
+    (5353, 'zeroconf', b'\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00'
+                       b'\x09_services\x07_dns-sd\x04_udp\x05local\x00\x00\x0c\x00\x01'),
+    (11211, 'memcache', b'\x00\x01\x00\x00\x00\x01\x00\x00stats\r\n'),
+    (623, 'asf-rmcp', bytes.fromhex('0600ff07000000000000000000092018c88100388e04b5')),  # IPMI auth capabilities
+    (47808, 'bacnet', b'\x81\x0a\x00\x0c\x01\x20\xff\xff\x00\xff\x10\x08'),  # Who-Is
+]
+
+
+def top_udp_ports(count):
+    """
+    :param count: number of ports
+    :return: list of (port, service name, payload) for the count most common UDP services
+    """
+    return udp_services[:count]
+
+
+def udp_host_record(address, ports):
+    """
+    Builds the record of the UDP ports which answered, so they can be merged into the nmap results
+
+    :param address: ip address of the host
+    :param ports: dict of port -> service name
+    :return: HostRecord
+    """
+    record = HostRecord()
+    record.addresses['ipv6' if ':' in address else 'ipv4'] = address
+
+    udp_ports = {}
+
+    for port, name in sorted(ports.items()):
+        udp_ports[port] = PortRecord('open', 'udp-response')
+        udp_ports[port].name = sys.intern(name)
+
+    record.ports['udp'] = udp_ports
+    record.build_index()
+
+    return record
@@ -1,5 +1,6 @@
 __all__ = ['test',
            'test_platform',
+           'registry',
            'default_ftp',
            'default_http',
            'default_imap',
@@ -0,0 +1,133 @@
+import hashlib
+import math
+import os
+import struct
+import sys
+
+
+class CorpusIndex:
+    """
+    Compact index answering "is this fragment part of the corpus?" without keeping the corpus in memory.
+
+    The text is split into words and every run of shingle_size consecutive words is stored in a bloom filter,
+    a fragment is reported as part of the corpus if all of its word shingles are found.
+    Lookups cost O(fragment length) and the index can be loaded from disk in a few milliseconds.
+    """
+
+    magic = b'CPIDX1'
+    header = struct.Struct('<6sBBQQ')  # magic, hash count, shingle size, bit count, shingle count
+
+    def __init__(self, bits, bit_count, hash_count=7, shingle_size=3, shingle_count=0):
+        """
+        :param bits: bytearray holding the bloom filter
+        :param bit_count: number of usable bits in the filter
+        :param hash_count: number of bits set for each shingle
+        :param shingle_size: number of words in a shingle
+        :param shingle_count: number of shingles stored
+        """
+        self.bits = bits
+        self.bit_count = bit_count
+        self.hash_count = hash_count
+        self.shingle_size = shingle_size
+        self.shingle_count = shingle_count
+
+    @classmethod
+    def build(cls, text, shingle_size=3, error_rate=0.01):
+        """
+        Builds the index of a text
+
+        :param text: corpus as string
+        :param shingle_size: number of words in a shingle
+        :param error_rate: false positive rate of a single shingle lookup
+        :return: CorpusIndex object
+        """
+        words = text.split()
+        shingles = {' '.join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)}
+
+        bit_count = max(8, int(-len(shingles) * math.log(error_rate) / math.log(2) ** 2))
+        hash_count = max(1, round(bit_count / max(1, len(shingles)) * math.log(2)))
+
+        index = cls(bytearray((bit_count + 7) // 8), bit_count, hash_count, shingle_size, len(shingles))
+
+        for shingle in shingles:
+            for position in index._positions(shingle):
+                index.bits[position >> 3] |= 1 << (position & 7)
+
+        return index
+
+    @classmethod
+    def load(cls, path):
+        """
+        :param path: index file written by save()
+        :return: CorpusIndex object
+        :raises: ValueError if the file is not a valid index
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        if len(data) < cls.header.size:
+            raise ValueError("Corpus index file is truncated")
+
+        magic, hash_count, shingle_size, bit_count, shingle_count = cls.header.unpack_from(data)
+
+        if magic != cls.magic or len(data) != cls.header.size + (bit_count + 7) // 8:
+            raise ValueError("Not a valid corpus index file")
+
+        return cls(bytearray(data[cls.header.size:]), bit_count, hash_count, shingle_size, shingle_count)
+
+    def save(self, path):
+        """
+        :param path: destination file
+        """
+        with open(path, 'wb') as f:
+            f.write(self.header.pack(self.magic, self.hash_count, self.shingle_size,
+                                     self.bit_count, self.shingle_count))
+            f.write(self.bits)
+
+    def _positions(self, shingle):
+
+        digest = hashlib.blake2b(shingle.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+
+        return [(h1 + i * h2) % self.bit_count for i in range(self.hash_count)]
+
+    def _has_shingle(self, shingle):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(shingle))
+
+    def contains(self, fragment):
+        """
+        Checks if a fragment of text appears in the corpus.
+        Whitespace differences (e.g. line wrapping) are ignored.
+        Fragments shorter than one shingle can not be verified and are reported as missing.
+
+        :param fragment: text to look for
+        :return: boolean
+        """
+        words = fragment.split()
+
+        if len(words) < self.shingle_size:
+            return False
+
+        return all(self._has_shingle(' '.join(words[i:i + self.shingle_size]))
+                   for i in range(len(words) - self.shingle_size + 1))
+
+
+def main(argv):
+    """Builds an index file from a local copy of a text: python -m tests.corpus_index <text file> <index file>"""
+
+    if len(argv) != 3:
+        print("Usage: python -m tests.corpus_index <text file> <index file>")
+        sys.exit(2)
+
+    with open(argv[1], 'rb') as f:
+        text = f.read().decode('utf-8', errors='replace')
+
+    index = CorpusIndex.build(text)
+    index.save(argv[2])
+
+    print("Indexed", index.shingle_count, "shingles into", os.path.getsize(argv[2]), "bytes")
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -1,5 +1,6 @@
 from .test import *
 
+from .signatures import SignatureDatabase
 from honeypots.honeypot import ScanFailure
 
 
@@ -9,32 +10,31 @@ class DefaultFTPBannerTest(Test):
     description = "Tests usage of default service banners"
     karma_value = 100
     doc_file = "default_banner.html"
+    required_services = [('ftp', 'tcp')]
 
     def run(self):
         """Check if banner matches any known banner"""
 
-        known_banners = {
-            b'220 DiskStation FTP server ready.\r\n': "dionaea",
-            b'220 Welcome to my FTP Server\r\n': "amun",
-            b'220 BearTrap-ftpd Service ready\r\n': "beartrap"
-        }
-
         target_ports = self.target_honeypot.get_service_ports('ftp', 'tcp')
 
         if not target_ports:
             self.set_result(TestResult.NOT_APPLICABLE, "No open ports found!")
             return
 
+        banners = self.target_honeypot.get_banners(target_ports, protocol='tcp')
+
         for port in target_ports:
 
-            try:
-                banner = self.target_honeypot.get_banner(port, protocol='tcp')
-            except ScanFailure as e:
-                self.set_result(TestResult.UNKNOWN, e)
+            banner = banners[port]
+
+            if isinstance(banner, ScanFailure):
+                self.set_result(TestResult.UNKNOWN, banner)
                 continue
 
-            if banner in known_banners:
-                self.set_result(TestResult.WARNING, "Default", known_banners[banner], "banner used")
+            family = SignatureDatabase.shared().match_banner('ftp', banner)
+
+            if family is not None:
+                self.set_result(TestResult.WARNING, "Default", family, "banner used")
                 return
             else:
                 self.set_result(TestResult.OK, "No default banners")
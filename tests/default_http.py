@@ -1,12 +1,17 @@
 from .test import *
+from .corpus_index import CorpusIndex
+from .signatures import SignatureDatabase
+from .page_similarity import PageIndex
+from honeypots.honeypot import ScanFailure
 
 from bs4 import BeautifulSoup
 import urllib.request
 import urllib.error
-import http
-import ssl
-import re
 import hashlib
+import tarfile
+import io
+import re
+import os
 
 
 class DefaultStylesheetTest(Test):
@@ -15,14 +20,12 @@ class DefaultStylesheetTest(Test):
     description = "Test unchanged website stylesheet"
     karma_value = 30
     doc_file = 'default_stylesheet.html'
+    required_services = [('http', 'tcp')]
+    resources = ['websites']  # fetched once and shared through the cache
 
     def run(self):
         """Check if content matches known content"""
 
-        default_hashes = {
-            '1118635ac91417296e67cd0f3e6f9927e5f502e328b92bb3888b3b789a49a257': "glastopf"
-        }
-
         css = self.target_honeypot.get_websites_css()
 
         if not css:
@@ -30,15 +33,10 @@ class DefaultStylesheetTest(Test):
 
         for style in css:
 
-            if isinstance(style, bytes):
-                hash_obj = hashlib.sha256(style)
-            else:
-                hash_obj = hashlib.sha256(style.encode())
-
-            digest = hash_obj.hexdigest()
+            family = SignatureDatabase.shared().match_hash('stylesheet', style)
 
-            if digest in default_hashes:
-                self.set_result(TestResult.WARNING, "Default stylesheet used for", default_hashes[digest])
+            if family is not None:
+                self.set_result(TestResult.WARNING, "Default stylesheet used for", family)
 
         if self.result == TestResult.UNKNOWN:
             self.set_result(TestResult.OK, "No default stylesheet matched")
@@ -50,19 +48,15 @@ class DefaultWebsiteTest(Test):
     description = "Test unchanged website content"
     karma_value = 60
     doc_file = 'default_website.html'
+    required_services = [('http', 'tcp')]
+    resources = ['websites']
 
-    def run(self):
-        """Check if webpage has a known hash"""
-
-        # TODO conpot has current time, hash everything except that?
-        # TODO use bs4 and test partial hashes for such cases
+    # Pages that differ from a known default website (e.g. in a timestamp) but are more similar
+    # than this percent will be shown as a warning, see PageIndex for the known websites
+    threshold = 80
 
-        default_hashes = {
-            'c59e04f46e25c454e65544c236abd9d71705cc4e5c4b4b7dc3ff83fec0e9402f': "shockpot",
-            'd405fe3c5b902342565cbf5523bb44a78c6bfb15b38a40c81a5f7bf4d8eb7838': "honeything",
-            '351190a71ddca564e471600c3d403fd8042e6888c8c6abe9cdfe536cef005e82': "dionaea",
-            '576137c8755b80c0751baa18c8306465fa02c641c683caf8b6d19469a5b96b86': "amun"
-        }
+    def run(self):
+        """Check if webpage has a known hash or is almost the same as a known page"""
 
         sites = self.target_honeypot.get_websites()
 
@@ -71,15 +65,20 @@ class DefaultWebsiteTest(Test):
 
         for content in sites:
 
-            if isinstance(content, bytes):
-                hash_obj = hashlib.sha256(content)
-            else:
-                hash_obj = hashlib.sha256(content.encode())
+            family = SignatureDatabase.shared().match_hash('website', content)
+
+            if family is not None:
+                self.set_result(TestResult.WARNING, "Default website used for", family)
+                continue
 
-            digest = hash_obj.hexdigest()
+            if not len(PageIndex.shared()):
+                continue  # no known default websites to compare with
 
-            if digest in default_hashes:
-                self.set_result(TestResult.WARNING, "Default website used for", default_hashes[digest])
+            match = PageIndex.shared().match(content)
+
+            if match is not None and match[1] * 100 > self.threshold:
+                self.set_result(TestResult.WARNING, "Website is", round(match[1] * 100),
+                                "percent similar to the default website of", match[0])
 
         if self.result == TestResult.UNKNOWN:
             self.set_result(TestResult.OK, "No default website matched")
@@ -91,20 +90,75 @@ class DefaultGlastopfWebsiteTest(Test):
     description = "Test unchanged source for website content"
     karma_value = 60
     doc_file = 'default_glastopf_site.html'
+    required_services = [('http', 'tcp')]
+    resources = ['websites']
+
+    # the default Glastopf website content is made of lines of Pride and Prejudice,
+    # the bundled index is built from the copy shipped with Glastopf (dork_list/data/pride.txt):
+    # python -m tests.corpus_index pride.txt tests/data/glastopf_corpus.idx
+    # without it the same file is taken from the Glastopf release on PyPI
+    release_url = ('https://files.pythonhosted.org/packages/c5/c2/'
+                   '1f9af2a29bf67a66b95525174c00361fdad1bc4d46e0b3e4f2f9453bc090/Glastopf-3.1.2.tar.gz')
+    release_sha256 = 'bb1c8a97e5723400f5c12c4b7799e093e21d2c04caf1ccc596a10f1d8b5ed541'
+    book_file = 'Glastopf-3.1.2/glastopf/modules/handlers/emulators/dork_list/data/pride.txt'
+    index_file = os.path.join(os.path.dirname(__file__), 'data', 'glastopf_corpus.idx')
+    cache_file = os.path.join(os.path.expanduser('~'), '.cache', 'checkpot', 'glastopf_corpus.idx')
+
+    _corpus_index = None  # loaded once and shared by all instances
+
+    @classmethod
+    def get_corpus_index(cls):
+        """
+        Loads the bundled index of the book. If it is missing or damaged, the index built by an earlier run
+        is used, or as a last resort the Glastopf release is downloaded and its copy of the book is indexed,
+        the result is saved for the next runs.
+
+        :return: CorpusIndex object
+        :raises: urllib.error.URLError if the release has to be downloaded and the download fails,
+                 ValueError if the downloaded release is not the expected one
+        """
+
+        if cls._corpus_index is not None:
+            return cls._corpus_index
+
+        for path in (cls.index_file, cls.cache_file):
+            try:
+                cls._corpus_index = CorpusIndex.load(path)
+                return cls._corpus_index
+            except (OSError, ValueError):
+                pass
 
-    def run(self):
-        """Check if content matches known content"""
+        try:
+            request = urllib.request.urlopen(cls.release_url, timeout=10)
+        except:
+            request = urllib.request.urlopen(cls.release_url, timeout=10)
+
+        release = request.read()
+
+        if hashlib.sha256(release).hexdigest() != cls.release_sha256:
+            raise ValueError("Downloaded Glastopf release does not match its checksum")
+
+        with tarfile.open(fileobj=io.BytesIO(release), mode='r:gz') as archive:
+            book = archive.extractfile(cls.book_file).read().decode('utf-8', errors='replace')
+
+        # same as python -m tests.corpus_index, so the result matches the bundled index
+        cls._corpus_index = CorpusIndex.build(book)
 
         try:
-            try:
-                request = urllib.request.urlopen('http://www.gutenberg.org/files/42671/42671.txt', timeout=10)
-            except:
-                request = urllib.request.urlopen('http://www.gutenberg.org/files/42671/42671.txt', timeout=10)
+            os.makedirs(os.path.dirname(cls.cache_file), exist_ok=True)
+            cls._corpus_index.save(cls.cache_file)
+        except OSError:
+            pass  # read only home folder, build it again next time
+
+        return cls._corpus_index
 
-            book = request.read().decode(request.headers.get_content_charset())
+    def run(self):
+        """Check if content matches known content"""
 
-        except urllib.error.URLError:
-            self.set_result(TestResult.UNKNOWN, 'failed to download gutenberg.org book content')
+        try:
+            book = self.get_corpus_index()
+        except (urllib.error.URLError, ValueError):
+            self.set_result(TestResult.UNKNOWN, 'failed to download the Glastopf release with the book content')
             return
 
         sites = self.target_honeypot.get_websites()
@@ -128,8 +182,10 @@ class DefaultGlastopfWebsiteTest(Test):
             total_items = len(items)
             matched_items = 0
 
+            # items shorter than 3 words (one index shingle) can not be verified and count as not found,
+            # they are rare in Glastopf pages (about 0.5 percent of the lines of the book longer than 15 characters)
             for item in items:
-                if len(item) > 15 and item.strip(' ') in book:
+                if len(item) > 15 and book.contains(item.strip(' ')):
                     matched_items += 1
 
             # if more than 20 percent of the content is found
@@ -163,20 +219,18 @@ class CertificateValidationTest(Test):
 
         for port in target_ports:
 
-            conn = http.client.HTTPSConnection(self.target_honeypot.ip, port=port, timeout=5)
-
             try:
-                conn.request('GET', '/')
-            except ssl.SSLError as e:
-                if e.reason == "CERTIFICATE_VERIFY_FAILED":
-                    self.set_result(TestResult.WARNING, "Certificate invalid for", self.target_honeypot.ip, ":", port)
-
-                else:
-                    self.set_result(TestResult.WARNING, "Other certificate error:", e.reason,
-                                    "for", self.target_honeypot.ip, ":", port)
-                return
-            except Exception as e:
+                reason = self.target_honeypot.get_certificate_error(port)
+            except ScanFailure as e:
                 self.set_result(TestResult.WARNING, "Connection failed with exception ", e)
                 return
 
+            if reason == "CERTIFICATE_VERIFY_FAILED":
+                self.set_result(TestResult.WARNING, "Certificate invalid for", self.target_honeypot.ip, ":", port)
+                return
+            elif reason is not None:
+                self.set_result(TestResult.WARNING, "Other certificate error:", reason,
+                                "for", self.target_honeypot.ip, ":", port)
+                return
+
             self.set_result(TestResult.OK, "Certificates Valid")
@@ -1,5 +1,6 @@
 from .test import *
 
+from .signatures import SignatureDatabase
 from honeypots.honeypot import ScanFailure
 
 
@@ -9,30 +10,31 @@ class DefaultIMAPBannerTest(Test):
     description = "Tests usage of default IMAP banners"
     karma_value = 90
     doc_file = "default_banner.html"
+    required_services = [('imap', 'tcp')]
 
     def run(self):
         """Check if content matches any known content"""
 
-        known_banners = {
-            b'a200 Lotus Domino 6.5.4 7.0.2 IMAP4\r\n': "amun"
-        }
-
         target_ports = self.target_honeypot.get_service_ports('imap', 'tcp')
 
         if not target_ports:
             self.set_result(TestResult.NOT_APPLICABLE, "No open ports found!")
             return
 
+        banners = self.target_honeypot.get_banners(target_ports, protocol='tcp')
+
         for port in target_ports:
 
-            try:
-                banner = self.target_honeypot.get_banner(port, protocol='tcp')
-            except ScanFailure as e:
-                self.set_result(TestResult.UNKNOWN, e)
+            banner = banners[port]
+
+            if isinstance(banner, ScanFailure):
+                self.set_result(TestResult.UNKNOWN, banner)
                 continue
 
-            if banner in known_banners:
-                self.set_result(TestResult.WARNING, "Default", known_banners[banner], "banner used")
+            family = SignatureDatabase.shared().match_banner('imap', banner)
+
+            if family is not None:
+                self.set_result(TestResult.WARNING, "Default", family, "banner used")
                 return
             else:
                 self.set_result(TestResult.OK, "No default banners")
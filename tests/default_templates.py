@@ -1,4 +1,5 @@
 from .test import *
+from .signatures import SignatureDatabase
 from honeypots.honeypot import ScanFailure
 
 
@@ -8,6 +9,8 @@ class DefaultTemplateFileTest(Test):
     description = "Tests usage of default running templates"
     karma_value = 100
     doc_file = 'default_template.html'
+    required_services = [('iso-tsap', 'tcp'), ('s7-comm', 'tcp')]
+    nmap_scripts = ['s7-info.nse']
 
     def run(self):
         """Check if content matches any known content"""
@@ -28,21 +31,12 @@ class DefaultTemplateFileTest(Test):
 
             parsed = info.split('\n  ')[1:]
 
-            default1 = ['Version: 0.0', 'System Name: Technodrome',
-                        'Module Type: Siemens, SIMATIC, S7-200',
-                        'Serial Number: 88111222',
-                        'Plant Identification: Mouser Factory',
-                        'Copyright: Original Siemens Equipment']
+            match = SignatureDatabase.shared().match_template('s7-info', parsed)
 
-            matched = 0
-
-            for a, b in zip(parsed, default1):
-                if a == b:
-                    matched += 1
-
-            if matched > 0:
-                self.set_result(TestResult.WARNING, "Template used for s7-comm service matches default ",
-                                matched/len(default1)*100, "percent")
+            if match is not None:
+                family, matched, total = match
+                self.set_result(TestResult.WARNING, "Template used for s7-comm service matches default", family,
+                                "template", matched/total*100, "percent")
                 return
 
             self.set_result(TestResult.OK, "s7-comm service does not match any default configurations")
@@ -1,6 +1,6 @@
 from .test import *
 
-import socket
+from honeypots.honeypot import Probe
 
 
 class KippoErrorMessageBugTest(Test):
@@ -9,6 +9,7 @@ class KippoErrorMessageBugTest(Test):
     description = "Tests presence of an obsolte version of kippo"
     karma_value = 100
     doc_file = 'old_version_bugs.html'
+    required_services = [('ssh', 'tcp')]
 
     def run(self):
         """Check if content matches any known content"""
@@ -19,29 +20,27 @@ class KippoErrorMessageBugTest(Test):
             self.set_result(TestResult.NOT_APPLICABLE, "No open ports found!")
             return
 
-        for port in target_ports:
-
-            # Based on research conducted by Andrew Morris and all following sources
-            #
-            # https://www.obscurechannel.com/x42/magicknumber.html
-            # https://morris.sc/detecting-kippo-ssh-honeypots/
-            # https://www.rapid7.com/db/modules/auxiliary/scanner/ssh/detect_kippo
-            # https://kbyte.snowpenguin.org/portal/2013/04/30/kippo-protocol-mismatch-workaround/
-            # http://www.hackinsight.org/news,155.html
-
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.settimeout(5)
-
-            try:
-                s.connect((self.target_honeypot.ip, port))
-                banner = s.recv(1024)  # TODO use banner?
-                s.send(b'\n\n\n\n\n\n\n\n')
-                response = s.recv(1024)
-                s.close()
-            except socket.error:
+        # Based on research conducted by Andrew Morris and all following sources
+        #
+        # https://www.obscurechannel.com/x42/magicknumber.html
+        # https://morris.sc/detecting-kippo-ssh-honeypots/
+        # https://www.rapid7.com/db/modules/auxiliary/scanner/ssh/detect_kippo
+        # https://kbyte.snowpenguin.org/portal/2013/04/30/kippo-protocol-mismatch-workaround/
+        # http://www.hackinsight.org/news,155.html
+
+        probes = self.target_honeypot.probe([Probe(self.target_honeypot.ip, port, [b'\n\n\n\n\n\n\n\n'])
+                                             for port in target_ports])
+
+        for probe in probes:
+
+            # TODO use probe.banner?
+
+            if probe.error:
                 self.set_result(TestResult.UNKNOWN, "Can't communicate with ports")
                 return
 
+            response = probe.response
+
             if b'168430090' in response:
                 self.set_result(TestResult.WARNING, "Old unpatched version of Kippo detected,"
                                                     " please update to the latest version")
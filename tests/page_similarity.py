@@ -0,0 +1,257 @@
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+
+
+class PageIndex:
+    """
+    Fingerprints of the default websites of honeypot families, finds pages that are almost the same
+    (e.g. only a timestamp differs) instead of exact copies.
+
+    A page is split into normalized HTML tokens (tags and words, lower case, every number becomes 0),
+    runs of shingle_size consecutive tokens are its shingles. The fingerprint is a MinHash signature:
+    for each of the permutations the smallest hash of all shingles. Two pages share a signature value
+    with a probability equal to the Jaccard similarity of their shingle sets.
+
+    Signatures are split into bands, pages sharing all values of at least one band are the candidates
+    of a lookup (locality sensitive hashing), only those are compared. A lookup costs O(page length + candidates)
+    instead of O(known pages), pages about 60 percent similar or more are very likely to become candidates.
+
+    The fingerprints are kept in data/page_fingerprints.json:
+
+        {"seed": <seed>, "permutations": <count>, "bands": <count>, "shingle_size": <tokens>,
+         "pages": {"<family>": [<signature as hex>, ...]}}
+    """
+
+    source_file = os.path.join(os.path.dirname(__file__), 'data', 'page_fingerprints.json')
+
+    _token = re.compile(r'<[^>]*>|[^<\s]+')
+    _number = re.compile(r'\d+')
+    _prime = (1 << 61) - 1
+    _value_mask = (1 << 32) - 1
+
+    _shared = None  # loaded once and shared by all tests
+
+    def __init__(self, seed=1, permutations=64, bands=16, shingle_size=4):
+        """
+        :param seed: seed of the hash permutations, signatures are only comparable with the same seed
+        :param permutations: number of values in a signature
+        :param bands: number of LSH bands, must divide permutations,
+                      more bands find less similar pages at the cost of more candidates
+        :param shingle_size: number of tokens in a shingle
+        :raises: ValueError if bands does not divide permutations
+        """
+        if permutations % bands:
+            raise ValueError("Number of bands must divide the number of permutations")
+
+        self.seed = seed
+        self.permutations = permutations
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self._rows = permutations // bands
+
+        generator = random.Random(seed)
+        self._coefficients = [(generator.randrange(1, self._prime), generator.randrange(self._prime))
+                              for _ in range(permutations)]
+
+        self._families = []  # page number -> family
+        self._signatures = []  # page number -> signature
+        self._buckets = {}  # (band, values of the band) -> list of page numbers
+
+    @classmethod
+    def load(cls, path=None):
+        """
+        :param path: fingerprints in json format, defaults to data/page_fingerprints.json
+        :return: PageIndex object
+        :raises: OSError if the file can not be read, ValueError if it is not valid
+        """
+        with open(path or cls.source_file, 'rb') as f:
+            source = json.loads(f.read().decode('utf-8'))
+
+        index = cls(source['seed'], source['permutations'], source['bands'], source['shingle_size'])
+
+        for family, signatures in sorted(source['pages'].items()):
+            for signature in signatures:
+                index.add_signature(family, index.decode(signature))
+
+        return index
+
+    @classmethod
+    def shared(cls):
+        """
+        :return: PageIndex of data/page_fingerprints.json, loaded on first use
+        """
+        if cls._shared is None:
+            cls._shared = cls.load()
+
+        return cls._shared
+
+    def save(self, path=None):
+        """
+        :param path: destination file, defaults to data/page_fingerprints.json
+        """
+        pages = {}
+
+        for family, signature in zip(self._families, self._signatures):
+            pages.setdefault(family, []).append(self.encode(signature))
+
+        with open(path or self.source_file, 'w') as f:
+            json.dump({'seed': self.seed, 'permutations': self.permutations, 'bands': self.bands,
+                       'shingle_size': self.shingle_size, 'pages': pages}, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    def tokens(self, content):
+        """
+        :param content: html page as string, or as bytes if the server did not name a charset (decoded as utf-8)
+        :return: list of normalized tokens
+        """
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', errors='replace')
+
+        return [' '.join(self._number.sub('0', token.lower()).split()) for token in self._token.findall(content)]
+
+    def fingerprint(self, content):
+        """
+        :param content: html page as string or bytes
+        :return: MinHash signature as tuple of integers, None for an empty page
+        """
+        tokens = self.tokens(content)
+
+        if not tokens:
+            return None
+
+        size = min(self.shingle_size, len(tokens))  # short pages are compared token by token
+
+        shingles = {int.from_bytes(hashlib.blake2b('\0'.join(tokens[i:i + size]).encode('utf-8'),
+                                                   digest_size=8).digest(), 'little')
+                    for i in range(len(tokens) - size + 1)}
+
+        prime = self._prime
+
+        return tuple(min((a * shingle + b) % prime for shingle in shingles) & self._value_mask
+                     for a, b in self._coefficients)
+
+    def encode(self, signature):
+        """
+        :param signature: signature from fingerprint()
+        :return: signature as hex string
+        """
+        return ''.join('%08x' % value for value in signature)
+
+    def decode(self, signature):
+        """
+        :param signature: signature as hex string
+        :return: signature as tuple of integers
+        :raises: ValueError if it does not belong to this index
+        """
+        if len(signature) != 8 * self.permutations:
+            raise ValueError("Page signature has the wrong length")
+
+        return tuple(int(signature[i:i + 8], 16) for i in range(0, len(signature), 8))
+
+    def _band_keys(self, signature):
+        return [(band, signature[band * self._rows:(band + 1) * self._rows]) for band in range(self.bands)]
+
+    def add_signature(self, family, signature):
+        """
+        :param family: honeypot family the page belongs to
+        :param signature: signature from fingerprint()
+        """
+        number = len(self._signatures)
+
+        self._families.append(family)
+        self._signatures.append(signature)
+
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, []).append(number)
+
+    def add(self, family, content):
+        """
+        :param family: honeypot family the page belongs to
+        :param content: default html page of the family as string or bytes
+        :return: True if the page was added, False if it is empty
+        """
+        signature = self.fingerprint(content)
+
+        if signature is None:
+            return False
+
+        self.add_signature(family, signature)
+        return True
+
+    def query(self, signature):
+        """
+        :param signature: signature from fingerprint()
+        :return: dict of family -> estimated similarity (0 to 1) of its most similar page,
+                 families without a candidate page are left out
+        """
+        candidates = set()
+
+        for key in self._band_keys(signature):
+            candidates.update(self._buckets.get(key, ()))
+
+        similar = {}
+
+        for number in candidates:
+
+            family = self._families[number]
+            similarity = sum(a == b for a, b in zip(signature, self._signatures[number])) / self.permutations
+
+            if similarity > similar.get(family, 0):
+                similar[family] = similarity
+
+        return similar
+
+    def match(self, content):
+        """
+        :param content: html page as string or bytes
+        :return: tuple of (family, estimated similarity) of the most similar known page, None if there is none
+        """
+        signature = self.fingerprint(content)
+
+        if signature is None:
+            return None
+
+        similar = self.query(signature)
+
+        if not similar:
+            return None
+
+        family = max(sorted(similar), key=lambda f: similar[f])
+
+        return family, similar[family]
+
+    def __len__(self):
+        return len(self._signatures)
+
+
+def main(argv):
+    """
+    Adds default websites to the fingerprint library:
+    python -m tests.page_similarity <family> <html file> [<html file> ...]
+    """
+
+    if len(argv) < 3:
+        print("Usage: python -m tests.page_similarity <family> <html file> [<html file> ...]")
+        sys.exit(2)
+
+    index = PageIndex.load()
+
+    for path in argv[2:]:
+
+        with open(path, 'rb') as f:
+            content = f.read().decode('utf-8', errors='replace')
+
+        if index.add(argv[1], content):
+            print("Added", path, "to", argv[1])
+        else:
+            print("No content found in", path)
+
+    index.save()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
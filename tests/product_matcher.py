@@ -0,0 +1,119 @@
+from collections import deque
+
+
+# substrings of nmap product descriptions that tell something about the target, grouped by what they indicate
+default_indicators = {
+    'honeypot': ['honeypot'],
+    'windows-only': ['ms-sql', 'iis', 'windows', 'microsoft'],  # products that do not run on linux
+    'linux-only': [],  # products that do not run on windows
+}
+
+
+class ProductMatcher:
+    """
+    Finds indicator substrings in product descriptions (product, version and extra info reported by nmap).
+
+    All patterns are compiled into a single Aho-Corasick automaton, so a description is scanned once
+    no matter how many patterns there are. Matching is case insensitive.
+    """
+
+    _shared = None  # built once from default_indicators and shared by all tests
+
+    def __init__(self, indicators):
+        """
+        :param indicators: dict of indicator -> list of substrings that reveal it
+        """
+        self._goto = [{}]  # state -> {character -> next state}
+        self._fail = [0]  # state -> longest proper suffix that is also a state
+        self._output = [()]  # state -> tuple of (indicator, pattern) ending in this state
+
+        for indicator, patterns in indicators.items():
+            for pattern in patterns:
+                self._add(pattern.lower(), indicator)
+
+        self._link()
+
+    @classmethod
+    def shared(cls):
+        """
+        :return: ProductMatcher for default_indicators
+        """
+        if cls._shared is None:
+            cls._shared = cls(default_indicators)
+
+        return cls._shared
+
+    def _add(self, pattern, indicator):
+
+        state = 0
+
+        for char in pattern:
+
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+                self._goto[state][char] = len(self._goto) - 1
+
+            state = self._goto[state][char]
+
+        self._output[state] += ((indicator, pattern),)
+
+    def _link(self):
+        """Computes the failure links breadth first, every state inherits the output of its failure state"""
+
+        queue = deque(self._goto[0].values())
+
+        while queue:
+
+            state = queue.popleft()
+
+            for char, child in self._goto[state].items():
+
+                fail = self._fail[state]
+
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] += self._output[self._fail[child]]
+
+                queue.append(child)
+
+    def match(self, description):
+        """
+        :param description: product description
+        :return: dict of indicator -> set of patterns found in the description
+        """
+        found = {}
+        state = 0
+
+        for char in description.lower():
+
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+
+            state = self._goto[state].get(char, 0)
+
+            for indicator, pattern in self._output[state]:
+                found.setdefault(indicator, set()).add(pattern)
+
+        return found
+
+    def match_ports(self, descriptions):
+        """
+        :param descriptions: dict of description -> list of ports, see Honeypot.get_product_descriptions()
+        :return: dict of port -> (description, dict of indicator -> set of patterns),
+                 ports without any indicator are left out
+        """
+        hits = {}
+
+        for description, ports in descriptions.items():
+
+            found = self.match(description)
+
+            if found:
+                for port in ports:
+                    hits[port] = (description, found)
+
+        return hits
@@ -0,0 +1,195 @@
+import importlib
+
+from .test import Test
+
+try:
+    from importlib.metadata import entry_points
+except ImportError:  # Python < 3.8, no discovery of external tests
+    entry_points = None
+
+
+class TestSpec:
+    """
+    Metadata of a Test, known without importing the module that implements it.
+    The module is imported the first time the Test is actually needed.
+    """
+
+    def __init__(self, path, level, requires_os=False, required_services=None, nmap_scripts=(), cost=1):
+        """
+        :param path: location of the Test class as 'package.module:ClassName'
+        :param level: scanning level the Test belongs to (1/2/3)
+        :param requires_os: the Test needs OS information (-O)
+        :param required_services: list of (service, protocol) the Test inspects, None if it needs the full scan,
+                                  must match the attribute of the class
+        :param nmap_scripts: .nse scripts the Test needs, must match the attribute of the class
+        :param cost: relative run time, expensive tests are started first when tests run concurrently
+        """
+        self.path = path
+        self.level = level
+        self.requires_os = requires_os
+        self.required_services = required_services
+        self.nmap_scripts = list(nmap_scripts)
+        self.cost = cost
+        self._class = None
+
+    def load(self):
+        """
+        Imports the Test class
+
+        :return: Test subclass
+        :raises: ImportError if the module can not be imported,
+                 ValueError if the class does not exist or does not match its metadata
+        """
+        if self._class is not None:
+            return self._class
+
+        module_name, _, class_name = self.path.partition(':')
+        test_class = getattr(importlib.import_module(module_name), class_name, None)
+
+        if not (isinstance(test_class, type) and issubclass(test_class, Test)):
+            raise ValueError("No Test class found at " + self.path)
+
+        if (test_class.required_services != self.required_services or
+                list(test_class.nmap_scripts) != self.nmap_scripts):
+            raise ValueError("Registered metadata of " + self.path + " does not match the class")
+
+        self._class = test_class
+        return test_class
+
+    def create(self):
+        """
+        :return: new instance of the Test
+        """
+        test = self.load()()
+        test.cost = self.cost
+        return test
+
+    def __repr__(self):
+        return 'TestSpec(' + self.path + ', level ' + str(self.level) + ')'
+
+
+class TestRegistry:
+    """
+    List of all available Tests, in the order their results are shown.
+    Built-in tests are registered below, external packages register theirs through a function
+    published as an entry point in the 'checkpot.tests' group, e.g. in setup.py:
+
+        entry_points={'checkpot.tests': ['mytests = mytests.registration:register']}
+
+    The function is called with the TestRegistry and should only call register(),
+    so the tests themselves are not imported until they are used.
+    """
+
+    entry_point_group = 'checkpot.tests'
+
+    def __init__(self):
+        self._specs = []
+        self._paths = set()
+
+    def register(self, path, level, requires_os=False, required_services=None, nmap_scripts=(), cost=1):
+        """
+        Adds a Test to the registry, see TestSpec for the parameters
+
+        :return: TestSpec object
+        :raises: ValueError if the Test is already registered
+        """
+        if path in self._paths:
+            raise ValueError("Test " + path + " is already registered")
+
+        spec = TestSpec(path, level, requires_os, required_services, nmap_scripts, cost)
+
+        self._specs.append(spec)
+        self._paths.add(path)
+
+        return spec
+
+    def discover(self):
+        """
+        Registers the Tests of all installed packages that publish a 'checkpot.tests' entry point.
+        Packages that fail to register are reported and skipped.
+
+        :return: number of packages that registered tests
+        """
+        if entry_points is None:
+            return 0
+
+        found = entry_points()
+
+        if hasattr(found, 'select'):
+            found = found.select(group=self.entry_point_group)
+        else:
+            found = found.get(self.entry_point_group, [])
+
+        count = 0
+
+        for entry_point in found:
+            try:
+                entry_point.load()(self)
+                count += 1
+            except Exception as e:
+                print("Could not load tests from", entry_point.name + ":", e)
+
+        return count
+
+    def select(self, scan_level, scan_os=False):
+        """
+        :param scan_level: maximum scanning level
+        :param scan_os: OS information is available
+        :return: list of TestSpec objects that apply
+        """
+        return [spec for spec in self._specs
+                if spec.level <= scan_level and (scan_os or not spec.requires_os)]
+
+    def create_tests(self, scan_level, scan_os=False):
+        """
+        Imports and instantiates the Tests that apply
+
+        :param scan_level: maximum scanning level
+        :param scan_os: OS information is available
+        :return: list of Test objects
+        """
+        return [spec.create() for spec in self.select(scan_level, scan_os)]
+
+    def __len__(self):
+        return len(self._specs)
+
+
+def default_registry(discover=True):
+    """
+    :param discover: also register the Tests of installed external packages
+    :return: TestRegistry holding the built-in Tests
+    """
+    registry = TestRegistry()
+
+    # level 1, only looks at the scan results
+    registry.register('tests.direct_fingerprinting:DirectFingerprintTest', 1, cost=0)
+    registry.register('tests.direct_fingerprinting:OSServiceCombinationTest', 1, requires_os=True, cost=0)
+    registry.register('tests.direct_fingerprinting:DefaultServiceCombinationTest', 1, cost=0)
+    registry.register('tests.direct_fingerprinting:DuplicateServicesCheck', 1, cost=0)
+
+    # level 2, contacts the services
+    registry.register('tests.default_ftp:DefaultFTPBannerTest', 2, required_services=[('ftp', 'tcp')])
+
+    registry.register('tests.service_implementation:HTTPTest', 2, required_services=[('http', 'tcp')], cost=2)
+    registry.register('tests.default_http:DefaultWebsiteTest', 2, required_services=[('http', 'tcp')], cost=2)
+    registry.register('tests.default_http:DefaultGlastopfWebsiteTest', 2, required_services=[('http', 'tcp')],
+                      cost=2)
+    registry.register('tests.default_http:DefaultStylesheetTest', 2, required_services=[('http', 'tcp')], cost=2)
+    registry.register('tests.default_http:CertificateValidationTest', 2, cost=2)
+
+    registry.register('tests.default_imap:DefaultIMAPBannerTest', 2, required_services=[('imap', 'tcp')])
+
+    registry.register('tests.default_smtp:DefaultSMTPBannerTest', 2, required_services=[('smtp', 'tcp')])
+    registry.register('tests.service_implementation:SMTPTest', 2, required_services=[('smtp', 'tcp')], cost=2)
+
+    registry.register('tests.default_telnet:DefaultTelnetBannerTest', 2, required_services=[('telnet', 'tcp')])
+    registry.register('tests.old_version_bugs:KippoErrorMessageBugTest', 2, required_services=[('ssh', 'tcp')],
+                      cost=2)
+
+    registry.register('tests.default_templates:DefaultTemplateFileTest', 2,
+                      required_services=[('iso-tsap', 'tcp'), ('s7-comm', 'tcp')], nmap_scripts=['s7-info.nse'])
+
+    if discover:
+        registry.discover()
+
+    return registry
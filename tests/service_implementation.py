@@ -1,8 +1,6 @@
-import socket
-
 from .test import *
 
-import http
+from honeypots.honeypot import Probe, ScanFailure
 
 
 class SMTPTest(Test):
@@ -12,6 +10,8 @@ class SMTPTest(Test):
     description = "Tests SMTP service implementation"
     karma_value = 60
     doc_file = 'implementation.html'
+    required_services = [('smtp', 'tcp')]
+    resources = ['smtp greeting']
 
     def run(self):
         """Verify service implements all methods in the SMTP specification"""
@@ -19,28 +19,29 @@ class SMTPTest(Test):
         target_ports = self.target_honeypot.get_service_ports('smtp', 'tcp')
 
         if target_ports:
+            # the greeting is shared with the banner tests through the banner cache,
+            # smtp servers may delay it on purpose so wait longer than usual
+            banners = self.target_honeypot.get_banners(target_ports, protocol='tcp',
+                                                       timeout=2 * self.target_honeypot.probe_timeout)
+
             for port in target_ports:
-                self.check_smtp_implemented(self.target_honeypot.ip, port)
+                self.check_smtp_implemented(banners[port])
 
                 if self.result == TestResult.WARNING:
                     return
         else:
             self.set_result(TestResult.NOT_APPLICABLE, "Service not present")
 
-    def check_smtp_implemented(self, server_address, port=25):
-
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.settimeout(10)
+    def check_smtp_implemented(self, banner):
+        """
+        :param banner: greeting of the smtp server or ScanFailure if it could not be read
+        """
 
-        try:
-            s.connect((server_address, port))
-        except socket.error as exception:
-            self.set_result(TestResult.WARNING, "failed to connect to smtp server: ", exception.strerror)
+        if isinstance(banner, ScanFailure):
+            self.set_result(TestResult.WARNING, "failed to connect to smtp server: ", banner)
             return
 
-        recv = s.recv(1024)
-
-        if recv[:3] != b'220':
+        if banner[:3] != b'220':
             self.set_result(TestResult.WARNING, "220 response not received from smtp server")
             return
         else:
@@ -55,6 +56,7 @@ class HTTPTest(Test):
     description = "Tests HTTP service implementation"
     karma_value = 60
     doc_file = 'implementation.html'
+    required_services = [('http', 'tcp')]
 
     def run(self):
         """Verify service implements all methods in the HTTP specification"""
@@ -62,51 +64,54 @@ class HTTPTest(Test):
         target_ports = self.target_honeypot.get_service_ports('http', 'tcp')
 
         if target_ports:
-            for port in target_ports:
-                if port != 443:  # TODO separate https when nmap parses incorrectly
-                    self.check_http_implemented(self.target_honeypot.ip, port)
+            # TODO separate https when nmap parses incorrectly
+            target_ports = [port for port in target_ports if port != 443]
 
-                    if self.result == TestResult.WARNING:
-                        return
+            if target_ports:
+                self.check_http_implemented(self.target_honeypot.ip, target_ports)
         else:
             self.set_result(TestResult.NOT_APPLICABLE, "Service not present")
 
-    def check_http_implemented(self, server_address, port=80):
+    def check_http_implemented(self, server_address, ports):
+        """
+        :param server_address: ip address of the web server
+        :param ports: list of http ports, all of them are checked at the same time
+        """
 
-        # try a simple http.client request first
+        # try a simple HEAD request first
 
-        try:
+        head = 'HEAD / HTTP/1.1\r\nHost: ' + server_address + '\r\nConnection: close\r\n\r\n'
 
-            conn = http.client.HTTPConnection(server_address, port=port, timeout=5)
-            conn.request('HEAD', '/')
-            conn.getresponse()
+        probes = self.target_honeypot.probe([Probe(server_address, port, [head.encode()], read_banner=False)
+                                             for port in ports])
 
-            self.set_result(TestResult.OK, "HTTP implemented")
+        # as a fallback measure run a manual test on the ports that did not answer correctly
+        # TODO extend this
 
-        except Exception as e:
-            # as a fallback measure run a manual test
-            # TODO extend this
+        fallback = [Probe(server_address, probe.port, [b'GET / HTTP/1.1\r\n\r\n'], read_banner=False,
+                          timeout=2 * self.target_honeypot.probe_timeout)
+                    for probe in probes if probe.error or not (probe.response or b'').startswith(b'HTTP/')]
 
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.settimeout(10)
+        fallback = {probe.port: probe for probe in self.target_honeypot.probe(fallback)}
 
-            try:
-                s.connect((server_address, port))
-            except socket.error as exception:
-                self.set_result(TestResult.WARNING, "failed to connect to http server: ", exception.strerror)
-                return
+        for port in ports:
+
+            if port not in fallback:
+                self.set_result(TestResult.OK, "HTTP implemented")
+                continue
+
+            probe = fallback[port]
 
-            try:
-                s.sendall(b'GET / HTTP/1.1\r\n\r\n')  # s.sendall(b'HEAD / HTTP/1.1\r\n\r\n')
-            except socket.error as exception:
-                self.set_result(TestResult.WARNING, "sending GET request to http server failed: ", exception.strerror)
+            if not probe.connected:
+                self.set_result(TestResult.WARNING, "failed to connect to http server: ", probe.error)
                 return
 
-            recv = s.recv(4096)
+            if probe.error and not probe.responses:
+                self.set_result(TestResult.WARNING, "sending GET request to http server failed: ", probe.error)
+                return
 
-            if recv[:15] == b'HTTP/1.1 200 OK':
+            if probe.response[:15] == b'HTTP/1.1 200 OK':
                 self.set_result(TestResult.OK, "http service responded with 200/OK")
-                return
             else:
-                self.set_result(TestResult.WARNING, "http service responded with unknown sequence: ", recv)
+                self.set_result(TestResult.WARNING, "http service responded with unknown sequence: ", probe.response)
                 return
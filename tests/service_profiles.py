@@ -0,0 +1,180 @@
+import json
+import math
+import os
+import sys
+import time
+from collections import namedtuple
+
+
+# similarity between the open ports of a target and a profile, all values are between 0 and 1:
+# jaccard: shared ports / ports open on either of them
+# profile_in_target: share of the profile found open on the target
+# target_in_profile: share of the target ports that belong to the profile
+ProfileScore = namedtuple('ProfileScore', ['jaccard', 'profile_in_target', 'target_in_profile'])
+
+
+class ProfileIndex:
+    """
+    Default port configurations (profiles) of known honeypots, kept in data/service_profiles.json
+    as {"<honeypot>": [<port>, ...]}.
+
+    The shipped file holds the hand-written profiles of amun, artillery, dionaea and honeypy that were
+    used by DefaultServiceCombinationTest before, nothing has been mined into it yet. Mining the other
+    containers needs Docker, see main().
+
+    A port -> profiles inverted index is built once, scoring a target only visits the profiles sharing
+    at least one port with it, so it stays fast as the library grows to thousands of profiles.
+    Ports can be weighted by rarity: a port open in few profiles (e.g. 27347) says more about the target
+    than one open in most of them (e.g. 80).
+    """
+
+    source_file = os.path.join(os.path.dirname(__file__), 'data', 'service_profiles.json')
+
+    _shared = None  # loaded once and shared by all tests
+
+    def __init__(self, profiles, weighted=True):
+        """
+        :param profiles: dict of profile name -> list of port numbers
+        :param weighted: weigh every port by log(1 + profiles / profiles containing the port),
+                         otherwise all ports count the same
+        """
+        self.names = sorted(profiles)
+        self._index = {}  # port -> list of profile numbers
+
+        for number, name in enumerate(self.names):
+            for port in set(profiles[name]):
+                self._index.setdefault(port, []).append(number)
+
+        count = len(self.names)
+
+        if weighted:
+            self._weights = {port: math.log(1 + count / len(numbers)) for port, numbers in self._index.items()}
+            self._unknown_weight = math.log(1 + count)  # ports found in no profile are the rarest
+        else:
+            self._weights = dict.fromkeys(self._index, 1.0)
+            self._unknown_weight = 1.0
+
+        self._sizes = [sum(self._weights[port] for port in set(profiles[name])) for name in self.names]
+
+    @classmethod
+    def load(cls, path=None, weighted=True):
+        """
+        :param path: profiles in json format, defaults to data/service_profiles.json
+        :param weighted: see __init__()
+        :return: ProfileIndex object
+        :raises: OSError if the file can not be read, ValueError if it is not valid
+        """
+        with open(path or cls.source_file, 'rb') as f:
+            return cls(json.loads(f.read().decode('utf-8')), weighted)
+
+    @classmethod
+    def shared(cls):
+        """
+        :return: weighted ProfileIndex of data/service_profiles.json, loaded on first use
+        """
+        if cls._shared is None:
+            cls._shared = cls.load()
+
+        return cls._shared
+
+    def weight(self, port):
+        """
+        :param port: port number
+        :return: weight of the port in all scores
+        """
+        return self._weights.get(port, self._unknown_weight)
+
+    def score(self, ports):
+        """
+        Compares the open ports of a target with all profiles
+
+        :param ports: list of open port numbers
+        :return: dict of profile name -> ProfileScore, profiles sharing no port with the target are left out
+        """
+        ports = set(ports)
+        shared = {}  # profile number -> weight of the shared ports
+
+        for port in ports:
+            for number in self._index.get(port, ()):
+                shared[number] = shared.get(number, 0) + self._weights[port]
+
+        target_size = sum(self.weight(port) for port in ports)
+        scores = {}
+
+        for number, common in shared.items():
+            profile_size = self._sizes[number]
+            scores[self.names[number]] = ProfileScore(common / (profile_size + target_size - common),
+                                                      common / profile_size, common / target_size)
+
+        return scores
+
+    def __len__(self):
+        return len(self.names)
+
+
+def mine(names, port_range='-', startup_time=10):
+    """
+    Builds profiles from the honeypot containers (see containers/): every container is started,
+    scanned and stopped again, its open TCP ports become its profile
+
+    :param names: container names
+    :param port_range: ports to scan
+    :param startup_time: seconds the services of a container get to start before the scan
+    :return: dict of container name -> list of open ports
+    """
+    # only mining needs Docker and a scanner
+    from containers.manager import Manager
+    from honeypots.honeypot import Honeypot
+
+    manager = Manager(verbose=True, build_info=False)
+    profiles = {}
+
+    for name in names:
+
+        manager.start_honeypot(name)
+
+        try:
+            time.sleep(startup_time)  # TODO wait for container to start, catch some sort of signal
+
+            hp = Honeypot(manager.get_honeypot_ip(name), verbose_scan=False)
+            hp.scan(port_range=port_range)
+
+            profiles[name] = sorted(hp.get_all_ports('tcp'))
+        finally:
+            manager.stop_honeypot(name)
+
+    return profiles
+
+
+def main(argv):
+    """
+    Mines profiles from the honeypot containers and adds them to the profile library:
+    python -m tests.service_profiles [<container> ...] (all containers if none is given)
+
+    Needs Docker, the containers (see containers/build_all.py) and nmap. Review the mined ports
+    before committing data/service_profiles.json, a profile should only hold the default configuration.
+    """
+
+    from containers.manager import Manager
+
+    names = argv[1:] or sorted(Manager.get_available_honeypots())
+
+    with open(ProfileIndex.source_file) as f:
+        profiles = json.load(f)
+
+    for name, ports in mine(names).items():
+
+        if not ports:
+            print("No open ports found for", name + ", profile not changed")
+            continue
+
+        profiles[name] = ports
+        print(name, "->", len(ports), "ports")
+
+    with open(ProfileIndex.source_file, 'w') as f:
+        f.write('{\n' + ',\n'.join('  ' + json.dumps(name) + ': ' + json.dumps(profiles[name])
+                                   for name in sorted(profiles)) + '\n}\n')
+
+
+if __name__ == '__main__':
+    main(sys.argv)
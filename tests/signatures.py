@@ -0,0 +1,223 @@
+import hashlib
+import json
+import marshal
+import os
+import tempfile
+
+
+class SignatureDatabase:
+    """
+    Known banners, content hashes and configuration templates of honeypot families.
+
+    The signatures are kept per family in data/signatures.json:
+
+        {"<family>": {"banners": {"<service>": [<banner>, ...]},
+                      "banner_prefixes": {"<service>": [<beginning of a banner>, ...]},
+                      "hashes": {"<kind>": [<sha256 hex digest>, ...]},
+                      "templates": {"<template>": [<field>, ...]}}}
+
+    Banners are strings holding one character per byte (latin-1), hash kinds are 'website' and 'stylesheet'.
+    The file is compiled into hash maps and a prefix trie per service, lookups cost O(1) or O(banner length)
+    regardless of the number of signatures. The compiled form is cached in a binary file and rebuilt
+    whenever the source changes.
+    """
+
+    magic = b'CPSIG1'
+    source_file = os.path.join(os.path.dirname(__file__), 'data', 'signatures.json')
+    cache_file = os.path.join(os.path.expanduser('~'), '.cache', 'checkpot', 'signatures.db')
+
+    _end = -1  # trie key marking the end of a prefix, the other keys are byte values
+
+    _shared = None  # loaded once and shared by all tests
+
+    def __init__(self, banners, prefixes, hashes, templates, template_sizes):
+        """
+        :param banners: dict of (service, banner) -> family
+        :param prefixes: dict of service -> prefix trie (nested dicts of byte -> node, _end -> family)
+        :param hashes: dict of (kind, hex digest) -> family
+        :param templates: dict of (template, position, field) -> list of families
+        :param template_sizes: dict of (template, family) -> number of fields
+        """
+        self._banners = banners
+        self._prefixes = prefixes
+        self._hashes = hashes
+        self._templates = templates
+        self._template_sizes = template_sizes
+
+    @classmethod
+    def compile(cls, source):
+        """
+        Builds the lookup structures
+
+        :param source: dict in the format of data/signatures.json
+        :return: SignatureDatabase object
+        :raises: ValueError if a signature is claimed by two families
+        """
+        banners = {}
+        prefixes = {}
+        hashes = {}
+        templates = {}
+        template_sizes = {}
+
+        def claim(table, key, family):
+            if table.get(key, family) != family:
+                raise ValueError("Signature " + repr(key) + " belongs to " + table[key] + " and " + family)
+            table[key] = family
+
+        for family, signatures in sorted(source.items()):
+
+            for service, values in signatures.get('banners', {}).items():
+                for banner in values:
+                    claim(banners, (service, banner.encode('latin-1')), family)
+
+            for service, values in signatures.get('banner_prefixes', {}).items():
+                for prefix in values:
+                    node = prefixes.setdefault(service, {})
+
+                    for byte in prefix.encode('latin-1'):
+                        node = node.setdefault(byte, {})
+
+                    claim(node, cls._end, family)
+
+            for kind, values in signatures.get('hashes', {}).items():
+                for digest in values:
+                    claim(hashes, (kind, digest.lower()), family)
+
+            for template, fields in signatures.get('templates', {}).items():
+                for position, field in enumerate(fields):
+                    templates.setdefault((template, position, field), []).append(family)
+
+                template_sizes[(template, family)] = len(fields)
+
+        return cls(banners, prefixes, hashes, templates, template_sizes)
+
+    @classmethod
+    def load(cls, source_file=None, cache_file=None):
+        """
+        Loads the compiled signatures from the cache, compiles the source instead if the cache
+        is missing or out of date and saves the result for the next runs
+
+        :param source_file: signatures in json format, defaults to data/signatures.json
+        :param cache_file: compiled signatures, defaults to ~/.cache/checkpot/signatures.db
+        :return: SignatureDatabase object
+        :raises: OSError if the source can not be read, ValueError if it is not valid
+        """
+        source_file = source_file or cls.source_file
+        cache_file = cache_file or cls.cache_file
+
+        with open(source_file, 'rb') as f:
+            source = f.read()
+
+        digest = hashlib.sha256(source).digest()
+
+        try:
+            with open(cache_file, 'rb') as f:
+                data = f.read()
+
+            if data[:len(cls.magic)] == cls.magic and data[len(cls.magic):len(cls.magic) + 32] == digest:
+                return cls(*marshal.loads(data[len(cls.magic) + 32:]))
+        except (OSError, ValueError, EOFError, TypeError):
+            pass  # compile it again
+
+        database = cls.compile(json.loads(source.decode('utf-8')))
+
+        try:
+            database.save(cache_file, digest)
+        except OSError:
+            pass  # read only home folder, compile it again next time
+
+        return database
+
+    @classmethod
+    def shared(cls):
+        """
+        :return: the SignatureDatabase used by the tests, loaded on first use
+        """
+        if cls._shared is None:
+            cls._shared = cls.load()
+
+        return cls._shared
+
+    def save(self, path, digest):
+        """
+        :param path: destination file
+        :param digest: sha256 digest of the source, the cache is only used while it matches
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # written next to the destination first so a concurrent run never reads half a file
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.part', delete=False) as f:
+            f.write(self.magic + digest)
+            f.write(marshal.dumps((self._banners, self._prefixes, self._hashes, self._templates,
+                                   self._template_sizes)))
+
+        os.replace(f.name, path)
+
+    def match_banner(self, service, banner):
+        """
+        Looks for a known banner, exact matches first, then the longest known prefix
+
+        :param service: service name (e.g. 'ftp')
+        :param banner: banner as bytes
+        :return: honeypot family or None
+        """
+        family = self._banners.get((service, banner))
+
+        if family is not None:
+            return family
+
+        node = self._prefixes.get(service)
+
+        for byte in banner:
+
+            if node is None:
+                break
+
+            family = node.get(self._end, family)
+            node = node.get(byte)
+        else:
+            if node is not None:
+                family = node.get(self._end, family)
+
+        return family
+
+    def match_hash(self, kind, content):
+        """
+        :param kind: kind of content (e.g. 'website')
+        :param content: content as bytes or string (hashed as utf-8)
+        :return: honeypot family whose default content has the same sha256 digest or None
+        """
+        if not isinstance(content, bytes):
+            content = content.encode()
+
+        return self._hashes.get((kind, hashlib.sha256(content).hexdigest()))
+
+    def match_template(self, template, fields):
+        """
+        Compares configuration fields with the default templates, field by field
+
+        :param template: template name (e.g. 's7-info')
+        :param fields: list of fields in the order of the template
+        :return: tuple of (family, matched fields, template fields) for the family whose template is matched best
+                 (largest share of its fields, then most fields), None if no field matched
+        """
+        matched = {}
+
+        for position, field in enumerate(fields):
+            for family in self._templates.get((template, position, field), ()):
+                matched[family] = matched.get(family, 0) + 1
+
+        if not matched:
+            return None
+
+        family = max(sorted(matched), key=lambda f: (matched[f] / self._template_sizes[(template, f)], matched[f]))
+
+        return family, matched[family], self._template_sizes[(template, family)]
+
+    def __len__(self):
+
+        def trie_size(node):
+            return sum(trie_size(child) if key != self._end else 1 for key, child in node.items())
+
+        return (len(self._banners) + len(self._hashes) + len(self._template_sizes) +
+                sum(trie_size(trie) for trie in self._prefixes.values()))
@@ -1,8 +1,14 @@
+import threading
+from contextlib import contextmanager
 from enum import Enum
 
 from honeypots.honeypot import Honeypot
 
 
+_bound_run = threading.local()  # (test, run token) the calling thread submits results for, see Test.running()
+_results_lock = threading.RLock()  # a result is checked against the current run and stored in one step
+
+
 class TestResult(Enum):
     """Lists all possible results for a test"""
 
@@ -27,9 +33,16 @@ class Test:
     description = default_description
     name = default_name
     karma_value = default_karma  # number of karma points this test is worth
+    nmap_scripts = []  # .nse scripts this test needs, they are executed during the initial scan
+    required_services = None  # list of (service, protocol) this test inspects, None if it needs the full scan
+    time_budget = None  # seconds this test may run, None for the budget given to the TestPlatform
+    depends_on = []  # Test classes that have to finish before this test starts (when tests run concurrently)
+    resources = []  # names of resources this test can not share with other running tests (e.g. 'websites')
+    cost = 1  # relative run time, expensive tests are started first when tests run concurrently
     __report = default_report
     __result = TestResult.UNKNOWN
     __karma = 0  # final karma determined automatically after the test has submitted its results
+    __run = None  # token of the current run, None after the test was cancelled (results are ignored then)
 
     def __init__(self, target_honeypot=None):
         """
@@ -81,19 +94,63 @@ class Test:
         """
         assert isinstance(result, TestResult)
 
-        self.__result = result
-        self.__report = " ".join(str(r) for r in report)
+        with _results_lock:
+            if self.__run is None:
+                return
+
+            bound = getattr(_bound_run, 'run', None)
+
+            if bound is not None and bound[0] is self and bound[1] is not self.__run:
+                return  # submitted by an earlier run of this test that is still going on
+
+            self.__result = result
+            self.__report = " ".join(str(r) for r in report)
 
-        if result ==  TestResult.OK:
-            self.__karma = self.karma_value
-        if result == TestResult.WARNING:
-            self.__karma = -self.karma_value
-        elif result == TestResult.UNKNOWN or result == TestResult.NOT_APPLICABLE:
-            self.__karma = 0
+            if result ==  TestResult.OK:
+                self.__karma = self.karma_value
+            if result == TestResult.WARNING:
+                self.__karma = -self.karma_value
+            elif result == TestResult.UNKNOWN or result == TestResult.NOT_APPLICABLE:
+                self.__karma = 0
+
+    def cancel(self, *report):
+        """
+        Reports the test as UNKNOWN and ignores all results it submits afterwards
+        (e.g. when it ran out of time and is left to finish in the background)
+
+        :param report: reason for the cancellation
+        """
+        with _results_lock:
+            self.set_result(TestResult.UNKNOWN, *report)
+            self.__run = None
+
+    def running(self):
+        """
+        Binds a thread to the current run of the test, enter the returned context in the thread that runs the test.
+        Results the thread submits after the test was reset or cancelled are ignored,
+        so a run that is still finishing in the background can not overwrite the result of a later run.
+
+        :return: context manager
+        """
+        return _bind_run(self, self.__run)
 
     def reset(self):
         """
         Resets the result and report of the test to defaults so it can be run again
         """
-        self.__result = TestResult.UNKNOWN
-        self.__report = self.default_report
+        with _results_lock:
+            self.__run = object()
+            self.__result = TestResult.UNKNOWN
+            self.__report = self.default_report
+
+
+@contextmanager
+def _bind_run(test, run):
+    """Context manager returned by Test.running()"""
+
+    _bound_run.run = (test, run)
+
+    try:
+        yield
+    finally:
+        _bound_run.run = None
@@ -1,6 +1,10 @@
 from .test import Test, TestResult
 from honeypots.honeypot import Honeypot
 from termcolor import colored, cprint
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import threading
+import queue
+import time
 
 
 class TestPlatform:
@@ -19,35 +23,299 @@ class TestPlatform:
         self.test_list = test_list
         self.__results = []
         self.target_honeypot = target_honeypot
+        self._resource_locks = {}  # resource name -> Lock held by the test using it
 
-    def run_tests(self, verbose=False, brief=False):
+    def run_tests(self, verbose=False, brief=False, time_limit=None, test_time_limit=None, workers=1):
         """
         Runs the list of tests on the target Honeypot
 
         :param verbose: print results of each test
         :param brief: disable output for N/A tests
+        :param time_limit: seconds available for all tests, the ones that do not fit are reported as UNKNOWN
+        :param test_time_limit: seconds available for each test (unless the test sets its own time_budget),
+                                a test that runs longer is cancelled and reported as UNKNOWN
+        :param workers: number of tests run at the same time, results are printed and stored in the order
+                        of the test list regardless
         """
+        deadline = time.monotonic() + time_limit if time_limit is not None else None
+
         if verbose:
             self.print_header()
 
-        for test in self.test_list:
+        def done(test):
+            if verbose and not (brief and test.result == TestResult.NOT_APPLICABLE):
+                self.print_results(test.result, test.name, test.karma, test.report, test.doc_link)
 
-            test.target_honeypot = self.target_honeypot
+        self._run_all(self.test_list, deadline, test_time_limit, workers, done)
 
-            test.run()
+        self.__results = [(test.name, test.report, test.result, test.karma) for test in self.test_list]
 
-            if verbose:
+        if verbose:
+            self.print_stats()
 
-                if brief and test.result == TestResult.NOT_APPLICABLE:
-                    continue
+    def run_tests_during_scan(self, scan, verbose=False, brief=False, time_limit=None, test_time_limit=None,
+                              workers=1):
+        """
+        Runs the list of tests while the target Honeypot is being scanned.
+        Tests that declare their required_services (and do not depend on other tests) start as soon as the scan
+        reports a matching port, the other tests run after the scan is done. A test that started early is run
+        again at the end if more matching ports were reported after it started.
+        Results are printed in the order of the test list once all tests are done.
 
-                self.print_results(test.result, test.name, test.karma, test.report, test.doc_link)
+        :param scan: function that scans the target Honeypot, called with the on_port callback for Honeypot.scan()
+        :param verbose: print results of each test
+        :param brief: disable output for N/A tests
+        :param time_limit: seconds available for the scan and all tests, see run_tests()
+        :param test_time_limit: seconds available for each test, see run_tests()
+        :param workers: number of tests run at the same time, see run_tests()
+        :raises: whatever scan raises, tests still waiting for the scan are not run in that case
+        """
+        deadline = time.monotonic() + time_limit if time_limit is not None else None
+        waiting = [test for test in self.test_list if test.required_services and not test.depends_on]
+        ready = queue.Queue()
+        started = {}  # test -> matching ports when the test started
+        failed = []  # tests that raised an exception in the background
+
+        def on_port(host, protocol, port, port_record):
+            for test in list(waiting):
+                if (port_record.name, protocol) in test.required_services:
+                    waiting.remove(test)
+                    ready.put(test)
+
+        def worker():
+            while True:
+                test = ready.get()
+
+                if test is None:
+                    return
+
+                started[test] = self._matching_ports(test)
+
+                try:
+                    self._run_exclusive(test, deadline, test_time_limit)
+                except Exception:
+                    failed.append(test)
+
+        threads = [threading.Thread(target=worker) for _ in range(max(1, workers))]
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            scan(on_port)
+        finally:
+            for thread in threads:
+                ready.put(None)
+
+            for thread in threads:
+                thread.join()
+
+        # tests that need the full scan, found no matching port or have to be run again
+        remaining = [test for test in self.test_list
+                     if test not in started or test in failed or started[test] != self._matching_ports(test)]
+
+        self._run_all(remaining, deadline, test_time_limit, workers)
 
         self.__results = [(test.name, test.report, test.result, test.karma) for test in self.test_list]
 
         if verbose:
+            self.print_header()
+
+            for test in self.test_list:
+
+                if brief and test.result == TestResult.NOT_APPLICABLE:
+                    continue
+
+                self.print_results(test.result, test.name, test.karma, test.report, test.doc_link)
+
             self.print_stats()
 
+    def _run_all(self, tests, deadline=None, time_limit=None, workers=1, done=None):
+        """
+        Runs a list of tests on up to workers threads.
+        Tests start in the order of the list (the most expensive ones first if there are several workers),
+        except that a test waits for the tests it depends_on and for running tests that use one of its resources.
+
+        :param tests: list of Test objects
+        :param deadline: time.monotonic() value by which all tests have to be done, None for no limit
+        :param time_limit: seconds available for each test, see _run_test()
+        :param workers: maximum number of tests running at the same time
+        :param done: optional function called with each test in the order of the list,
+                     as soon as the test and all tests before it are done
+        :raises: whatever the tests raise, ValueError if the tests depend on each other in a circle
+        """
+        pending = list(tests)
+
+        if workers > 1:
+            # the longest tests should not be the last ones to start
+            pending.sort(key=lambda test: -test.cost)
+
+        running = {}  # future -> test
+        finished = set()
+        reported = 0
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+
+            while pending or running:
+
+                for test in list(pending):
+
+                    if len(running) >= workers:
+                        break
+
+                    if self._can_start(test, pending, running.values()):
+                        pending.remove(test)
+                        running[executor.submit(self._run_exclusive, test, deadline, time_limit)] = test
+
+                if not running:
+                    raise ValueError("Circular dependencies between tests: " + ", ".join(t.name for t in pending))
+
+                complete, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in complete:
+                    finished.add(running.pop(future))
+                    future.result()
+
+                while reported < len(tests) and tests[reported] in finished:
+
+                    if done is not None:
+                        done(tests[reported])
+
+                    reported += 1
+
+    @staticmethod
+    def _can_start(test, pending, running):
+        """
+        :param test: Test object waiting to run
+        :param pending: tests that did not start yet
+        :param running: tests that are running
+        :return: True if none of the tests it depends on is left and none of its resources is in use
+        """
+        dependencies = tuple(test.depends_on)
+
+        if any(isinstance(other, dependencies) for other in pending if other is not test):
+            return False
+
+        if any(isinstance(other, dependencies) for other in running):
+            return False
+
+        return not any(set(test.resources) & set(other.resources) for other in running)
+
+    def _run_exclusive(self, test, deadline=None, time_limit=None):
+        """
+        Runs a test while holding the locks of its resources, so no other test uses them at the same time.
+        A test that was cancelled keeps the locks until it actually stopped, the next test that needs them
+        waits for them within its own time budget.
+
+        :param test: Test object
+        :param deadline: time.monotonic() value by which all tests have to be done, None for no limit
+        :param time_limit: seconds available for the test if it does not define its own time_budget
+        :raises: whatever the test raises
+        """
+        start = time.monotonic()
+
+        test.target_honeypot = self.target_honeypot
+
+        budget = test.time_budget if test.time_budget is not None else time_limit
+
+        if deadline is not None:
+            left = deadline - start
+
+            if left <= 0:
+                test.cancel("Test not run, the time limit of the run was reached")
+                return
+
+            budget = left if budget is None else min(budget, left)
+
+        # always lock in the same order so two tests can not wait for each other
+        locks = [self._resource_locks.setdefault(resource, threading.Lock())
+                 for resource in sorted(set(test.resources))]
+        acquired = []
+
+        for lock in locks:
+            if not lock.acquire(timeout=-1 if budget is None else max(0, start + budget - time.monotonic())):
+                break
+
+            acquired.append(lock)
+
+        if len(acquired) < len(locks):
+            self._release(acquired)
+            test.cancel("Test not run, a cancelled test using the same resources did not stop in time")
+            return
+
+        worker = None
+
+        try:
+            worker = self._run_test(test, None if budget is None else start + budget - time.monotonic())
+        finally:
+            if worker is None:
+                self._release(acquired)
+            else:
+                # the cancelled test is still running, the locks are handed back once it stops
+                threading.Thread(target=self._release, args=(acquired, worker), daemon=True).start()
+
+    @staticmethod
+    def _release(locks, worker=None):
+        """
+        :param locks: locks to release in reverse order
+        :param worker: thread to wait for before the locks are released
+        """
+        if worker is not None:
+            worker.join()
+
+        for lock in reversed(locks):
+            lock.release()
+
+    def _run_test(self, test, budget=None):
+        """
+        Runs a test within its time budget. A test that runs out of time is cancelled: it is reported as UNKNOWN
+        and left to finish in the background, its network timeouts are cut short so that happens soon.
+        Results it submits afterwards are ignored, even if the test is run again in the meantime.
+
+        :param test: Test object, its target_honeypot has to be set
+        :param budget: seconds available for the test, None for no limit
+        :return: the thread of a cancelled test that is still running, otherwise None
+        :raises: whatever the test raises
+        """
+        if budget is None:
+            test.run()
+            return None
+
+        if budget <= 0:
+            test.cancel("Test not run, no time left after waiting for its resources")
+            return None
+
+        errors = []
+        binding = test.running()
+
+        def run():
+            with self.target_honeypot.deadline(budget), binding:
+                try:
+                    test.run()
+                except Exception as e:
+                    errors.append(e)
+
+        thread = threading.Thread(target=run, name=test.name, daemon=True)
+        thread.start()
+        thread.join(budget)
+
+        if thread.is_alive():
+            test.cancel("Test timed out after", round(budget, 2), "seconds")
+            return thread
+
+        if errors:
+            raise errors[0]
+
+        return None
+
+    def _matching_ports(self, test):
+        """
+        :return: set of (service, protocol, port) matching the required_services of a test
+        """
+        return {(service, protocol, port)
+                for service, protocol in test.required_services
+                for port in self.target_honeypot.get_service_ports(service, protocol)}
+
     @property
     def results(self):
         """